@@ -1,14 +1,90 @@
+import hashlib
+import importlib
+import json
 import logging
 import os
+import re
+import shlex
+import shutil
 import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-import boto3
-
-import importlib
-from interfaces.helper import SSM_ARG_PARAMS
-lambda_interface = importlib.import_module('interfaces.lambda')
-cli_interface    = importlib.import_module('interfaces.cli')
+if __name__ == '__main__':
+	# Parse the CLI options before loading the dependencies below: the CLI imports this module (as app) once parsed,
+	# so help and invalid options do not wait for them
+	from interfaces.cli import cli_handler
+	cli_handler()
+	sys.exit()
+
+import psycopg2
+
+import metrics
+import progress
+from interfaces.helper import SSM_ARG_PARAMS, SSM_OPTIONAL_ARG_PARAMS, SSM_OPTIONAL_RESTORE_ARG_PARAMS
+from aws_clients import DEFAULT_MAX_POOL_CONNECTIONS, get_boto3_client, get_transfer_config
+from catalog import (add_catalog_entry, find_catalog_entry, get_catalog_key, load_catalog, rebuild_catalog, remove_catalog,
+                     update_catalog)
+from chunk_store import (CHUNK_LEASE_PREFIX, CHUNK_MAX_SIZE, CHUNK_READ_SIZE, CHUNK_STORE_PREFIX, RECIPE_SUFFIX, chunk_store_lease,
+                         collect_garbage_chunks, download_deduplicated, move_referenced_chunks, upload_deduplicated)
+from compression import (CHUNK_CODECS, COMPRESSION_METHODS, EXTERNAL_CODEC_SUFFIXES, METADATA_KEY, PG_DUMP_COMPRESSION_METHODS,
+                         CompressingReader, decompress_file, get_pg_dump_compress_option)
+from db_admin import DbAdminConnection
+from dump_cache import DumpCache
+from process_runner import ProcessRunner, TeeReader
+from retention import list_backup_objects, select_retained_backups
+from s3_transfer import MIB, MultipartStreamUpload, change_storage_class, delete_objects, download_file_parallel,\
+                        download_files_parallel, get_checksum_tag, set_checksum_tag, upload_file_with_checksum
+from ssm_params import get_ssm_parameters
+from system_resources import get_cpu_count, get_memory_limit
+from table_split import SPLIT_PART_NAME, dump_table_range, export_split_tables, load_table_part, qualified_name
+from toc_filter import filter_toc, parse_toc, table_matches
+
+# Directory-format backups are stored as a prefix holding all dump files,
+# completed by a manifest object (written last) describing them.
+MANIFEST_FILENAME = 'manifest.json'
+DUMP_KEY_SUFFIXES = ('.dump',) + tuple('.dump'+suffix for suffix in EXTERNAL_CODEC_SUFFIXES.values())
+BACKUP_KEY_SUFFIXES = DUMP_KEY_SUFFIXES + ('/'+MANIFEST_FILENAME, RECIPE_SUFFIX)
+
+# Storage classes backups can be stored as: Glacier Instant Retrieval is cheaper to store but more expensive to retrieve.
+# The most recent backups (restored most often) can be kept as STANDARD by pruning (see hot_backups)
+BACKUP_STORAGE_CLASSES = ('GLACIER_IR', 'STANDARD')
+# Prune arguments defining the grandfather-father-son retention (see retention.select_retained_backups)
+RETENTION_ARGS = ('keep_daily', 'keep_weekly', 'keep_monthly')
+
+# Settings speeding up bulk loads (index builds and foreign key validation in particular),
+# applied to the temp DB while pg_restore runs when restore_profile is 'default' (see parse_restore_profile)
+DEFAULT_RESTORE_PROFILE = {
+	'maintenance_work_mem': '1GB',
+	'max_parallel_maintenance_workers': '4',
+	'synchronous_commit': 'off'
+}
+RESTORE_PROFILE_SETTING_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+
+# Restore arguments selecting the schemas and tables to restore (see toc_filter.filter_toc)
+TOC_FILTER_ARGS = ('include_schemas', 'exclude_schemas', 'include_tables', 'exclude_tables', 'exclude_table_data')
+
+# Template DBs holding restored backups (cloned by restores using templates) are named {prefix}{identifier}_...
+RESTORE_TEMPLATE_PREFIX = 'restore_template_'
+
+# pg_dump -v reports every (parallel) table data dump it completed
+PG_DUMP_FINISHED_ITEM_RE = re.compile(r'finished item (\d+) ')
+# pg_restore -v reports every TOC item it restored: by dump ID when running parallel workers (-j > 1),
+# as a single line per item otherwise
+PG_RESTORE_ITEM_RE = re.compile(r'(?:processing|processing missed|finished) item (\d+) ')
+PG_RESTORE_SERIAL_ITEM_RE = re.compile(r'^pg_restore: (?:creating|processing data for|executing) ')
+
+# Batch jobs mostly wait on the DB server and S3, so more jobs than CPUs can run concurrently
+BATCH_JOBS_PER_CPU = 2
+# Estimated memory use of a backup job besides its transfer buffers (application and pg_dump processes)
+BATCH_JOB_BASE_MEMORY = 256 * MIB
+# Memory to keep available for the application itself, outside of batch jobs
+BATCH_RESERVED_MEMORY = 256 * MIB
+# Options only applying to a batch as a whole (not passed on to its jobs)
+BATCH_OPTIONS = ('action', 'batch_jobs', 'batch_concurrency', 'loglevel')
 
 def main(options):
 
@@ -18,19 +94,82 @@ def main(options):
 
 	logging.basicConfig(level=os.environ.get("LOGLEVEL", log_level))
 
+	metrics_format = 'json'
+	if 'metrics' in options and options['metrics'] != None:
+		if options['metrics'] not in metrics.METRICS_FORMATS:
+			err_msg = "Error while retrieving args: Argument metrics can only have value 'json' or 'emf'"
+			logging.error(err_msg)
+			raise Exception(err_msg)
+
+		metrics_format = options['metrics']
+
+	# Record the timing of all phases of this run, and report them once completed (successfully or not)
+	run = metrics.start_run(options.get('action'), identifier=options.get('identifier'), env=options.get('target_env'))
+	try:
+		return run_main(options, run)
+	finally:
+		metrics.report_run(run, metrics_format)
+
+def run_main(options, run):
+
+	if 'action' in options and options['action'] == 'batch':
+		logging.info('Running batch of backup jobs...')
+		response = run_batch(options)
+		if 'err_msg' in response:
+			err_msg = 'Error while running batch: '+response['err_msg']
+			logging.error(err_msg)
+			raise Exception(err_msg)
+
+		return response['batch_results']
+
+	if 'action' in options and options['action'] == 'restore' and 'target_env' in options and options['target_env'] != None\
+	   and ',' in options['target_env']:
+		logging.info('Restoring backup from S3 to several target envs...')
+		response = run_restore_fanout(options)
+		if 'err_msg' in response:
+			err_msg = 'Error while running restore: '+response['err_msg']
+			logging.error(err_msg)
+			raise Exception(err_msg)
+
+		return response['restore_results']
+
 	logging.info('Processing input args...')
 
-	args_response = get_args_dict(options, SSM_ARG_PARAMS)
+	with metrics.span('resolve_args'):
+		args_response = get_args_dict(options, SSM_ARG_PARAMS, SSM_OPTIONAL_ARG_PARAMS, SSM_OPTIONAL_RESTORE_ARG_PARAMS)
 	if 'err_msg' in args_response:
 		err_msg = 'Error while retrieving args: '+args_response['err_msg']
 		logging.error(err_msg)
 		raise Exception(err_msg)
 
 	db_args = args_response['db_args']
+	run.dimensions.update(identifier=db_args['identifier'], env=db_args['target_env'])
 	logging.info('target_env: '+db_args['target_env'])
 	logging.info('identifier: '+db_args['identifier'])
 	logging.debug('db_args: {}'.format(db_args))
 
+	reporter = start_progress_reporting(db_args, db_args['target_env'])
+	response = {'err_msg': 'Unexpected error'}
+	try:
+		response = run_action(db_args)
+	finally:
+		if reporter is not None:
+			reporter.finish(response.get('err_msg'))
+
+	if 'err_msg' in response:
+		err_msg = 'Error while running {action}: {msg}'.format(
+			action=db_args['action'], msg=response['err_msg'])
+		logging.error(err_msg)
+		raise Exception(err_msg)
+
+	if db_args['action'] == 'list':
+		return response['backup_list']
+	if db_args['action'] == 'prune':
+		return response['prune_report']
+
+	return '{action} completed successfully.'.format(action=db_args['action'])
+
+def run_action(db_args):
 	response = []
 	if db_args['action'] == 'backup':
 		logging.info('Creating backup to S3...')
@@ -38,28 +177,313 @@ def main(options):
 	elif db_args['action'] == 'restore':
 		logging.info('Restoring backup from S3...')
 		response = restore_s3_to_postgres(db_args)
+	elif db_args['action'] == 'copy':
+		logging.info('Copying source DB to target DB...')
+		response = copy_postgres_to_postgres(db_args)
+	elif db_args['action'] == 'list':
+		logging.info('Listing backups from catalog...')
+		response = list_s3_backups(db_args)
+	elif db_args['action'] == 'prune':
+		logging.info('Pruning backups from S3...')
+		response = prune_s3_backups(db_args)
+
+	return response
+
+@metrics.timed_phase('batch')
+def run_batch(options):
+	"""
+	Run a batch of backup jobs (one per identifier and target_env) concurrently,
+	by a worker pool sized to the CPUs and memory available (unless batch_concurrency is defined).
+	Every job combines the batch options with its own (overriding) options.
+	A failing job does not affect the others, all job results get reported once the batch completed.
+	"""
+
+	if 'batch_jobs' not in options or options['batch_jobs'] == None:
+		error_message = "Missing input argument batch_jobs"
+		return {'err_msg': error_message}
+
+	jobs = options['batch_jobs']
+	if isinstance(jobs, str):
+		try:
+			jobs = json.loads(jobs)
+		except ValueError as err:
+			error_message = "Argument batch_jobs is not valid JSON: {}".format(err)
+			return {'err_msg': error_message}
+
+	if not isinstance(jobs, list) or not jobs or not all(isinstance(job, dict) for job in jobs):
+		error_message = "Argument batch_jobs must be a (non-empty) list of job objects."
+		return {'err_msg': error_message}
+
+	job_options = []
+	for job in jobs:
+		if 'action' in job and job['action'] != 'backup':
+			error_message = "Batch jobs only support action 'backup' (job {}).".format(json.dumps(job))
+			return {'err_msg': error_message}
+
+		merged_options = { key: value for key, value in options.items() if key not in BATCH_OPTIONS }
+		merged_options.update({ key: str(value) for key, value in job.items() if value != None })
+		merged_options['action'] = 'backup'
+		job_options.append(merged_options)
+
+	# Backups are keyed by identifier, env and timestamp, so the same DB cannot be backed up twice concurrently
+	job_names = [ '{}/{}'.format(job.get('identifier'), job.get('target_env', 'dev')) for job in job_options ]
+	duplicates = sorted(set(name for name in job_names if job_names.count(name) > 1))
+	if duplicates:
+		error_message = "Argument batch_jobs holds duplicate jobs for {}.".format(', '.join(duplicates))
+		return {'err_msg': error_message}
+
+	if 'batch_concurrency' in options and options['batch_concurrency'] != None:
+		try:
+			concurrency = int(options['batch_concurrency'])
+		except ValueError:
+			error_message = "Argument batch_concurrency must be an integer."
+			return {'err_msg': error_message}
+
+		if concurrency < 1:
+			error_message = "Argument batch_concurrency must be a positive integer."
+			return {'err_msg': error_message}
+	else:
+		concurrency = get_batch_concurrency(job_options)
+
+	concurrency = min(concurrency, len(job_options))
+	logging.info("Running {count} backup jobs, {concurrency} at a time...".format(count=len(job_options), concurrency=concurrency))
+
+	results = [None] * len(job_options)
+	with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch-job') as executor:
+		futures = { executor.submit(run_batch_job, job_names[index], job_options[index]): index
+		            for index in range(len(job_options)) }
+		for future in as_completed(futures):
+			results[futures[future]] = future.result()
+
+	# Full job errors got logged by every job, only report their first line
+	lines = [ '{:<40} {:<10} {:>10}  {}'.format('Job', 'Status', 'Duration', 'Error') ]
+	for result in results:
+		lines.append('{:<40} {:<10} {:>9.1f}s  {}'.format(result['job'], result['status'], result['duration'],
+			result.get('error', '').strip().split("\n")[0]))
+	batch_results = "\n".join(lines)
+	logging.info("Batch results:\n"+batch_results)
+
+	failed_jobs = [ result['job'] for result in results if result['status'] != 'succeeded' ]
+	if failed_jobs:
+		error_message = "{failed} of {count} jobs failed ({jobs}).\n".format(
+			failed=len(failed_jobs), count=len(results), jobs=', '.join(failed_jobs))+batch_results
+		return {'err_msg': error_message}
+
+	return {'batch_results': batch_results}
+
+def run_batch_job(job_name, job_options):
+	"""Run a single batch job, returning its result (never raising)."""
+
+	start_time = time.monotonic()
+	result = {'job': job_name}
 
+	# Every job reports its own metrics (jobs run in separate threads, each with their own context)
+	run = metrics.start_run('backup', identifier=job_options.get('identifier'), env=job_options.get('target_env', 'dev'))
+
+	logging.info('Starting batch job {}...'.format(job_name))
+	try:
+		with metrics.span('resolve_args'):
+			args_response = get_args_dict(job_options, SSM_ARG_PARAMS, SSM_OPTIONAL_ARG_PARAMS)
+		if 'err_msg' in args_response:
+			response = {'err_msg': 'Error while retrieving args: '+args_response['err_msg']}
+		else:
+			response = run_action(args_response['db_args'])
+	except Exception as err:
+		logging.exception('Batch job {} failed unexpectedly.'.format(job_name))
+		response = {'err_msg': 'Unexpected error: {}'.format(err)}
+
+	metrics.report_run(run, job_options.get('metrics') or 'json')
+
+	result['duration'] = time.monotonic() - start_time
 	if 'err_msg' in response:
-		err_msg = 'Error while running {action}: {msg}'.format(
-			action=db_args['action'], msg=response['err_msg'])
-		logging.error(err_msg)
-		raise Exception(err_msg)
+		logging.error('Batch job {job} failed: {msg}'.format(job=job_name, msg=response['err_msg']))
+		result['status'] = 'failed'
+		result['error'] = response['err_msg']
+	else:
+		logging.info('Batch job {job} completed successfully in {duration:.1f}s.'.format(job=job_name, duration=result['duration']))
+		result['status'] = 'succeeded'
 
-	return '{action} completed successfully.'.format(action=db_args['action'])
+	return result
+
+def run_restore_fanout(options):
+	"""
+	Restore a single backup to several target environments (comma-separated target_env),
+	downloading the backup only once (see restore_s3_to_targets).
+	All arguments get resolved (and validated) per target env, a target failing does not affect the others.
+	"""
+
+	target_envs = [ env.strip() for env in options['target_env'].split(',') if env.strip() ]
+	duplicates = sorted(set(env for env in target_envs if target_envs.count(env) > 1))
+	if duplicates:
+		error_message = "Argument target_env holds duplicate envs {}.".format(', '.join(duplicates))
+		return {'err_msg': error_message}
+
+	target_responses = {}
+	targets = []
+	for env in target_envs:
+		with metrics.span('resolve_args'):
+			args_response = get_args_dict(dict(options, target_env=env), SSM_ARG_PARAMS, SSM_OPTIONAL_ARG_PARAMS,
+			                              SSM_OPTIONAL_RESTORE_ARG_PARAMS)
+		if 'err_msg' in args_response:
+			target_responses[env] = {'err_msg': 'Error while retrieving args: '+args_response['err_msg']}
+		else:
+			targets.append(args_response['db_args'])
+
+	# Every target env gets its DB replaced, so no two targets can share a DB
+	target_dbs = [ (target_args['db_host'], target_args['db_name']) for target_args in targets ]
+	if len(set(target_dbs)) < len(target_dbs):
+		error_message = "Target envs {} do not all refer to a different DB.".format(', '.join(target_envs))
+		return {'err_msg': error_message}
+
+	# Progress gets reported for all targets once restoring, its status finished on every outcome
+	reporter = None
+	if targets:
+		reporter = start_progress_reporting(targets[0], ','.join(target_args['target_env'] for target_args in targets))
+	response = {'err_msg': 'Unexpected error'}
+	try:
+		response = restore_target_envs(targets, target_envs, target_responses)
+	finally:
+		if reporter is not None:
+			reporter.finish(response.get('err_msg'))
+
+	return response
+
+def restore_target_envs(targets, target_envs, target_responses):
+	"""
+	Restore the backup to all `targets` (resolved target envs), reporting the outcome for all `target_envs`
+	(including those failing to resolve, already in `target_responses`).
+	"""
+
+	if targets:
+		concurrency = targets[0]['target_concurrency'] or len(targets)
+		logging.info("Restoring to {count} target envs, {concurrency} at a time...".format(count=len(targets), concurrency=concurrency))
+
+		response = restore_s3_to_targets(targets[0], targets, target_concurrency=concurrency)
+		for target_args in targets:
+			if 'err_msg' in response:
+				target_responses[target_args['target_env']] = response
+			else:
+				target_responses[target_args['target_env']] = response['target_responses'][target_args['target_env']]
+
+	# Full target errors got logged, only report their first line
+	lines = [ '{:<20} {:<10} {}'.format('Target env', 'Status', 'Error') ]
+	for env in target_envs:
+		error = target_responses[env].get('err_msg', '')
+		lines.append('{:<20} {:<10} {}'.format(env, 'failed' if error else 'succeeded', error.strip().split("\n")[0]))
+	restore_results = "\n".join(lines)
+	logging.info("Restore results:\n"+restore_results)
+
+	failed_envs = [ env for env in target_envs if 'err_msg' in target_responses[env] ]
+	for env in failed_envs:
+		logging.error('Restore to target env {env} failed: {msg}'.format(env=env, msg=target_responses[env]['err_msg']))
+	if failed_envs:
+		error_message = "{failed} of {count} target envs failed ({envs}).\n".format(
+			failed=len(failed_envs), count=len(target_envs), envs=', '.join(failed_envs))+restore_results
+		return {'err_msg': error_message}
+
+	return {'restore_results': restore_results}
+
+def get_batch_concurrency(job_options):
+	"""
+	Return the number of batch jobs to run concurrently,
+	limited by the CPUs available and by the memory required by the most demanding job.
+	"""
+
+	cpu_limit = get_cpu_count() * BATCH_JOBS_PER_CPU
+	job_memory = max(estimate_backup_memory(options) for options in job_options)
+	memory_limit = (get_memory_limit() - BATCH_RESERVED_MEMORY) // job_memory
+
+	logging.info("Batch concurrency limits: {cpu} jobs by CPU, {memory} jobs by memory ({job_memory} MiB per job).".format(
+		cpu=cpu_limit, memory=memory_limit, job_memory=job_memory // MIB))
+
+	return max(1, min(cpu_limit, memory_limit))
+
+def estimate_backup_memory(options):
+	"""Estimate the peak memory use (in bytes) of a backup job, from its (unvalidated) options."""
+
+	try:
+		part_size = int(options.get('transfer_part_size') or 32) * MIB
+		concurrency = int(options.get('transfer_concurrency') or 4)
+	except ValueError:
+		part_size, concurrency = 32 * MIB, 4
+
+	backup_mode = options.get('backup_mode') or 'file'
+	if backup_mode == 'stream' or (backup_mode == 'file' and options.get('backup_format') != 'directory'):
+		# The part being read, plus the parts being uploaded
+		transfer_memory = part_size * (concurrency + 1)
+	elif backup_mode == 'dedup':
+		# The stream data being chunked (and carried over), plus the chunks being uploaded
+		transfer_memory = 2 * CHUNK_READ_SIZE + CHUNK_MAX_SIZE * concurrency
+	else:
+		# boto3 managed uploads (transfer_concurrency parts at once), per file uploaded concurrently
+		transfer_memory = part_size * concurrency * concurrency
 
-def get_args_dict(options, arg_set):
+	return BATCH_JOB_BASE_MEMORY + transfer_memory
+
+def start_progress_reporting(db_args, env):
+	"""
+	Start reporting the progress of a backup, restore or copy to the status object of the task in the backup bucket
+	(see progress.ProgressReporter). Returns the reporter, or None when disabled (progress_interval 0).
+	"""
+
+	if db_args['action'] not in ('backup', 'restore', 'copy') or db_args['progress_interval'] == 0:
+		return None
+
+	return progress.start_reporting(get_s3_client(db_args), db_args['s3_bucket'], db_args['progress_interval'],
+		db_args['action'], identifier=db_args['identifier'], env=env)
+
+def get_s3_client(db_args):
+	"""Return the shared S3 client, with a connection pool sized for the transfers of db_args (see s3_pool_size)."""
+
+	return get_boto3_client('s3', max_pool_connections=db_args['s3_pool_size'])
+
+def get_args_dict(options, arg_set, optional_arg_set={}, optional_restore_arg_set={}):
 
 	#Default values
 	return_args = {
 		'target_env': 'dev',
 		'src_env': 'production',
-		'region': 'us-east-1'
+		'region': 'us-east-1',
+		'backup_mode': 'file',
+		'backup_format': 'custom',
+		'compression': 'gzip',
+		'storage_class': 'GLACIER_IR',
+		'compression_level': None,
+		'dump_jobs': None,
+		'split_table_size': None,
+		'transfer_part_size': 32,
+		'transfer_concurrency': 4,
+		'transfer_threshold': None,
+		's3_pool_size': None,
+		'process_timeout': None,
+		'cache_dir': None,
+		'cache_size': 20,
+		'restore_jobs': None,
+		'target_concurrency': None,
+		'use_template': False,
+		'analyze': False,
+		'prewarm': None,
+		'restore_profile': None,
+		'template_max_age': 7,
+		'template_max_count': 3,
+		'include_schemas': None,
+		'exclude_schemas': None,
+		'include_tables': None,
+		'exclude_tables': None,
+		'exclude_table_data': None,
+		'keep_daily': 7,
+		'keep_weekly': 4,
+		'keep_monthly': 12,
+		'hot_backups': None,
+		'dry_run': False,
+		'archive': False,
+		'progress_interval': progress.DEFAULT_PROGRESS_INTERVAL
 	}
 
 	#Input argument validation
 	if 'action' in options and options['action'] != None:
-		if options['action'] not in ('backup', 'restore'):
-			error_message = "Argument action can only have value 'backup' or 'restore'"
+		if options['action'] not in ('backup', 'restore', 'copy', 'list', 'prune'):
+			error_message = "Argument action can only have value 'backup', 'restore', 'copy', 'list' or 'prune'"
 			return {'err_msg': error_message}
 
 		return_args['action'] = options['action']
@@ -78,374 +502,2044 @@ def get_args_dict(options, arg_set):
 	if 'src_env' in options and options['src_env'] != None:
 		return_args['src_env'] = options['src_env']
 
-	if 'restore_timestamp' in options and options['restore_timestamp'] != None and return_args['action'] != 'restore':
-		error_message = "Input argument restore_timestamp only relevant for restore action."
-		return {'err_msg': error_message}
+	for restore_arg in ('restore_timestamp', 'cache_dir', 'cache_size', 'target_concurrency', 'use_template',
+	                    'template_max_age', 'template_max_count') + TOC_FILTER_ARGS:
+		if restore_arg in options and options[restore_arg] != None and return_args['action'] != 'restore':
+			error_message = "Input argument {} only relevant for restore action.".format(restore_arg)
+			return {'err_msg': error_message}
 
-	if return_args['action'] == 'restore':
+	# Copies restore (into the target DB) as well, straight from the source DB rather than from a backup
+	for restore_arg in ('restore_jobs', 'analyze', 'prewarm'):
+		if restore_arg in options and options[restore_arg] != None and return_args['action'] not in ('restore', 'copy'):
+			error_message = "Input argument {} only relevant for restore and copy actions.".format(restore_arg)
+			return {'err_msg': error_message}
+
+	if 'archive' in options and options['archive'] != None:
+		if return_args['action'] != 'copy':
+			error_message = "Input argument archive only relevant for copy action."
+			return {'err_msg': error_message}
+
+		return_args['archive'] = options['archive'] == 'true'
+
+	for arg_key in arg_set:
+		if 'src_'+arg_key in options and options['src_'+arg_key] != None and return_args['action'] != 'copy':
+			error_message = "Input argument {} only relevant for copy action.".format('src_'+arg_key)
+			return {'err_msg': error_message}
+
+	if return_args['action'] in ('restore', 'copy'):
 		# Prevent data roll-up from environments with lower data integrity
 		# to environments with higher data integrity
 		if env_rank(return_args['src_env']) > env_rank(return_args['target_env']):
-			error_message = "Action 'restore' is not allowed to target env {target} from source env {source}."\
-							.format(target=return_args['target_env'],source=return_args['src_env'])
+			error_message = "Action '{action}' is not allowed to target env {target} from source env {source}."\
+							.format(action=return_args['action'],target=return_args['target_env'],source=return_args['src_env'])
 			return {'err_msg': error_message}
 
 		# Prevent accidental production environment restore
 		if return_args['target_env'] == 'production':
 			if 'prod_restore' not in options or options['prod_restore'] != 'true':
-				error_message = "Action 'restore' to target env production requested, but prod_restore is not defined as 'true'."
+				error_message = "Action '{}' to target env production requested, but prod_restore is not defined as 'true'."\
+								.format(return_args['action'])
 				return {'err_msg': error_message}
 
+		if 'ignore_privileges' in options and options['ignore_privileges'] == 'true':
+			return_args['ignore_privileges'] = True
+
+		if 'analyze' in options and options['analyze'] == 'true':
+			return_args['analyze'] = True
+
+	if return_args['action'] == 'copy' and ',' in return_args['target_env']:
+		error_message = "Action 'copy' only supports a single target env."
+		return {'err_msg': error_message}
+
+	if return_args['action'] == 'restore':
 		if 'restore_timestamp' in options and options['restore_timestamp'] != None:
 			return_args['restore_timestamp'] = options['restore_timestamp']
 		else:
 			return_args['restore_timestamp'] = ''
 
-		if 'ignore_privileges' in options and options['ignore_privileges'] == 'true':
-			return_args['ignore_privileges'] = True
+		if 'cache_dir' in options and options['cache_dir'] != None and options['cache_dir'] != "":
+			return_args['cache_dir'] = options['cache_dir']
+
+		if 'use_template' in options and options['use_template'] == 'true':
+			return_args['use_template'] = True
+
+		# Comma-separated lists of (shell-style) schema and table name patterns
+		for filter_arg in TOC_FILTER_ARGS:
+			if filter_arg in options and options[filter_arg] != None:
+				patterns = [ pattern.strip() for pattern in options[filter_arg].split(',') if pattern.strip() ]
+				if patterns:
+					return_args[filter_arg] = patterns
+
+	for prune_arg in RETENTION_ARGS + ('hot_backups', 'dry_run'):
+		if prune_arg in options and options[prune_arg] != None and return_args['action'] != 'prune':
+			error_message = "Input argument {} only relevant for prune action.".format(prune_arg)
+			return {'err_msg': error_message}
+
+	if return_args['action'] == 'prune':
+		# Retention counts of 0 disable a retention period, hot_backups 0 moves all backups to GLACIER_IR
+		for count_arg in RETENTION_ARGS + ('hot_backups',):
+			if count_arg in options and options[count_arg] != None:
+				try:
+					return_args[count_arg] = int(options[count_arg])
+				except ValueError:
+					error_message = "Argument {} must be an integer.".format(count_arg)
+					return {'err_msg': error_message}
+
+				if return_args[count_arg] < 0:
+					error_message = "Argument {} must not be negative.".format(count_arg)
+					return {'err_msg': error_message}
+
+		if 'dry_run' in options and options['dry_run'] == 'true':
+			return_args['dry_run'] = True
+
+	if 'backup_mode' in options and options['backup_mode'] != None:
+		if return_args['action'] != 'backup':
+			error_message = "Input argument backup_mode only relevant for backup action."
+			return {'err_msg': error_message}
+
+		if options['backup_mode'] not in ('file', 'stream', 'dedup'):
+			error_message = "Argument backup_mode can only have value 'file', 'stream' or 'dedup'"
+			return {'err_msg': error_message}
+
+		return_args['backup_mode'] = options['backup_mode']
+
+	if 'backup_format' in options and options['backup_format'] != None:
+		if return_args['action'] != 'backup':
+			error_message = "Input argument backup_format only relevant for backup action."
+			return {'err_msg': error_message}
+
+		if options['backup_format'] not in ('custom', 'directory'):
+			error_message = "Argument backup_format can only have value 'custom' or 'directory'"
+			return {'err_msg': error_message}
+
+		if options['backup_format'] == 'directory' and return_args['backup_mode'] != 'file':
+			error_message = "Argument backup_format 'directory' can only be combined with backup_mode 'file'."
+			return {'err_msg': error_message}
+
+		return_args['backup_format'] = options['backup_format']
+
+	if 'split_table_size' in options and options['split_table_size'] != None:
+		if return_args['action'] != 'backup':
+			error_message = "Input argument split_table_size only relevant for backup action."
+			return {'err_msg': error_message}
+
+		if return_args['backup_format'] != 'directory':
+			error_message = "Argument split_table_size can only be combined with backup_format 'directory'."
+			return {'err_msg': error_message}
+
+	for int_arg in ('dump_jobs', 'split_table_size', 'transfer_part_size', 'transfer_concurrency', 'transfer_threshold', 's3_pool_size',
+	                'process_timeout', 'cache_size', 'restore_jobs', 'target_concurrency', 'template_max_age', 'template_max_count', 'prewarm'):
+		if int_arg in options and options[int_arg] != None:
+			try:
+				return_args[int_arg] = int(options[int_arg])
+			except ValueError:
+				error_message = "Argument {} must be an integer.".format(int_arg)
+				return {'err_msg': error_message}
+
+			if return_args[int_arg] < 1:
+				error_message = "Argument {} must be a positive integer.".format(int_arg)
+				return {'err_msg': error_message}
+
+	# Run as many pg_dump and pg_restore workers as CPUs are available (as sized for the backup by the ECS trigger)
+	for jobs_arg in ('dump_jobs', 'restore_jobs'):
+		if return_args[jobs_arg] == None:
+			return_args[jobs_arg] = get_cpu_count()
+
+	if 'progress_interval' in options and options['progress_interval'] != None:
+		try:
+			return_args['progress_interval'] = int(options['progress_interval'])
+		except ValueError:
+			error_message = "Argument progress_interval must be an integer."
+			return {'err_msg': error_message}
+
+		if return_args['progress_interval'] < 0:
+			error_message = "Argument progress_interval must not be negative."
+			return {'err_msg': error_message}
+
+	if return_args['transfer_part_size'] < 5:
+		error_message = "Argument transfer_part_size must be at least 5 (MiB)."
+		return {'err_msg': error_message}
+
+	# Files smaller than a single part get uploaded in a single request
+	if return_args['transfer_threshold'] == None:
+		return_args['transfer_threshold'] = return_args['transfer_part_size']
+	# Directory backups upload transfer_concurrency files at once, each in up to transfer_concurrency parts at once
+	if return_args['s3_pool_size'] == None:
+		return_args['s3_pool_size'] = max(DEFAULT_MAX_POOL_CONNECTIONS, return_args['transfer_concurrency']**2)
+
+	# Copies archive the copied dump as a backup (of src_env), when requested
+	for backup_arg in optional_arg_set:
+		if backup_arg in options and options[backup_arg] != None and return_args['action'] not in ('backup', 'copy'):
+			error_message = "Input argument {} only relevant for backup and copy actions.".format(backup_arg)
+			return {'err_msg': error_message}
+
+	for restore_arg in optional_restore_arg_set:
+		if restore_arg in options and options[restore_arg] != None and return_args['action'] not in ('restore', 'copy'):
+			error_message = "Input argument {} only relevant for restore and copy actions.".format(restore_arg)
+			return {'err_msg': error_message}
 
 	if 'region' in options and options['region'] != None:
 		return_args['region'] = options['region']
 
 	# Retrieve database details from ssm if not defined directly
-	logging.info('Setting up ssm client...')
-	ssm_client = boto3.client('ssm', region_name=return_args['region'])
-	logging.info('Defining ssm parameter name template...')
 	ssm_parameter_name = '/{identifier}/{{env}}/db/backup/{{keyname}}'.format(identifier=return_args['identifier'])
 
+	required_params = {}
 	for arg_key, ssm_key in arg_set.items():
-		logging.debug('\tDefining {}...'.format(arg_key))
+		# Listing and pruning backups only requires the bucket, no DB details
+		if return_args['action'] in ('list', 'prune') and arg_key != 's3_bucket':
+			continue
+
 		if arg_key in options and options[arg_key] != None and options[arg_key] != "":
-			logging.debug("\t\tRetrieving {} from options...".format(arg_key))
+			logging.debug("\tRetrieving {} from options...".format(arg_key))
 			return_args[arg_key] = options[arg_key]
 		else:
-			logging.debug("\t\tRetrieving {} from SSM...".format(arg_key))
-
-			env = ''
-			#For restore action calls, fetch s3_bucket from src_env rather than target_env (to ensure correct src file retrieval)
-			if options['action'] == 'restore' and arg_key == 's3_bucket':
+			#For restore (and copy) action calls, fetch s3_bucket from src_env rather than target_env (to ensure correct src file retrieval)
+			if options['action'] in ('restore', 'copy') and arg_key == 's3_bucket':
 				env = return_args['src_env']
 			#In all other cases, target_env value from SSM
 			else:
 				env=return_args['target_env']
 
-			param_name = ssm_parameter_name.format(env=env, keyname=ssm_key)
-			logging.debug("\t\t... as param {param_name} for env {env}, identifier {identifier}".format(
-					env=env, identifier=return_args['identifier'], param_name=param_name))
+			required_params[arg_key] = (env, ssm_parameter_name.format(env=env, keyname=ssm_key))
+
+	# Copies read from the source DB (of src_env), defined by the same args prefixed by src_
+	if return_args['action'] == 'copy':
+		for arg_key, ssm_key in arg_set.items():
+			if arg_key == 's3_bucket':
+				continue
+
+			src_arg_key = 'src_'+arg_key
+			if src_arg_key in options and options[src_arg_key] != None and options[src_arg_key] != "":
+				logging.debug("\tRetrieving {} from options...".format(src_arg_key))
+				return_args[src_arg_key] = options[src_arg_key]
+			else:
+				required_params[src_arg_key] = (return_args['src_env'],
+					ssm_parameter_name.format(env=return_args['src_env'], keyname=ssm_key))
+
+	# Optional (backup or restore) settings, which can be configured per identifier and env in SSM
+	# (backup settings of copies apply to their archive, a backup of src_env)
+	optional_arg_envs = {
+		'backup':  [(optional_arg_set, return_args['target_env'])],
+		'restore': [(optional_restore_arg_set, return_args['target_env'])],
+		'copy':    [(optional_arg_set, return_args['src_env']), (optional_restore_arg_set, return_args['target_env'])]
+	}
+	optional_params = {}
+	for action_optional_arg_set, env in optional_arg_envs.get(return_args['action'], []):
+		for arg_key, ssm_key in action_optional_arg_set.items():
+			if arg_key in options and options[arg_key] != None and options[arg_key] != "":
+				return_args[arg_key] = options[arg_key]
+			else:
+				optional_params[arg_key] = ssm_parameter_name.format(env=env, keyname=ssm_key)
+
+	# All parameters (of both envs, for restores) get retrieved at once, through the shared parameter cache
+	param_names = [ param_name for _, param_name in required_params.values() ] + list(optional_params.values())
+	if param_names:
+		ssm_client = get_boto3_client('ssm', region_name=return_args['region'])
+		params = get_ssm_parameters(ssm_client, param_names)
+
+	for arg_key, (env, param_name) in required_params.items():
+		if param_name not in params:
+			error_message = "parameter {param_name} not found in SSM for env {env} identifier {identifier}.".format(
+				env=env, identifier=return_args['identifier'], param_name=param_name)
+			return {'err_msg': error_message}
+
+		logging.debug("\tRetrieved {arg_key} from SSM param {param_name}.".format(arg_key=arg_key, param_name=param_name))
+		return_args[arg_key] = params[param_name]
+
+	for arg_key, param_name in optional_params.items():
+		if param_name in params:
+			logging.debug("\tRetrieved {arg_key} from SSM param {param_name}.".format(arg_key=arg_key, param_name=param_name))
+			return_args[arg_key] = params[param_name]
+
+	if return_args['action'] == 'copy' and (return_args['src_db_host'], return_args['src_db_name']) == (return_args['db_host'], return_args['db_name']):
+		error_message = "Action 'copy' requires different source and target DBs (both are DB {name} at host {host}).".format(
+			name=return_args['db_name'], host=return_args['db_host'])
+		return {'err_msg': error_message}
+
+	if return_args['action'] in ('backup', 'copy'):
+		if return_args['compression'] not in COMPRESSION_METHODS:
+			error_message = "Argument compression can only have value "+", ".join("'{}'".format(method) for method in COMPRESSION_METHODS)
+			return {'err_msg': error_message}
+
+		# Copies stream their archive, like backup_mode 'stream'
+		if return_args['compression'] not in PG_DUMP_COMPRESSION_METHODS and return_args['action'] == 'backup'\
+		   and return_args['backup_mode'] == 'file':
+			error_message = "Argument compression '{}' requires backup_mode 'stream' or 'dedup'.".format(return_args['compression'])
+			return {'err_msg': error_message}
+
+		if return_args['compression_level'] != None:
 			try:
-				param = ssm_client.get_parameter(Name=param_name, WithDecryption=True)
-				return_args[arg_key] = param['Parameter']['Value']
-			except ssm_client.exceptions.ParameterNotFound as err:
-				error_message = "parameter {param_name} not found in SSM for env {env} identifier {identifier}.".format(
-					env=env, identifier=return_args['identifier'], param_name=param_name)
+				return_args['compression_level'] = int(return_args['compression_level'])
+			except ValueError:
+				error_message = "Argument compression_level must be an integer."
 				return {'err_msg': error_message}
 
+		if return_args['storage_class'] not in BACKUP_STORAGE_CLASSES:
+			error_message = "Argument storage_class can only have value "+", ".join("'{}'".format(storage_class) for storage_class in BACKUP_STORAGE_CLASSES)
+			return {'err_msg': error_message}
+
+	if return_args['action'] in ('restore', 'copy') and return_args['restore_profile'] != None:
+		restore_profile = parse_restore_profile(return_args['restore_profile'])
+		if restore_profile is None:
+			error_message = "Argument restore_profile must be 'default' or a comma-separated list of setting=value pairs."
+			return {'err_msg': error_message}
+
+		return_args['restore_profile'] = restore_profile
+
 	return { 'db_args': return_args }
 
+@metrics.timed_phase('backup')
 def backup_postgres_to_s3(db_args):
 
-	now_datetime_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+	start_datetime = datetime.now()
+	now_datetime_str = start_datetime.strftime("%Y-%m-%d_%H-%M-%S")
 	filename = '{identifier}/{env}/{date}.dump'.format(identifier=db_args['identifier'], env=db_args['target_env'], date=now_datetime_str)
+	if db_args['compression'] in EXTERNAL_CODEC_SUFFIXES:
+		filename += EXTERNAL_CODEC_SUFFIXES[db_args['compression']]
 
-	# Create local backup
-	tmp_local_filepath = '/tmp/'+filename.replace('/','-')
-
-	backup_command = 'pg_dump -Fc -v -d {DB_NAME} -f {FILE}'.format(DB_NAME=db_args['db_name'], FILE=tmp_local_filepath)
+	if db_args['compression'] == 'pg_zstd' and get_pg_dump_major_version() < 16:
+		error_message = "Compression 'pg_zstd' requires pg_dump 16 or later."
+		return {'err_msg': error_message}
 
-	pg_env = os.environ.copy()
-	pg_env["PGUSER"] = db_args['db_user']
-	pg_env["PGHOST"] = db_args['db_host']
-	pg_env["PGPASSWORD"] = db_args['db_password']
+	# Progress gets reported against the size of the previous backup
+	estimated_size = estimate_backup_size(db_args)
+
+	with metrics.span('dump_and_upload') as phase, progress.track(total=estimated_size, estimated=True) as tracked:
+		if db_args['backup_mode'] == 'stream':
+			response = stream_postgres_to_s3(db_args, filename, tracked.advance)
+		elif db_args['backup_mode'] == 'dedup':
+			recipe_key = '{identifier}/{env}/{date}{suffix}'.format(identifier=db_args['identifier'], env=db_args['target_env'],
+				date=now_datetime_str, suffix=RECIPE_SUFFIX)
+			response = dedup_postgres_to_s3(db_args, recipe_key, tracked.advance)
+		elif db_args['backup_format'] == 'directory':
+			backup_prefix = '{identifier}/{env}/{date}/'.format(identifier=db_args['identifier'], env=db_args['target_env'], date=now_datetime_str)
+			response = dump_directory_postgres_to_s3(db_args, backup_prefix, tracked.advance)
+		else:
+			response = dump_file_postgres_to_s3(db_args, filename, tracked.advance)
 
-	logging.info("Storing backup to {}...".format(tmp_local_filepath))
+		if 'err_msg' in response:
+			phase.fail()
+			return response
 
-	process = subprocess.Popen(backup_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, env=pg_env)
+		phase.set_bytes(response['size'])
 
-	stderr_str = ""
-	for line in iter(process.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+	# Register the backup in the catalog
+	with metrics.span('catalog_update') as phase:
+		if not add_backup_to_catalog(db_args, db_args['target_env'], response, now_datetime_str, start_datetime):
+			phase.fail()
+			error_message = "Backup {key} was uploaded, but could not be registered in the backup catalog.".format(key=response['key'])
 
-	exitcode = process.wait()
-	if exitcode != 0:
-		error_message = "pg_dump execution failed (exitcode {}).\n".format(exitcode)\
-		                +stderr_str
+			return {'err_msg': error_message}
 
-		return {'err_msg': error_message}
+	return {}
 
-	# Upload backup to S3
-	s3_target = 's3://{s3_bucket}/{filename}'.format(s3_bucket=db_args['s3_bucket'], filename=filename)
-	logging.info("Uploading backup to {}...".format(s3_target))
+def add_backup_to_catalog(db_args, env, backup, timestamp, start_datetime):
+	"""
+	Register a completed backup of `env` in its backup catalog, as described by `backup`
+	(the `key`, `size` and optional `sha256` of the uploaded backup,
+	and the `dump_size` of the dump file once decompressed, for backups compressed by this application).
+	When the catalog cannot be updated, it gets removed instead, so lookups rebuild it from a listing (see find_s3_backup).
+	Returns False when the backup could neither be registered nor the catalog removed
+	(leaving lookups unaware of the backup).
+	"""
 
-	s3_client = boto3.client('s3')
+	s3_client = get_s3_client(db_args)
+	catalog_key = get_catalog_key(db_args['identifier'], env)
+	backup_prefix = '{identifier}/{env}/'.format(identifier=db_args['identifier'], env=env)
+	try:
+		catalog_entry = {
+			'key': backup['key'],
+			'timestamp': timestamp,
+			'size': backup['size'],
+			'duration': round((datetime.now() - start_datetime).total_seconds(), 3),
+			'etag': s3_client.head_object(Bucket=db_args['s3_bucket'], Key=backup['key'])['ETag']
+		}
+		# Directory-format backups hold the checksums of all their files in their manifest
+		if 'sha256' in backup:
+			catalog_entry['sha256'] = backup['sha256']
+		if 'dump_size' in backup:
+			catalog_entry['dump_size'] = backup['dump_size']
+		add_catalog_entry(s3_client, db_args['s3_bucket'], catalog_key, backup_prefix, BACKUP_KEY_SUFFIXES, catalog_entry)
+	except Exception as err:
+		logging.warning("Failed to add backup to catalog: {}".format(err))
+	else:
+		return True
 
-	s3_client.upload_file(tmp_local_filepath, db_args['s3_bucket'], filename,
-		ExtraArgs={'StorageClass': 'GLACIER_IR'})
+	# A catalog missing the backup would make lookups silently find older backups
+	try:
+		remove_catalog(s3_client, db_args['s3_bucket'], catalog_key)
+	except Exception as err:
+		logging.error("Failed to remove outdated catalog {}: {}".format(catalog_key, err))
+		return False
 
-	return {}
+	return True
 
-def restore_s3_to_postgres(db_args):
+def estimate_backup_size(db_args, env=None):
 	"""
-	This function will
-	1.  Refuse all new connections to target DB
-	2.  Terminate all open connections to target DB
-	3.  Put target DB in readonly mode
-	4.  Re-enable new connections to target DB
-	5.  Create a new, temporarily named, DB
-	6.  Populate the new DB with the appropriate
-	    DB dump file found from the src_env
-	7.  Refuse all new connections to target DB
-	8.  Terminate all open connections to target DB
-	9.  Drop the specified target_env db
-	10. Rename the temporarily named DB to the target_env DB name
+	Return the size of the latest backup of the identifier and env (target_env when undefined, from the catalog),
+	or None when unknown.
 	"""
 
-	filename_prefix = '{identifier}/{env}/{timestamp}'.format(identifier=db_args['identifier'],
-	                                                          env=db_args['src_env'],
-	                                                          timestamp=db_args['restore_timestamp'])
-
-	latest_backup_s3_filepath = get_latest_s3_backup(db_args['s3_bucket'], filename_prefix)
+	try:
+		catalog, _ = load_catalog(get_s3_client(db_args), db_args['s3_bucket'], get_catalog_key(db_args['identifier'], env or db_args['target_env']))
+	except Exception as err:
+		logging.warning("Failed to load backup catalog to estimate the backup size: {}".format(err))
+		return None
 
-	if latest_backup_s3_filepath == None:
-		error_message = "Failed to find backup (filename_prefix {}).\n".format(filename_prefix)
+	entry = find_catalog_entry(catalog) if catalog is not None else None
 
-		return {'err_msg': error_message}
+	return entry.get('size') if entry is not None else None
 
-	tmp_local_filepath = '/tmp/'+latest_backup_s3_filepath.replace('/','-')
+def dump_file_postgres_to_s3(db_args, filename, progress_callback=None):
+	"""
+	Create a backup to local storage, and upload it to S3 once completed
+	(calling `progress_callback` with the number of bytes uploaded along the way).
+	"""
 
-	temp_DB_name = db_args['db_name']+datetime.now().strftime("%Y%m%d_%H%M%S")
+	# Create local backup
+	tmp_local_filepath = '/tmp/'+filename.replace('/','-')
 
-	logging.info('Retrieving latest backup: '+latest_backup_s3_filepath)
-
-	s3 = boto3.client('s3')
-	s3.download_file(db_args['s3_bucket'], latest_backup_s3_filepath, tmp_local_filepath)
-
-	# -h {DB_HOST} -U {DB_USER}
-	dropconn_cmd = 'psql -c "SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = \'{DB_NAME}\' and pid <> pg_backend_pid()"'.format(DB_NAME=db_args['db_name'])
-	readonlydb_cmd = 'psql -c \'ALTER DATABASE "{DB_NAME}" SET default_transaction_read_only=on;\''.format(DB_NAME=db_args['db_name'])
-	dropdb_cmd  = 'dropdb {DB_NAME}'.format(DB_NAME=db_args['db_name'])
-	createdb_cmd  = 'createdb {DB_NAME}'.format(DB_NAME=temp_DB_name)
-	renamedb_cmd  = 'psql -c \'ALTER DATABASE "{TEMP_DB_NAME}" RENAME TO "{DB_NAME}";\''.format(TEMP_DB_NAME=temp_DB_name,DB_NAME=db_args['db_name'])
-	queryconnlimit_cmd = 'psql -t -A -c "SELECT datconnlimit FROM pg_database WHERE datname = \'{DB_NAME}\';"'.format(DB_NAME=db_args['db_name'])
-	setconnlimit_cmd = 'psql -c \'ALTER DATABASE "{DB_NAME}" CONNECTION LIMIT {{connlimit}};\''.format(DB_NAME=db_args['db_name'])
-	refuseconn_cmd = setconnlimit_cmd.format(connlimit=0)
-	restore_cmd = 'pg_restore -Fc -v -j 8'
-	if 'ignore_privileges' in db_args:
-		restore_cmd += ' -O -x'
-	restore_cmd += ' -d {DB_NAME}'.format(DB_NAME=temp_DB_name)
-	restore_cmd += ' {FILENAME}'.format(FILENAME=tmp_local_filepath)
+	backup_command = 'pg_dump -Fc {COMPRESS} -v -d {DB_NAME} -f {FILE}'.format(DB_NAME=db_args['db_name'], FILE=tmp_local_filepath,
+		COMPRESS=get_pg_dump_compress_option(db_args['compression'], db_args['compression_level']))
 
 	pg_env = os.environ.copy()
 	pg_env["PGUSER"] = db_args['db_user']
 	pg_env["PGHOST"] = db_args['db_host']
 	pg_env["PGPASSWORD"] = db_args['db_password']
 
-	# Query and store current DB connection limit (for restore after DB restore completed)
-	logging.info("Retrieving connection limit for DB {DB} at host {HOST}...".format(DB=db_args['db_name'], HOST=db_args['db_host']))
-	process_queryconnlimit = subprocess.Popen(queryconnlimit_cmd, shell=True, stdout=subprocess.PIPE, env=pg_env)
-
-	connlimit = process_queryconnlimit.communicate()[0].decode().strip()
-	logging.info("\tCurrent connection limit for DB: {connlimit}".format(connlimit=connlimit))
+	logging.info("Storing backup to {}...".format(tmp_local_filepath))
 
-	# 1.  Refuse all new connections to target DB
-	logging.info("Refusing all new connections to DB...")
-	process_refuseconn = subprocess.Popen(refuseconn_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
+	with metrics.span('dump') as phase:
+		runner = ProcessRunner(backup_command, 'pg_dump', env=pg_env, timeout=db_args['process_timeout'])
+		exitcode = runner.run()
+		if exitcode != 0:
+			phase.fail()
+			error_message = runner.failure_message()
 
-	stderr_str = ""
-	for line in iter(process_refuseconn.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+			return {'err_msg': error_message}
 
-	exitcode_refuseconn = process_refuseconn.wait()
-	if exitcode_refuseconn != 0:
-		error_message = "Updating DB to refuse new connections failed (exitcode {}).\n".format(exitcode_refuseconn)\
-		                +stderr_str
+		size = os.path.getsize(tmp_local_filepath)
+		phase.set_bytes(size)
 
-		return {'err_msg': error_message}
+	# Upload backup to S3
+	s3_target = 's3://{s3_bucket}/{filename}'.format(s3_bucket=db_args['s3_bucket'], filename=filename)
+	logging.info("Uploading backup to {}...".format(s3_target))
 
-	# 2.  Terminate all open connections to target DB
-	logging.info("Dropping all existing connections to DB...")
-	process_dropconn = subprocess.Popen(dropconn_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
+	with metrics.span('upload') as phase:
+		s3_client = get_s3_client(db_args)
+
+		# Read the dump file once, checksumming it while uploading
+		upload = MultipartStreamUpload(s3_client, db_args['s3_bucket'], filename,
+			part_size=db_args['transfer_part_size']*MIB, concurrency=db_args['transfer_concurrency'],
+			progress_callback=progress_callback, StorageClass=db_args['storage_class'], Metadata={METADATA_KEY: db_args['compression']})
+		try:
+			with open(tmp_local_filepath, 'rb') as dump_file:
+				upload.upload_stream(dump_file)
+		except Exception as err:
+			phase.fail()
+			upload.abort()
+
+			error_message = "Upload to {target} failed: {err}".format(target=s3_target, err=err)
+			return {'err_msg': error_message}
 
-	stderr_str = ""
-	for line in iter(process_dropconn.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+		upload.complete()
+		sha256 = upload.sha256.hexdigest()
+		set_checksum_tag(s3_client, db_args['s3_bucket'], filename, sha256)
+		phase.set_bytes(size)
 
-	exitcode_dropconn = process_dropconn.wait()
-	if exitcode_dropconn != 0:
-		error_message = "Dropping all existing connections to DB failed (exitcode {}).\n".format(exitcode_dropconn)\
-		                +stderr_str
+	return {'key': filename, 'size': size, 'sha256': sha256}
 
-		return {'err_msg': error_message}
+def stream_postgres_to_s3(db_args, filename, progress_callback=None):
+	"""
+	Stream the pg_dump output directly into a multipart upload to S3,
+	so that dump and upload overlap and no local storage is required
+	(calling `progress_callback` with the number of bytes uploaded along the way).
+	"""
 
-	# 3.  Put target DB in readonly mode
-	logging.info("Update DB to become read-only...")
-	process_readonlydb = subprocess.Popen(readonlydb_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
+	backup_command = 'pg_dump -Fc {COMPRESS} -v -d {DB_NAME}'.format(DB_NAME=db_args['db_name'],
+		COMPRESS=get_pg_dump_compress_option(db_args['compression'], db_args['compression_level']))
 
-	stderr_str = ""
-	for line in iter(process_readonlydb.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+	pg_env = os.environ.copy()
+	pg_env["PGUSER"] = db_args['db_user']
+	pg_env["PGHOST"] = db_args['db_host']
+	pg_env["PGPASSWORD"] = db_args['db_password']
 
-	exitcode_readonlydb = process_readonlydb.wait()
-	if exitcode_readonlydb != 0:
-		error_message = "Updating DB to be read-only failed (exitcode {}).\n".format(exitcode_readonlydb)\
-		                +stderr_str
+	s3_target = 's3://{s3_bucket}/{filename}'.format(s3_bucket=db_args['s3_bucket'], filename=filename)
+	logging.info("Streaming backup to {}...".format(s3_target))
 
-		return {'err_msg': error_message}
+	s3_client = get_s3_client(db_args)
+	upload = MultipartStreamUpload(s3_client, db_args['s3_bucket'], filename,
+		part_size=db_args['transfer_part_size']*MIB, concurrency=db_args['transfer_concurrency'],
+		progress_callback=progress_callback, StorageClass=db_args['storage_class'], Metadata={METADATA_KEY: db_args['compression']})
 
-	# 4.  Re-enable new connections to target DB
-	logging.info("Allowing new (read-only) connections to DB...")
-	process_allowconn = subprocess.Popen(setconnlimit_cmd.format(connlimit=connlimit), shell=True, stderr=subprocess.PIPE, env=pg_env)
+	# The main thread consumes stdout, stderr gets drained by the runner
+	runner = ProcessRunner(backup_command, 'pg_dump', env=pg_env, stdout='pipe', timeout=db_args['process_timeout']).start()
 
-	stderr_str = ""
-	for line in iter(process_allowconn.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+	dump_stream = runner.stdout
+	if db_args['compression'] in EXTERNAL_CODEC_SUFFIXES:
+		dump_stream = CompressingReader(runner.stdout, db_args['compression'], db_args['compression_level'])
 
-	exitcode_allowconn = process_allowconn.wait()
-	if exitcode_allowconn != 0:
-		error_message = "Re-enabling DB connections (read-only) failed (exitcode {}).\n".format(exitcode_allowconn)\
-		                +stderr_str
+	try:
+		total_size = upload.upload_stream(dump_stream)
+	except Exception as err:
+		runner.cancel()
+		runner.wait()
+		upload.abort()
 
+		error_message = "Streaming upload to {target} failed: {err}".format(target=s3_target, err=err)
 		return {'err_msg': error_message}
 
-	# 5.  Create a new, temporarily named, DB
-	logging.info("Creating new (temp) DB {}...".format(temp_DB_name))
-	process_dbcreate = subprocess.Popen(createdb_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
-
-	stderr_str = ""
-	for line in iter(process_dbcreate.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+	exitcode = runner.wait()
+	if exitcode != 0:
+		upload.abort()
 
-	exitcode_dbcreate = process_dbcreate.wait()
-	if exitcode_dbcreate != 0:
-		error_message = "createdb execution failed (exitcode {}).\n".format(exitcode_dbcreate)\
-		                +stderr_str
+		error_message = runner.failure_message()
 
 		return {'err_msg': error_message}
 
-	# 6.  Populate the new DB with the appropriate
-	#     DB dump file found from the src_env
-	logging.info("Restoring dump {dumpfile} to DB {DB}...".format(
-		dumpfile=tmp_local_filepath, DB=temp_DB_name))
-	process_dbrestore = subprocess.Popen(restore_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
+	upload.complete()
+	sha256 = upload.sha256.hexdigest()
+	set_checksum_tag(s3_client, db_args['s3_bucket'], filename, sha256)
+	logging.info("Streamed {size} bytes to {target} (sha256 {sha256}).".format(size=total_size, target=s3_target, sha256=sha256))
 
-	stderr_str = ""
-	for line in iter(process_dbrestore.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+	response = {'key': filename, 'size': total_size, 'sha256': sha256}
+	# Restores decompress the dump file locally, which takes this much space (see restore_s3_to_targets)
+	if db_args['compression'] in EXTERNAL_CODEC_SUFFIXES:
+		response['dump_size'] = dump_stream.size
 
-	exitcode_dbrestore = process_dbrestore.wait()
+	return response
 
-	logging.debug("Dump restore process exited.")
+def dedup_postgres_to_s3(db_args, recipe_key, progress_callback=None):
+	"""
+	Stream an uncompressed pg_dump output through content-defined chunking,
+	uploading only the chunks not yet present in the identifier's chunk store,
+	and store the recipe to rebuild the dump file from those chunks
+	(calling `progress_callback` with the number of bytes chunked along the way).
+	"""
 
-	# 7.  Refuse all new connections to target DB
-	logging.info("Refusing all new connections to DB...")
-	process_refuseconn = subprocess.Popen(refuseconn_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
+	# Dump uncompressed, so unchanged data results in identical chunks (chunks get compressed individually)
+	backup_command = 'pg_dump -Fc -Z 0 -v -d {DB_NAME}'.format(DB_NAME=db_args['db_name'])
 
-	stderr_str = ""
-	for line in iter(process_refuseconn.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+	pg_env = os.environ.copy()
+	pg_env["PGUSER"] = db_args['db_user']
+	pg_env["PGHOST"] = db_args['db_host']
+	pg_env["PGPASSWORD"] = db_args['db_password']
 
-	exitcode_refuseconn = process_refuseconn.wait()
-	if exitcode_refuseconn != 0:
-		error_message = "Updating DB to refuse new connections failed (exitcode {}).\n".format(exitcode_refuseconn)\
-		                +stderr_str
+	chunk_prefix = CHUNK_STORE_PREFIX.format(identifier=db_args['identifier'])
+	s3_target = 's3://{s3_bucket}/{recipe_key}'.format(s3_bucket=db_args['s3_bucket'], recipe_key=recipe_key)
+	logging.info("Streaming deduplicated backup to {}...".format(s3_target))
 
-		return {'err_msg': error_message}
+	s3_client = get_s3_client(db_args)
 
-	# 8.  Terminate all open connections to target DB
-	logging.info("Dropping all existing connections to DB...")
-	process_dropconn = subprocess.Popen(dropconn_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
+	# Chunks reused from the store must not get collected as garbage before the recipe referencing them got stored
+	with chunk_store_lease(s3_client, db_args['s3_bucket'], CHUNK_LEASE_PREFIX.format(identifier=db_args['identifier'])):
+		# The main thread consumes stdout, stderr gets drained by the runner
+		runner = ProcessRunner(backup_command, 'pg_dump', env=pg_env, stdout='pipe', timeout=db_args['process_timeout']).start()
 
-	stderr_str = ""
-	for line in iter(process_dropconn.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+		try:
+			recipe = upload_deduplicated(runner.stdout, s3_client, db_args['s3_bucket'], chunk_prefix,
+				concurrency=db_args['transfer_concurrency'], storage_class=db_args['storage_class'],
+				codec=CHUNK_CODECS[db_args['compression']], level=db_args['compression_level'], progress_callback=progress_callback)
+		except Exception as err:
+			runner.cancel()
+			runner.wait()
 
-	exitcode_dropconn = process_dropconn.wait()
-	if exitcode_dropconn != 0:
-		error_message = "Dropping all existing connections to DB failed (exitcode {}).\n".format(exitcode_dropconn)\
-		                +stderr_str
+			error_message = "Deduplicated upload to {target} failed: {err}".format(target=s3_target, err=err)
+			return {'err_msg': error_message}
 
-		return {'err_msg': error_message}
+		exitcode = runner.wait()
+		if exitcode != 0:
+			error_message = runner.failure_message()
 
-	# 9.  Drop the specified target_env db
-	logging.info("Dropping original DB...")
-	process_dbdrop = subprocess.Popen(dropdb_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
+			return {'err_msg': error_message}
 
-	stderr_str = ""
-	for line in iter(process_dbdrop.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+		s3_client.put_object(Bucket=db_args['s3_bucket'], Key=recipe_key, Body=json.dumps(recipe).encode(),
+			ContentType='application/json', StorageClass=db_args['storage_class'])
 
-	exitcode_dbdrop = process_dbdrop.wait()
-	if exitcode_dbdrop != 0:
-		error_message = "dropdb execution failed (exitcode {}).\n".format(exitcode_dbdrop)\
-		                +stderr_str
+	return {'key': recipe_key, 'size': recipe['size'], 'sha256': recipe['sha256']}
 
-		return {'err_msg': error_message}
+def dump_directory_postgres_to_s3(db_args, backup_prefix, progress_callback=None):
+	"""
+	Create a directory-format dump using `dump_jobs` parallel pg_dump workers,
+	uploading every table data file to S3 as soon as pg_dump finished writing it
+	(calling `progress_callback` with the number of bytes uploaded along the way).
+	The data of tables larger than `split_table_size` gets dumped in ranges by `dump_jobs` parallel workers
+	alongside pg_dump, under the same snapshot (see table_split), every range uploaded as a file of its own.
+	A manifest listing all files, with their sizes and checksums, is uploaded last
+	and marks the backup as complete.
+	"""
 
-	# 10. Rename the temporarily named DB to the target_env DB name
-	logging.info("Renaming temp DB...")
-	process_dbrename = subprocess.Popen(renamedb_cmd, shell=True, stderr=subprocess.PIPE, env=pg_env)
+	tmp_local_dirpath = '/tmp/'+backup_prefix.rstrip('/').replace('/','-')
+	# pg_dump requires its output directory not to exist yet
+	split_local_dirpath = tmp_local_dirpath+'-split'
 
-	stderr_str = ""
-	for line in iter(process_dbrename.stderr.readline, b''):
-		decoded_str = line.decode().strip()
-		stderr_str += decoded_str+"\n"
-		logging.info(decoded_str)
+	backup_command = 'pg_dump -Fd {COMPRESS} -v -j {JOBS} -d {DB_NAME} -f {DIR}'.format(
+		JOBS=db_args['dump_jobs'], DB_NAME=db_args['db_name'], DIR=tmp_local_dirpath,
+		COMPRESS=get_pg_dump_compress_option(db_args['compression'], db_args['compression_level']))
 
-	exitcode_dbrename = process_dbrename.wait()
-	if exitcode_dbrename != 0:
-		error_message = "Rename-DB query execution failed (exitcode {}).\n".format(exitcode_dbrename)\
-		                +stderr_str
+	pg_env = os.environ.copy()
+	pg_env["PGUSER"] = db_args['db_user']
+	pg_env["PGHOST"] = db_args['db_host']
+	pg_env["PGPASSWORD"] = db_args['db_password']
+
+	split_tables = []
+	snapshot_connection = None
+	if db_args['split_table_size'] != None:
+		try:
+			snapshot_connection = DbAdminConnection(db_args, maintenance_db=db_args['db_name'])
+			snapshot, split_tables = export_split_tables(snapshot_connection, db_args['split_table_size']*MIB, db_args['dump_jobs'])
+		except psycopg2.Error as err:
+			if snapshot_connection is not None:
+				snapshot_connection.close()
+			error_message = "Failed to prepare split tables: {}".format(err)
+
+			return {'err_msg': error_message}
+
+		if split_tables:
+			backup_command += ' --snapshot={}'.format(snapshot)
+			for table in split_tables:
+				backup_command += ' --exclude-table-data={}'.format(shlex.quote(qualified_name(table)))
+		else:
+			snapshot_connection.close()
+			snapshot_connection = None
+
+	s3_target = 's3://{s3_bucket}/{prefix}'.format(s3_bucket=db_args['s3_bucket'], prefix=backup_prefix)
+	logging.info("Storing directory backup to {dir} and uploading to {target}...".format(
+		dir=tmp_local_dirpath, target=s3_target))
+
+	s3_client = get_s3_client(db_args)
+	transfer_config = get_transfer_config(db_args['transfer_part_size']*MIB, db_args['transfer_concurrency'],
+		db_args['transfer_threshold']*MIB)
+
+	def upload_dump_file(name, dirpath=tmp_local_dirpath):
+		filepath = os.path.join(dirpath, name)
+		file_details = upload_file_with_checksum(s3_client, filepath, db_args['s3_bucket'], backup_prefix+name,
+			extra_args={'StorageClass': db_args['storage_class']}, progress_callback=progress_callback, transfer_config=transfer_config)
+		# Free up local storage as soon as possible
+		os.remove(filepath)
+		logging.debug("Uploaded {name} ({size} bytes).".format(name=name, size=file_details['size']))
+
+		return dict(name=name, **file_details)
+
+	uploads = {}
+	upload_executor = ThreadPoolExecutor(max_workers=db_args['transfer_concurrency'], thread_name_prefix='s3-upload')
+
+	split_codec = CHUNK_CODECS[db_args['compression']]
+
+	def dump_split_range(name, table, table_range):
+		dump_table_range(pg_env, db_args['db_name'], snapshot, table, table_range, os.path.join(split_local_dirpath, name),
+			split_codec, db_args['compression_level'], timeout=db_args['process_timeout'])
+
+		return upload_dump_file(name, split_local_dirpath)
+
+	# Dump (and upload) the ranges of split tables while pg_dump runs
+	split_executor = ThreadPoolExecutor(max_workers=db_args['dump_jobs'], thread_name_prefix='split-dump')
+	if split_tables:
+		os.makedirs(split_local_dirpath, exist_ok=True)
+	for table_index, table in enumerate(split_tables):
+		table['parts'] = []
+		for part_index, table_range in enumerate(table['ranges']):
+			name = SPLIT_PART_NAME.format(table=table_index, part=part_index)
+			table['parts'].append(name)
+			uploads[name] = split_executor.submit(dump_split_range, name, table, table_range)
+
+	def upload_finished_files(line):
+		# Upload table data files as soon as pg_dump closed them
+		match = PG_DUMP_FINISHED_ITEM_RE.search(line)
+		if match:
+			for name in os.listdir(tmp_local_dirpath):
+				if name.startswith(match.group(1)+'.dat') and name not in uploads:
+					uploads[name] = upload_executor.submit(upload_dump_file, name)
+
+	runner = ProcessRunner(backup_command, 'pg_dump', env=pg_env, line_callback=upload_finished_files,
+		timeout=db_args['process_timeout'])
+	exitcode = runner.run()
+	if exitcode != 0:
+		upload_executor.shutdown(wait=True, cancel_futures=True)
+		split_executor.shutdown(wait=True, cancel_futures=True)
+		if snapshot_connection is not None:
+			snapshot_connection.close()
+		delete_uploaded_files(s3_client, db_args['s3_bucket'], backup_prefix, uploads)
+		shutil.rmtree(tmp_local_dirpath, ignore_errors=True)
+		shutil.rmtree(split_local_dirpath, ignore_errors=True)
+
+		error_message = runner.failure_message()
+
+		return {'err_msg': error_message}
+
+	# Upload all remaining files (TOC, blobs, ...)
+	for name in os.listdir(tmp_local_dirpath):
+		if name not in uploads:
+			uploads[name] = upload_executor.submit(upload_dump_file, name)
+
+	upload_executor.shutdown(wait=True)
+	split_executor.shutdown(wait=True)
+	# The exported snapshot (and the locks on split tables) are no longer needed once all ranges got dumped
+	if snapshot_connection is not None:
+		snapshot_connection.close()
+
+	files = []
+	upload_errors = []
+	for name, future in sorted(uploads.items()):
+		try:
+			files.append(future.result())
+		except Exception as err:
+			upload_errors.append("{name}: {err}".format(name=name, err=err))
+
+	shutil.rmtree(tmp_local_dirpath, ignore_errors=True)
+	shutil.rmtree(split_local_dirpath, ignore_errors=True)
+
+	if upload_errors:
+		delete_uploaded_files(s3_client, db_args['s3_bucket'], backup_prefix, uploads)
+
+		error_message = "Upload of directory backup to {target} failed.\n".format(target=s3_target)\
+		                +"\n".join(upload_errors)
 
 		return {'err_msg': error_message}
 
+	manifest = {
+		'format': 'directory',
+		'files': files
+	}
+	if split_tables:
+		manifest['split_tables'] = [ {'schema': table['schema'], 'name': table['name'], 'columns': table['columns'],
+		                              'encoding': table['encoding'], 'codec': split_codec, 'parts': table['parts']}
+		                             for table in split_tables ]
+	s3_client.put_object(Bucket=db_args['s3_bucket'], Key=backup_prefix+MANIFEST_FILENAME,
+		Body=json.dumps(manifest, indent=1).encode(), ContentType='application/json', StorageClass=db_args['storage_class'])
+
+	total_size = sum(file['size'] for file in files)
+	logging.info("Uploaded {count} files ({size} bytes) to {target}.".format(
+		count=len(files), size=total_size, target=s3_target))
+
+	return {'key': backup_prefix+MANIFEST_FILENAME, 'size': total_size}
+
+def delete_uploaded_files(s3_client, bucket, backup_prefix, uploads):
+	"""Remove the files of an incomplete directory backup from S3."""
+
+	keys = [ backup_prefix+name for name, future in uploads.items()
+	         if future.done() and not future.cancelled() and future.exception() is None ]
+	if not keys:
+		return
+
+	logging.info("Removing {} files of incomplete backup {}...".format(len(keys), backup_prefix))
+	delete_objects(s3_client, bucket, keys)
+
+def download_directory_backup(s3_client, bucket, manifest_key, local_dirpath, part_size, concurrency, progress_callback=None):
+	"""
+	Download all files of a directory-format backup, as listed in its manifest,
+	into `local_dirpath` and verify their checksums.
+	The manifest gets stored along with them (listing the split tables to restore).
+	Returns the total size (in bytes) downloaded. Raises on failure.
+	"""
+
+	backup_prefix = manifest_key[:-len(MANIFEST_FILENAME)]
+	manifest_body = s3_client.get_object(Bucket=bucket, Key=manifest_key)['Body'].read()
+	manifest = json.loads(manifest_body)
+
+	os.makedirs(local_dirpath, exist_ok=True)
+	with open(os.path.join(local_dirpath, MANIFEST_FILENAME), 'wb') as manifest_file:
+		manifest_file.write(manifest_body)
+	files = [ {'key': backup_prefix+file['name'], 'filepath': os.path.join(local_dirpath, file['name']), 'size': file['size'],
+	           'sha256': file['sha256']}
+	          for file in manifest['files'] ]
+
+	return download_files_parallel(s3_client, bucket, files, part_size, concurrency, progress_callback)
+
+def restore_s3_to_postgres(db_args):
+	"""
+	This function will
+	0.  Download the appropriate DB dump file found from the src_env
+	    (in parallel ranges), verifying its checksum and archive TOC
+	    before touching the target DB
+	1.  Refuse all new connections to target DB
+	2.  Terminate all open connections to target DB
+	3.  Put target DB in readonly mode
+	4.  Re-enable new connections to target DB
+	5.  Create a new, temporarily named, DB
+	6.  Populate the new DB with the appropriate
+	    DB dump file found from the src_env
+	    (and optionally analyze it and prewarm its most used tables)
+	7.  Refuse all new connections to target DB
+	8.  Terminate all open connections to target DB
+	9.  Drop the specified target_env db
+	10. Rename the temporarily named DB to the target_env DB name
+	"""
+
+	response = restore_s3_to_targets(db_args, [db_args], target_concurrency=1)
+	if 'err_msg' in response:
+		return response
+
+	return response['target_responses'][db_args['target_env']]
+
+def get_restore_disk_size(backup_entry):
+	"""
+	Return the local storage (in bytes) taken by restoring a backup (as found by find_s3_backup):
+	the downloaded backup, along with the decompressed dump file for backups compressed by this application
+	(when recorded in the catalog, the cache making room again once decompressed otherwise, see CacheEntry.commit).
+	"""
+
+	return (backup_entry['size'] or 0) + backup_entry.get('dump_size', 0)
+
+@metrics.timed_phase('restore')
+def restore_s3_to_targets(db_args, targets, target_concurrency):
+	"""
+	Restore a single backup (found as defined by `db_args`) to several target environments,
+	each defined by its own db_args (in `targets`).
+	The backup gets downloaded and verified once (step 0 of restore_s3_to_postgres),
+	after which steps 1 to 10 run for up to `target_concurrency` targets concurrently.
+	Returns the response of every target (as `target_responses`, by target env),
+	or an error when the backup could not be retrieved.
+	"""
+
+	filename_prefix = '{identifier}/{env}/{timestamp}'.format(identifier=db_args['identifier'],
+	                                                          env=db_args['src_env'],
+	                                                          timestamp=db_args['restore_timestamp'])
+
+	backup_entry = find_s3_backup(db_args['s3_bucket'], db_args['identifier'], db_args['src_env'],
+	                              db_args['restore_timestamp'])
+
+	if backup_entry == None:
+		error_message = "Failed to find backup (filename_prefix {}).\n".format(filename_prefix)
+
+		return {'err_msg': error_message}
+
+	latest_backup_s3_filepath = backup_entry['key']
+
+	# Directory-format backups are identified by their manifest
+	if latest_backup_s3_filepath.endswith('/'+MANIFEST_FILENAME):
+		backup_format = 'directory'
+		tmp_local_filepath = '/tmp/'+latest_backup_s3_filepath[:-len('/'+MANIFEST_FILENAME)].replace('/','-')
+	# Deduplicated backups are rebuilt from the chunk store as a custom-format dump file
+	elif latest_backup_s3_filepath.endswith(RECIPE_SUFFIX):
+		backup_format = 'dedup'
+		tmp_local_filepath = '/tmp/'+latest_backup_s3_filepath[:-len(RECIPE_SUFFIX)].replace('/','-')+'.dump'
+	else:
+		backup_format = 'custom'
+		tmp_local_filepath = '/tmp/'+latest_backup_s3_filepath.replace('/','-')
+		# Dump files compressed by this application get decompressed after download
+		for codec_suffix in EXTERNAL_CODEC_SUFFIXES.values():
+			if tmp_local_filepath.endswith(codec_suffix):
+				tmp_local_filepath = tmp_local_filepath[:-len(codec_suffix)]
+
+	# Repeated restores of the same backup (version) may clone a template DB holding it (see restore_from_template)
+	template = None
+	if db_args['use_template']:
+		template = {'name': get_restore_template_name(db_args, backup_entry),
+		            'key': latest_backup_s3_filepath, 'etag': backup_entry['etag']}
+
+	target_responses = {}
+	db_admins = {}
+	cache_entry = None
+	downloaded_size = None
+	restore_list_path = None
+	try:
+		# All administrative steps run over a single connection to the maintenance DB (per target),
+		# connect before downloading to fail fast on unreachable targets.
+		for target_args in targets:
+			try:
+				db_admins[target_args['target_env']] = DbAdminConnection(target_args)
+			except psycopg2.Error as err:
+				error_message = "Failed to connect to DB host {host}: {err}".format(host=target_args['db_host'], err=err)
+				target_responses[target_args['target_env']] = {'err_msg': error_message}
+
+		if not db_admins:
+			return {'target_responses': target_responses}
+
+		# No download needed when every target server holds a template DB of the backup already
+		if template is not None and all(find_restore_template(db_admin, template['name']) for db_admin in db_admins.values()):
+			logging.info('Found template DB {} on all target DB hosts, skipping download.'.format(template['name']))
+			tmp_local_filepath = None
+		else:
+			# Repeated restores of the same backup (version) read it from the (optional) local dump cache
+			if db_args['cache_dir'] != None:
+				try:
+					dump_cache = DumpCache(db_args['cache_dir'], db_args['cache_size']*1024*MIB)
+					cache_entry = dump_cache.acquire(latest_backup_s3_filepath, backup_entry['etag'])
+					if not cache_entry.hit:
+						dump_cache.evict(keep_id=cache_entry.id, reserve=get_restore_disk_size(backup_entry))
+				except OSError as err:
+					error_message = "Failed to use dump cache {dir}: {err}".format(dir=db_args['cache_dir'], err=err)
+
+					return {'err_msg': error_message}
+
+				tmp_local_filepath = cache_entry.path
+
+			# 0.  Download (and verify) the DB dump file
+			logging.info('Retrieving latest backup: '+latest_backup_s3_filepath)
+			if cache_entry is not None and cache_entry.hit:
+				downloaded_size = cache_entry.size
+			else:
+				s3 = get_s3_client(db_args)
+				try:
+					with metrics.span('download') as phase, progress.track(total=backup_entry.get('size')) as tracked:
+						if backup_format == 'dedup':
+							downloaded_size = download_deduplicated(s3, db_args['s3_bucket'], latest_backup_s3_filepath,
+								tmp_local_filepath, concurrency=db_args['transfer_concurrency'], progress_callback=tracked.advance)
+						elif backup_format == 'directory':
+							downloaded_size = download_directory_backup(s3, db_args['s3_bucket'], latest_backup_s3_filepath,
+								tmp_local_filepath, part_size=db_args['transfer_part_size']*MIB,
+								concurrency=db_args['transfer_concurrency'], progress_callback=tracked.advance)
+						else:
+							downloaded_size = download_dump_file(s3, db_args['s3_bucket'], latest_backup_s3_filepath,
+								tmp_local_filepath, part_size=db_args['transfer_part_size']*MIB,
+								concurrency=db_args['transfer_concurrency'], sha256=backup_entry.get('sha256'),
+								progress_callback=tracked.advance)
+						phase.set_bytes(downloaded_size)
+
+					if cache_entry is not None:
+						cache_entry.commit()
+				except Exception as err:
+					# Only drop cached backups when incomplete
+					if cache_entry is not None and not cache_entry.hit:
+						cache_entry.discard()
+					error_message = "Failed to download backup {file}: {err}\n".format(file=latest_backup_s3_filepath, err=err)
+
+					return {'err_msg': error_message}
+
+			logging.info("Retrieved backup {file} ({size} bytes).".format(file=latest_backup_s3_filepath, size=downloaded_size))
+
+			# Reject corrupt or truncated archives before touching any target DB
+			response = validate_backup_archive(tmp_local_filepath, backup_format)
+			if 'err_msg' in response:
+				if cache_entry is not None:
+					cache_entry.discard()
+
+				return response
+
+			# Only restore the selected schemas and tables (if any filters were defined)
+			restore_list_path = write_restore_list(response['toc_lines'], db_args)
+
+		def restore_target(target_args):
+			db_admin = db_admins[target_args['target_env']]
+			if len(targets) == 1:
+				return restore_to_target(target_args, db_admin, tmp_local_filepath, backup_format, downloaded_size,
+				                         restore_list_path, template)
+
+			# Record the phases of every target separately
+			with metrics.span(target_args['target_env']) as phase:
+				target_response = restore_to_target(target_args, db_admin, tmp_local_filepath, backup_format, downloaded_size,
+				                                    restore_list_path, template)
+				if 'err_msg' in target_response:
+					phase.fail()
+
+				return target_response
+
+		with ThreadPoolExecutor(max_workers=target_concurrency, thread_name_prefix='restore-target') as executor:
+			futures = {}
+			for target_args in targets:
+				if target_args['target_env'] in db_admins:
+					futures[target_args['target_env']] = executor.submit(metrics.in_current_context(restore_target), target_args)
+			for env, future in futures.items():
+				try:
+					target_responses[env] = future.result()
+				except Exception as err:
+					logging.exception('Restore to target env {} failed unexpectedly.'.format(env))
+					target_responses[env] = {'err_msg': 'Unexpected error: {}'.format(err)}
+	finally:
+		for db_admin in db_admins.values():
+			db_admin.close()
+		if restore_list_path is not None:
+			os.remove(restore_list_path)
+		if cache_entry is not None:
+			cache_entry.release()
+		elif tmp_local_filepath is not None:
+			remove_local_backup(tmp_local_filepath)
+
+	return {'target_responses': target_responses}
+
+def restore_to_target(db_args, db_admin, tmp_local_filepath, backup_format, downloaded_size, restore_list_path=None,
+                      template=None):
+	"""
+	Run steps 1 to 10 of restore_s3_to_postgres for a single target DB,
+	using the (downloaded and verified) DB dump file
+	(only restoring the TOC entries listed in `restore_list_path`, when defined),
+	or cloning the restored backup from a template DB when `template` is defined (see restore_from_template).
+	"""
+
+	temp_DB_name = db_args['db_name']+datetime.now().strftime("%Y%m%d_%H%M%S")
+
+	if template is not None:
+		# 1-6. Prepare the target DB and clone the template DB (built first when not found)
+		response = restore_from_template(db_args, db_admin, temp_DB_name, template, tmp_local_filepath, backup_format,
+		                                 downloaded_size, restore_list_path)
+
+		if 'err_msg' in response:
+			return response
+
+		restore_error = response['restore_error']
+	else:
+		# 1-5. Prepare the target DB and create the temp DB
+		response = prepare_restore_target(db_args, db_admin, temp_DB_name)
+
+		if 'err_msg' in response:
+			return response
+
+		# 6.  Populate the new DB with the appropriate
+		#     DB dump file found from the src_env
+		response = run_pg_restore(db_args, db_admin, temp_DB_name, tmp_local_filepath, backup_format, downloaded_size,
+		                          restore_list_path)
+
+		# Never swap in a partially restored (or restore-tuned) DB
+		if 'err_msg' in response or response['runner'].timed_out or response['runner'].cancelled:
+			error_message = response['err_msg'] if 'err_msg' in response else response['runner'].failure_message()
+
+			rollback_response = rollback_restore_target(db_args, db_admin, temp_DB_name)
+			if 'err_msg' in rollback_response:
+				error_message += rollback_response['err_msg']
+
+			return {'err_msg': error_message}
+
+		runner_dbrestore = response['runner']
+		restore_error = runner_dbrestore.failure_message() if runner_dbrestore.exitcode != 0 else None
+
+	# 7-10. Swap the temp DB in place of the target DB
+	# (templates got analyzed when built, clones hold the template's statistics)
+	return swap_restored_db(db_args, db_admin, temp_DB_name, restore_error, analyze=db_args['analyze'] and template is None)
+
+def swap_restored_db(db_args, db_admin, temp_DB_name, restore_error=None, analyze=True):
+	"""
+	Run steps 7 to 10 of restore_s3_to_postgres for a single target DB, swapping the restored temp DB
+	in place of the target DB once optimized (see optimize_restored_db, analyzing it only when `analyze` is set).
+	Reports `restore_error` (the pg_restore failure, if any) once swapped in.
+	"""
+
+	# Collect planner statistics and warm up the cache before the restored DB receives any traffic
+	if analyze or db_args['prewarm'] != None:
+		response = optimize_restored_db(db_args, temp_DB_name, analyze=analyze)
+		if 'err_msg' in response:
+			logging.warning("Optimizing restored DB {DB} failed, swapping it in regardless: {err}".format(
+				DB=temp_DB_name, err=response['err_msg']))
+
+	try:
+		# The swap span is the window in which the target DB refuses connections
+		with metrics.span('swap'):
+			swap_duration = db_admin.swap_databases(db_args['db_name'], temp_DB_name)
+	except psycopg2.Error as err:
+		error_message = "Replacing DB {DB} by temp DB {TEMP_DB} failed: {err}".format(
+			DB=db_args['db_name'], TEMP_DB=temp_DB_name, err=err)
+
+		return {'err_msg': error_message}
+
+	logging.info("DB {DB} was unavailable for {duration:.3f}s while swapping in the restored DB.".format(
+		DB=db_args['db_name'], duration=swap_duration))
+
 	# Currently every restore to a non-RDS location "fails" because
 	# the role "rdsadmin" does not exist on local postgres installations.
-	if exitcode_dbrestore != 0:
-		error_message = "pg_restore execution failed (exitcode {}).\n".format(exitcode_dbrestore)\
-		                +stderr_str
+	if restore_error is not None:
+		return {'err_msg': restore_error}
+
+	return {}
+
+def run_pg_restore(db_args, db_admin, db_name, tmp_local_filepath, backup_format, downloaded_size, restore_list_path=None):
+	"""
+	Restore the DB dump file into (existing) DB `db_name`, with the settings of the restore profile (if any)
+	applied to that DB while pg_restore runs. Returns the (completed) process runner (as `runner`).
+	Directory-format backups holding split tables get restored section by section, loading all ranges
+	of the split tables in parallel along with the data section (before indexes and constraints get created).
+	"""
+
+	restore_cmd = 'pg_restore -F{FORMAT} -v -j {JOBS}'.format(FORMAT='d' if backup_format == 'directory' else 'c',
+		JOBS=db_args['restore_jobs'])
+	if 'ignore_privileges' in db_args:
+		restore_cmd += ' -O -x'
+	if restore_list_path is not None:
+		restore_cmd += ' -L {LIST}'.format(LIST=restore_list_path)
+	restore_target = ' -d {DB_NAME} {FILENAME}'.format(DB_NAME=db_name, FILENAME=tmp_local_filepath)
+
+	pg_env = os.environ.copy()
+	pg_env["PGUSER"] = db_args['db_user']
+	pg_env["PGHOST"] = db_args['db_host']
+	pg_env["PGPASSWORD"] = db_args['db_password']
+
+	split_tables = list_restored_split_tables(db_args, tmp_local_filepath, restore_list_path) if backup_format == 'directory' else []
+
+	response = apply_restore_profile(db_args, db_admin, db_name)
+	if 'err_msg' in response:
+		return response
+
+	# Progress gets reported as the number of TOC items (and split table ranges) restored
+	item_ids = list_restore_items(tmp_local_filepath, backup_format, restore_list_path)
+	part_count = sum(len(table['parts']) for table in split_tables)
+	restored_ids = set()
+	loaded_parts = []
+
+	def count_restored_item(line):
+		match = PG_RESTORE_ITEM_RE.search(line)
+		if match:
+			if int(match.group(1)) in item_ids:
+				restored_ids.add(int(match.group(1)))
+			tracked.set_done(len(restored_ids) + len(loaded_parts))
+		elif not restored_ids and PG_RESTORE_SERIAL_ITEM_RE.match(line):
+			tracked.advance(1)
+
+	def count_loaded_part(name):
+		loaded_parts.append(name)
+		tracked.set_done(len(restored_ids) + len(loaded_parts))
+
+	sections = ('pre-data', 'data', 'post-data') if split_tables else (None,)
+
+	logging.info("Restoring dump {dumpfile} to DB {DB}...".format(
+		dumpfile=tmp_local_filepath, DB=db_name))
+	with metrics.span('pg_restore') as phase, progress.track(total=(len(item_ids) + part_count) or None, unit='items') as tracked:
+		runner_dbrestore = None
+		load_errors = []
+		for section in sections:
+			section_cmd = restore_cmd + (' --section={}'.format(section) if section is not None else '') + restore_target
+			runner = ProcessRunner(section_cmd, 'pg_restore', env=pg_env, stdout='lines', line_callback=count_restored_item,
+				timeout=db_args['process_timeout']).start()
+			if section == 'data':
+				load_errors = load_split_tables(db_args, pg_env, db_name, tmp_local_filepath, split_tables, count_loaded_part)
+			runner.wait()
+
+			# Report the first section failing (later sections still get restored, as pg_restore does on errors)
+			if runner_dbrestore is None or runner_dbrestore.exitcode == 0:
+				runner_dbrestore = runner
+			if runner.timed_out or runner.cancelled or load_errors:
+				break
+
+		phase.set_bytes(downloaded_size)
+		if runner_dbrestore.exitcode != 0 or load_errors:
+			phase.fail()
+
+	logging.debug("Dump restore process exited.")
+
+	if load_errors:
+		error_message = "Loading split tables into DB {DB} failed.\n".format(DB=db_name)+"\n".join(load_errors)
+
+		return {'err_msg': error_message}
+
+	response = remove_restore_profile(db_args, db_admin, db_name)
+	if 'err_msg' in response:
+		return response
+
+	return {'runner': runner_dbrestore}
+
+def list_restored_split_tables(db_args, tmp_local_dirpath, restore_list_path=None):
+	"""
+	Return the split tables of a directory-format backup (as listed in its manifest) to restore the data of,
+	leaving out tables not restored (as selected by the restore list) and tables restored without their data.
+	"""
+
+	manifest_path = os.path.join(tmp_local_dirpath, MANIFEST_FILENAME)
+	if not os.path.exists(manifest_path):
+		return []
+
+	with open(manifest_path) as manifest_file:
+		split_tables = json.load(manifest_file).get('split_tables', [])
+
+	if split_tables and restore_list_path is not None:
+		with open(restore_list_path) as list_file:
+			restored_tables = { (entry['schema'], entry['name']) for entry in parse_toc(list_file.read().splitlines())
+			                    if entry['description'] == 'TABLE' }
+		split_tables = [ table for table in split_tables if (table['schema'], table['name']) in restored_tables
+		                 and not table_matches(table['schema'], table['name'], db_args['exclude_table_data'] or []) ]
+
+	return split_tables
+
+def load_split_tables(db_args, pg_env, db_name, tmp_local_dirpath, split_tables, progress_callback=None):
+	"""
+	Load all ranges of `split_tables` (stored in `tmp_local_dirpath`) into DB `db_name`, using `restore_jobs` parallel workers
+	(calling `progress_callback` with the name of every range loaded).
+	Returns the errors of all ranges failing to load (none remaining get loaded after the first failure).
+	"""
+
+	if not split_tables:
+		return []
+
+	def load_part(table, name):
+		load_table_part(pg_env, db_name, table, os.path.join(tmp_local_dirpath, name), table['codec'],
+			timeout=db_args['process_timeout'])
+		if progress_callback is not None:
+			progress_callback(name)
+
+	logging.info("Loading {count} ranges of {tables} split tables into DB {DB}...".format(
+		count=sum(len(table['parts']) for table in split_tables), tables=len(split_tables), DB=db_name))
+	load_errors = []
+	with ThreadPoolExecutor(max_workers=db_args['restore_jobs'], thread_name_prefix='split-load') as executor:
+		futures = { executor.submit(load_part, table, name): '{} ({})'.format(qualified_name(table), name)
+		            for table in split_tables for name in table['parts'] }
+		for future in as_completed(futures):
+			if future.cancelled():
+				continue
+			try:
+				future.result()
+			except Exception as err:
+				load_errors.append("{part}: {err}".format(part=futures[future], err=err))
+				for pending_future in futures:
+					pending_future.cancel()
+
+	return load_errors
+
+def apply_restore_profile(db_args, db_admin, db_name):
+	"""Apply the settings of the restore profile (if any) to DB `db_name`, before restoring into it."""
+
+	# Settings apply to every session started (by pg_restore) once defined
+	restore_profile = db_args['restore_profile'] or {}
+	if restore_profile:
+		logging.info("Applying restore profile to DB {DB}: {settings}".format(DB=db_name,
+			settings=', '.join('{}={}'.format(name, value) for name, value in restore_profile.items())))
+		try:
+			db_admin.set_database_settings(db_name, restore_profile)
+		except psycopg2.Error as err:
+			error_message = "Applying restore profile failed: {}".format(err)
+
+			return {'err_msg': error_message}
+
+	return {}
+
+def remove_restore_profile(db_args, db_admin, db_name):
+	"""Remove the settings of the restore profile (if any) from DB `db_name`, once restored."""
+
+	# The restored DB must keep the server's normal configuration once swapped in (or cloned)
+	restore_profile = db_args['restore_profile'] or {}
+	if restore_profile:
+		logging.info("Removing restore profile from DB {}...".format(db_name))
+		try:
+			db_admin.reset_database_settings(db_name, restore_profile.keys())
+		except psycopg2.Error as err:
+			error_message = "Removing restore profile failed: {}".format(err)
+
+			return {'err_msg': error_message}
+
+	return {}
+
+@metrics.timed_phase('copy')
+def copy_postgres_to_postgres(db_args):
+	"""
+	Copy the source DB (of src_env) to the target DB (of target_env) in a single pass, without staging a backup:
+	the pg_dump output of the source DB gets piped into pg_restore of a temp DB,
+	which replaces the target DB once restored (steps 1 to 10 of restore_s3_to_postgres, without downloading).
+	When `archive` is set, the dump gets uploaded to S3 along the way as a backup of src_env (see pipe_postgres_to_postgres).
+	"""
+
+	start_datetime = datetime.now()
+
+	if db_args['archive'] and db_args['compression'] == 'pg_zstd' and get_pg_dump_major_version() < 16:
+		error_message = "Compression 'pg_zstd' requires pg_dump 16 or later."
+		return {'err_msg': error_message}
+
+	try:
+		db_admin = DbAdminConnection(db_args)
+	except psycopg2.Error as err:
+		error_message = "Failed to connect to DB host {host}: {err}".format(host=db_args['db_host'], err=err)
+
+		return {'err_msg': error_message}
+
+	temp_DB_name = db_args['db_name']+datetime.now().strftime("%Y%m%d_%H%M%S")
+	try:
+		# 1-5. Prepare the target DB and create the temp DB
+		response = prepare_restore_target(db_args, db_admin, temp_DB_name)
+
+		if 'err_msg' in response:
+			return response
+
+		# 6.  Populate the new DB straight from the source DB
+		response = pipe_postgres_to_postgres(db_args, db_admin, temp_DB_name, start_datetime)
+
+		# Never swap in a partially restored (or restore-tuned) DB
+		if 'err_msg' in response:
+			error_message = response['err_msg']
+
+			rollback_response = rollback_restore_target(db_args, db_admin, temp_DB_name)
+			if 'err_msg' in rollback_response:
+				error_message += rollback_response['err_msg']
+
+			return {'err_msg': error_message}
+
+		# 7-10. Swap the temp DB in place of the target DB
+		return swap_restored_db(db_args, db_admin, temp_DB_name, response['restore_error'], analyze=db_args['analyze'])
+	finally:
+		db_admin.close()
+
+def pipe_postgres_to_postgres(db_args, db_admin, db_name, start_datetime):
+	"""
+	Restore a dump of the source DB into (existing) DB `db_name`, piping the pg_dump output into pg_restore
+	(running a single pg_restore worker, as parallel restores require a seekable archive),
+	with the settings of the restore profile (if any) applied to that DB while pg_restore runs.
+	When `archive` is set, the dump gets uploaded to S3 along the way (teed from the pipe), as a backup of src_env
+	named after `start_datetime`, which only gets completed and registered in the backup catalog once restored cleanly
+	(the upload gets aborted otherwise, so no backup gets archived by a failing copy).
+	Returns the pg_restore failure (as `restore_error`, None when restored cleanly),
+	or an error when pg_dump, the archive upload or its registration failed, or pg_restore got interrupted.
+	"""
+
+	archive_key = None
+	if db_args['archive']:
+		archive_key = '{identifier}/{env}/{date}.dump'.format(identifier=db_args['identifier'], env=db_args['src_env'],
+			date=start_datetime.strftime("%Y-%m-%d_%H-%M-%S"))
+		if db_args['compression'] in EXTERNAL_CODEC_SUFFIXES:
+			archive_key += EXTERNAL_CODEC_SUFFIXES[db_args['compression']]
+
+	# Only compress the dump when archiving it, pg_restore reads it locally otherwise
+	dump_command = 'pg_dump -Fc {COMPRESS} -v -d {DB_NAME}'.format(DB_NAME=db_args['src_db_name'],
+		COMPRESS=get_pg_dump_compress_option(db_args['compression'] if archive_key is not None else 'none', db_args['compression_level']))
+
+	dump_env = os.environ.copy()
+	dump_env["PGUSER"] = db_args['src_db_user']
+	dump_env["PGHOST"] = db_args['src_db_host']
+	dump_env["PGPASSWORD"] = db_args['src_db_password']
+
+	restore_cmd = 'pg_restore -Fc -v'
+	if 'ignore_privileges' in db_args:
+		restore_cmd += ' -O -x'
+	restore_cmd += ' -d {DB_NAME}'.format(DB_NAME=db_name)
+
+	restore_env = os.environ.copy()
+	restore_env["PGUSER"] = db_args['db_user']
+	restore_env["PGHOST"] = db_args['db_host']
+	restore_env["PGPASSWORD"] = db_args['db_password']
 
+	response = apply_restore_profile(db_args, db_admin, db_name)
+	if 'err_msg' in response:
+		return response
+
+	upload = None
+	estimated_size = None
+	if archive_key is not None:
+		s3_target = 's3://{s3_bucket}/{filename}'.format(s3_bucket=db_args['s3_bucket'], filename=archive_key)
+		logging.info("Archiving copied dump to {}...".format(s3_target))
+
+		s3_client = get_s3_client(db_args)
+		upload = MultipartStreamUpload(s3_client, db_args['s3_bucket'], archive_key,
+			part_size=db_args['transfer_part_size']*MIB, concurrency=db_args['transfer_concurrency'],
+			StorageClass=db_args['storage_class'], Metadata={METADATA_KEY: db_args['compression']})
+
+		# Progress gets reported against the size of the previous backup of src_env (when compressed alike)
+		if db_args['compression'] not in EXTERNAL_CODEC_SUFFIXES:
+			estimated_size = estimate_backup_size(db_args, db_args['src_env'])
+
+	logging.info("Copying DB {SRC_DB} at host {SRC_HOST} to DB {DB} at host {HOST}...".format(
+		SRC_DB=db_args['src_db_name'], SRC_HOST=db_args['src_db_host'], DB=db_name, HOST=db_args['db_host']))
+	with metrics.span('dump_and_restore') as phase, progress.track(total=estimated_size, estimated=estimated_size is not None) as tracked:
+		dump_runner = ProcessRunner(dump_command, 'pg_dump', env=dump_env, stdout='pipe', timeout=db_args['process_timeout']).start()
+		restore_runner = ProcessRunner(restore_cmd, 'pg_restore', env=restore_env, stdin=subprocess.PIPE, stdout='lines',
+			timeout=db_args['process_timeout']).start()
+
+		# The main thread pumps the dump from pg_dump to pg_restore (and the archive upload), stderr gets drained by the runners
+		dump_stream = TeeReader(dump_runner.stdout, restore_runner.process.stdin, progress_callback=tracked.advance)
+		pipe_error = None
+		try:
+			if upload is None:
+				while dump_stream.read(MIB):
+					pass
+			elif db_args['compression'] in EXTERNAL_CODEC_SUFFIXES:
+				upload.upload_stream(CompressingReader(dump_stream, db_args['compression'], db_args['compression_level']))
+			else:
+				upload.upload_stream(dump_stream)
+		except Exception as err:
+			pipe_error = err
+			dump_runner.cancel()
+			if not isinstance(err, BrokenPipeError):
+				restore_runner.cancel()
+
+		# End of the dump for pg_restore
+		try:
+			restore_runner.process.stdin.close()
+		except OSError:
+			pass
+
+		dump_exitcode = dump_runner.wait()
+		restore_runner.wait()
+		logging.debug("Dump restore process exited.")
+
+		archived = False
+		if upload is not None:
+			if pipe_error is None and dump_exitcode == 0 and restore_runner.exitcode == 0:
+				upload.complete()
+				set_checksum_tag(s3_client, db_args['s3_bucket'], archive_key, upload.sha256.hexdigest())
+				logging.info("Archived {size} bytes to {target} (sha256 {sha256}).".format(size=upload.bytes_uploaded, target=s3_target,
+					sha256=upload.sha256.hexdigest()))
+				archived = True
+			else:
+				logging.info("Not archiving the copied dump to {}, the copy failed.".format(s3_target))
+				upload.abort()
+
+		phase.set_bytes(dump_stream.size)
+		if pipe_error is not None or dump_exitcode != 0 or restore_runner.exitcode != 0:
+			phase.fail()
+
+	error_message = None
+	# pg_restore exiting before reading the complete dump breaks the pipe
+	if isinstance(pipe_error, BrokenPipeError):
+		error_message = restore_runner.failure_message()
+	elif pipe_error is not None:
+		error_message = "Copying dump to DB {DB} failed: {err}".format(DB=db_name, err=pipe_error)
+	elif dump_exitcode != 0:
+		error_message = dump_runner.failure_message()
+	elif restore_runner.timed_out or restore_runner.cancelled:
+		error_message = restore_runner.failure_message()
+
+	if archived:
+		with metrics.span('catalog_update') as catalog_phase:
+			archive = {'key': archive_key, 'size': upload.bytes_uploaded, 'sha256': upload.sha256.hexdigest()}
+			if db_args['compression'] in EXTERNAL_CODEC_SUFFIXES:
+				archive['dump_size'] = dump_stream.size
+			if not add_backup_to_catalog(db_args, db_args['src_env'], archive, start_datetime.strftime("%Y-%m-%d_%H-%M-%S"),
+			                             start_datetime):
+				catalog_phase.fail()
+				error_message = "Archive {key} was uploaded, but could not be registered in the backup catalog.".format(key=archive_key)
+
+	response = remove_restore_profile(db_args, db_admin, db_name)
+	if error_message is not None:
 		return {'err_msg': error_message}
+	if 'err_msg' in response:
+		return response
+
+	return {'restore_error': restore_runner.failure_message() if restore_runner.exitcode != 0 else None}
+
+def list_restore_items(tmp_local_filepath, backup_format, restore_list_path=None):
+	"""
+	Return the dump IDs of all TOC items to restore (as listed in `restore_list_path`, when defined).
+	Returns an empty set when the archive cannot be listed (which pg_restore reports itself).
+	"""
+
+	if restore_list_path is not None:
+		with open(restore_list_path) as restore_list:
+			return set(entry['id'] for entry in parse_toc(line.rstrip('\n') for line in restore_list))
+
+	toc_lines = []
+	list_cmd = 'pg_restore -l -F{FORMAT} {FILENAME}'.format(FORMAT='d' if backup_format == 'directory' else 'c', FILENAME=tmp_local_filepath)
+	runner = ProcessRunner(list_cmd, 'pg_restore', stdout='lines', line_callback=toc_lines.append, log_output=False)
+	if runner.run() != 0:
+		return set()
+
+	return set(entry['id'] for entry in parse_toc(toc_lines))
+
+@metrics.timed_phase('optimize')
+def optimize_restored_db(db_args, db_name, analyze=True, prewarm=True):
+	"""
+	Prepare restored DB `db_name` for application traffic before swapping it in:
+	collect planner statistics for all tables (ANALYZE in stages, by `restore_jobs` parallel vacuumdb workers),
+	and load the `prewarm` tables most used in the (current) target DB, along with their indexes,
+	into the shared buffer cache (through pg_prewarm).
+	"""
+
+	if analyze:
+		analyze_cmd = 'vacuumdb --analyze-in-stages -j {JOBS} -d {DB_NAME}'.format(JOBS=db_args['restore_jobs'], DB_NAME=db_name)
+
+		pg_env = os.environ.copy()
+		pg_env["PGUSER"] = db_args['db_user']
+		pg_env["PGHOST"] = db_args['db_host']
+		pg_env["PGPASSWORD"] = db_args['db_password']
+
+		logging.info("Analyzing DB {}...".format(db_name))
+		with metrics.span('analyze') as phase:
+			runner = ProcessRunner(analyze_cmd, 'vacuumdb', env=pg_env, stdout='lines', timeout=db_args['process_timeout'])
+			if runner.run() != 0:
+				phase.fail()
+
+				return {'err_msg': runner.failure_message()}
+
+	if prewarm and db_args['prewarm'] != None:
+		with metrics.span('prewarm'):
+			try:
+				blocks = prewarm_hot_tables(db_args, db_name, db_args['prewarm'])
+			except psycopg2.Error as err:
+				error_message = "Prewarming DB {DB} failed: {err}".format(DB=db_name, err=err)
+
+				return {'err_msg': error_message}
+
+		logging.info("Loaded {blocks} blocks of the {count} most used tables into the cache.".format(
+			blocks=blocks, count=db_args['prewarm']))
 
 	return {}
 
-def get_latest_s3_backup(bucket_name, prefix):
+def prewarm_hot_tables(db_args, db_name, count):
+	"""
+	Load the `count` most used tables of the target DB (by blocks accessed, as the target DB reports),
+	along with their indexes, from DB `db_name` into the shared buffer cache.
+	Returns the number of blocks loaded.
+	"""
+
+	target_connection = DbAdminConnection(db_args, maintenance_db=db_args['db_name'])
+	try:
+		hot_tables = target_connection.execute('SELECT schemaname, relname FROM pg_statio_user_tables'
+		                                       ' ORDER BY coalesce(heap_blks_read, 0) + coalesce(heap_blks_hit, 0) DESC LIMIT %s',
+		                                       (count,))
+	finally:
+		target_connection.close()
+
+	if not hot_tables:
+		return 0
+
+	logging.info("Prewarming tables {}...".format(', '.join('{}.{}'.format(schema, table) for schema, table in hot_tables)))
+	restored_connection = DbAdminConnection(db_args, maintenance_db=db_name)
+	try:
+		# Only keep the extension in the restored DB when it was part of the backup
+		created_extension = not restored_connection.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")
+		if created_extension:
+			restored_connection.execute('CREATE EXTENSION pg_prewarm')
+
+		rows = restored_connection.execute(
+			"WITH hot_table AS (SELECT to_regclass(format('%%I.%%I', schema, name)) AS oid"
+			"                   FROM unnest(%s::text[], %s::text[]) AS hot(schema, name))"
+			" SELECT coalesce(sum(pg_prewarm(relation.oid)), 0) FROM pg_class relation"
+			" WHERE relation.relkind IN ('r', 'm', 'i')"
+			"  AND (relation.oid IN (SELECT oid FROM hot_table)"
+			"       OR relation.oid IN (SELECT indexrelid FROM pg_index WHERE indrelid IN (SELECT oid FROM hot_table)))",
+			([ schema for schema, _ in hot_tables ], [ table for _, table in hot_tables ]))
+
+		if created_extension:
+			restored_connection.execute('DROP EXTENSION pg_prewarm')
+	finally:
+		restored_connection.close()
+
+	return rows[0][0]
+
+def get_restore_template_name(db_args, backup_entry):
+	"""
+	Name the template DB holding a restored backup after its identifier and timestamp,
+	suffixed by a digest of the backup (version) and the restore options defining the restored content.
+	"""
+
+	variant = json.dumps([backup_entry['key'], backup_entry['etag'], 'ignore_privileges' in db_args, db_args['analyze']] +
+	                     [ db_args[filter_arg] for filter_arg in TOC_FILTER_ARGS ])
+	digest = hashlib.sha256(variant.encode()).hexdigest()[:8]
+	timestamp = re.sub(r'[^0-9_]', '', backup_entry['timestamp'])
+
+	# DB names are limited to 63 characters
+	identifier_length = 63 - len(RESTORE_TEMPLATE_PREFIX) - len(timestamp) - len(digest) - 2
+	identifier = re.sub(r'[^a-z0-9_]', '_', db_args['identifier'].lower())[:identifier_length]
 
-	s3 = boto3.client('s3')
-	paginator = s3.get_paginator( "list_objects_v2" )
+	return '{prefix}{identifier}_{timestamp}_{digest}'.format(prefix=RESTORE_TEMPLATE_PREFIX, identifier=identifier,
+		timestamp=timestamp, digest=digest)
 
-	logging.debug('Finding latest backup in bucket {bucket} with prefix {prefix}...'.format(bucket=bucket_name, prefix=prefix))
-	page_iterator = paginator.paginate(Bucket=bucket_name, Prefix=prefix)
-	latest_all = None
-	for page in page_iterator:
-		if "Contents" in page:
-			latest_page = max(page['Contents'], key=lambda x: x['LastModified'])
-			if latest_all is None or latest_page['LastModified'] > latest_all['LastModified']:
-				latest_all = latest_page
+def find_restore_template(db_admin, template_name):
+	"""Return the details of template DB `template_name` (None when not found)."""
 
-	if latest_all == None:
-		logging.error('No backups found in bucket {bucket} with prefix {prefix}...'.format(bucket=bucket_name, prefix=prefix))
+	try:
+		comment = db_admin.get_template_comment(template_name)
+	except psycopg2.Error as err:
+		logging.warning('Looking up template DB {name} failed: {err}'.format(name=template_name, err=err))
 		return None
-	else:
-		return latest_all['Key']
+
+	if comment is None:
+		return None
+
+	return parse_template_details(comment)
+
+def parse_template_details(comment):
+	try:
+		details = json.loads(comment)
+	except ValueError:
+		return {}
+
+	return details if isinstance(details, dict) else {}
+
+def restore_from_template(db_args, db_admin, temp_DB_name, template, tmp_local_filepath, backup_format, downloaded_size,
+                          restore_list_path=None):
+	"""
+	Run steps 1 to 6 of restore_s3_to_postgres for a single target DB by cloning
+	(a file-level copy of) a pristine template DB holding the restored backup as temp DB.
+	When not found on the target DB host, the template DB gets built from the DB dump file first,
+	before touching the target DB (see build_restore_template).
+	Returns the pg_restore failure of the template DB build (as `restore_error`, None when restored cleanly).
+	"""
+
+	# Building, cloning and evicting a template DB never overlap (across all restores to the DB host)
+	try:
+		db_admin.lock(template['name'])
+	except psycopg2.Error as err:
+		error_message = "Locking template DB {name} failed: {err}".format(name=template['name'], err=err)
+
+		return {'err_msg': error_message}
+
+	try:
+		details = find_restore_template(db_admin, template['name'])
+		if details is None:
+			if tmp_local_filepath is None:
+				error_message = "Template DB {} was evicted while restoring, retry the restore.".format(template['name'])
+
+				return {'err_msg': error_message}
+
+			response = build_restore_template(db_args, db_admin, template, tmp_local_filepath, backup_format, downloaded_size,
+			                                  restore_list_path)
+			if 'err_msg' in response:
+				return response
+
+			details = response['details']
+		else:
+			logging.info("Found template DB {} holding the backup.".format(template['name']))
+
+		# 1-5. Prepare the target DB and clone the template DB
+		response = prepare_restore_target(db_args, db_admin, temp_DB_name, template=template['name'])
+
+		if 'err_msg' in response:
+			return response
+
+		# Keep the most recently used template DBs
+		details['last_used'] = time.time()
+		try:
+			db_admin.set_comment(template['name'], json.dumps(details))
+		except psycopg2.Error as err:
+			logging.warning('Recording use of template DB {name} failed: {err}'.format(name=template['name'], err=err))
+
+		evict_restore_templates(db_args, db_admin, keep_name=template['name'])
+	finally:
+		db_admin.unlock(template['name'])
+
+	return {'restore_error': details.get('restore_error')}
+
+@metrics.timed_phase('build_template')
+def build_restore_template(db_args, db_admin, template, tmp_local_filepath, backup_format, downloaded_size,
+                           restore_list_path=None):
+	"""
+	Restore the DB dump file into a new template DB (refusing all connections, so it stays pristine),
+	recording the backup it holds (and any pg_restore failure, reported by every restore cloning it) as its comment.
+	Returns the recorded details.
+	"""
+
+	logging.info("Creating template DB {}...".format(template['name']))
+	try:
+		# Drop any leftovers of an earlier incomplete build
+		if db_admin.database_exists(template['name']):
+			db_admin.drop_template(template['name'])
+		db_admin.create_database(template['name'])
+	except psycopg2.Error as err:
+		error_message = "Creating template DB failed: {}".format(err)
+
+		return {'err_msg': error_message}
+
+	response = run_pg_restore(db_args, db_admin, template['name'], tmp_local_filepath, backup_format, downloaded_size,
+	                          restore_list_path)
+
+	# Never keep a partially restored (or restore-tuned) template DB
+	if 'err_msg' in response or response['runner'].timed_out or response['runner'].cancelled:
+		error_message = response['err_msg'] if 'err_msg' in response else response['runner'].failure_message()
+
+		logging.info("Dropping template DB {}...".format(template['name']))
+		try:
+			db_admin.drop_database(template['name'])
+		except psycopg2.Error as err:
+			error_message += "Dropping template DB failed: {}".format(err)
+
+		return {'err_msg': error_message}
+
+	runner_dbrestore = response['runner']
+
+	if db_args['analyze']:
+		response = optimize_restored_db(db_args, template['name'], analyze=True, prewarm=False)
+		if 'err_msg' in response:
+			logging.warning("Analyzing template DB {name} failed: {err}".format(name=template['name'], err=response['err_msg']))
+
+	details = {
+		'key': template['key'],
+		'etag': template['etag'],
+		'created': time.time(),
+		'restore_error': runner_dbrestore.failure_message() if runner_dbrestore.exitcode != 0 else None
+	}
+
+	logging.info("Marking DB {} as template...".format(template['name']))
+	try:
+		db_admin.mark_template(template['name'], json.dumps(details))
+	except psycopg2.Error as err:
+		error_message = "Marking DB {name} as template failed: {err}".format(name=template['name'], err=err)
+
+		return {'err_msg': error_message}
+
+	return {'details': details}
+
+def evict_restore_templates(db_args, db_admin, keep_name=None):
+	"""
+	Drop the template DBs (of restored backups) on the DB host left unused for more than `template_max_age` days,
+	and the least recently used ones beyond `template_max_count`.
+	Template DB `keep_name` and template DBs in use (locked by any restore) are never evicted.
+	"""
+
+	try:
+		templates = []
+		for template_name, comment in db_admin.list_templates(RESTORE_TEMPLATE_PREFIX):
+			details = parse_template_details(comment or '')
+			templates.append((details.get('last_used', details.get('created', 0)), template_name))
+		# Most recently used first
+		templates.sort(reverse=True)
+
+		now = time.time()
+		for position, (last_used, template_name) in enumerate(templates):
+			if template_name == keep_name:
+				continue
+			if position < db_args['template_max_count'] and now - last_used <= db_args['template_max_age']*24*3600:
+				continue
+
+			if not db_admin.try_lock(template_name):
+				logging.debug('Template DB {} in use, not evicting.'.format(template_name))
+				continue
+
+			try:
+				logging.info('Evicting template DB {}...'.format(template_name))
+				db_admin.drop_template(template_name)
+			finally:
+				db_admin.unlock(template_name)
+	except psycopg2.Error as err:
+		logging.warning('Evicting template DBs failed: {}'.format(err))
+
+@metrics.timed_phase('validate')
+def validate_backup_archive(local_path, backup_format):
+	"""
+	Sanity check a downloaded DB dump by reading its table of contents (TOC),
+	which fails fast on archives with a corrupt header or TOC.
+	Returns the (verbose) TOC listing lines, as `toc_lines`.
+	"""
+
+	toc_lines = []
+	toc_entries = []
+	def collect_toc_line(line):
+		toc_lines.append(line)
+		# TOC listing lines starting with ';' are comments
+		if line and not line.startswith(';'):
+			toc_entries.append(line)
+
+	list_cmd = 'pg_restore -l -v -F{FORMAT} {FILENAME}'.format(FORMAT='d' if backup_format == 'directory' else 'c', FILENAME=local_path)
+	runner = ProcessRunner(list_cmd, 'pg_restore', stdout='lines', line_callback=collect_toc_line, log_output=False)
+	exitcode = runner.run()
+	if exitcode != 0:
+		error_message = "Invalid backup archive {file}: {reason}".format(file=local_path, reason=runner.failure_message())
+
+		return {'err_msg': error_message}
+
+	if not toc_entries:
+		error_message = "Invalid backup archive {file}: table of contents is empty.".format(file=local_path)
+
+		return {'err_msg': error_message}
+
+	logging.info("Backup archive {file} holds {count} TOC entries.".format(file=local_path, count=len(toc_entries)))
+
+	return {'toc_lines': toc_lines}
+
+def write_restore_list(toc_lines, db_args):
+	"""
+	Write the list of TOC entries to restore (for pg_restore -L), as selected by the schema and table filters
+	of db_args. Returns the path of the list file, or None when restoring the complete archive.
+	"""
+
+	if all(db_args[filter_arg] == None for filter_arg in TOC_FILTER_ARGS):
+		return None
+
+	selected_entries = filter_toc(parse_toc(toc_lines), **{ filter_arg: db_args[filter_arg] for filter_arg in TOC_FILTER_ARGS })
+
+	list_fd, list_path = tempfile.mkstemp(prefix='pg_restore-', suffix='.list')
+	with os.fdopen(list_fd, 'w') as list_file:
+		for entry in selected_entries:
+			list_file.write(entry['line']+"\n")
+
+	return list_path
+
+@metrics.timed_phase('prepare_target')
+def prepare_restore_target(db_args, db_admin, temp_DB_name, template=None):
+	"""
+	Run the DB preparation steps of a restore (steps 1 to 5 of restore_s3_to_postgres),
+	once the DB dump file was downloaded and verified.
+	The temp DB gets created as a clone of template DB `template`, when defined.
+	"""
+
+	# Query and store current DB connection limit (for restore after DB restore completed)
+	logging.info("Retrieving connection limit for DB {DB} at host {HOST}...".format(DB=db_args['db_name'], HOST=db_args['db_host']))
+	try:
+		connlimit = db_admin.get_connection_limit(db_args['db_name'])
+	except psycopg2.Error as err:
+		error_message = "Retrieving DB connection limit failed: {}".format(err)
+
+		return {'err_msg': error_message}
+
+	if connlimit is None:
+		error_message = "DB {DB} not found at host {HOST}.".format(DB=db_args['db_name'], HOST=db_args['db_host'])
+
+		return {'err_msg': error_message}
+
+	logging.info("\tCurrent connection limit for DB: {connlimit}".format(connlimit=connlimit))
+
+	steps = [
+		# 1.  Refuse all new connections to target DB
+		("Refusing all new connections to DB...", "Updating DB to refuse new connections failed",
+		 lambda: db_admin.set_connection_limit(db_args['db_name'], 0)),
+		# 2.  Terminate all open connections to target DB
+		("Dropping all existing connections to DB...", "Dropping all existing connections to DB failed",
+		 lambda: db_admin.terminate_connections(db_args['db_name'])),
+		# 3.  Put target DB in readonly mode
+		("Update DB to become read-only...", "Updating DB to be read-only failed",
+		 lambda: db_admin.set_read_only(db_args['db_name'])),
+		# 4.  Re-enable new connections to target DB
+		("Allowing new (read-only) connections to DB...", "Re-enabling DB connections (read-only) failed",
+		 lambda: db_admin.set_connection_limit(db_args['db_name'], connlimit)),
+		# 5.  Create a new, temporarily named, DB
+		("Creating new (temp) DB {}{}...".format(temp_DB_name, ' from template DB '+template if template else ''),
+		 "Creating temp DB failed",
+		 lambda: db_admin.create_database(temp_DB_name, template=template))
+	]
+
+	for log_message, error_description, step in steps:
+		logging.info(log_message)
+		try:
+			step()
+		except psycopg2.Error as err:
+			error_message = "{description}: {err}".format(description=error_description, err=err)
+
+			return {'err_msg': error_message}
+
+	return {}
+
+@metrics.timed_phase('rollback_target')
+def rollback_restore_target(db_args, db_admin, temp_DB_name):
+	"""
+	Revert the DB preparation steps of a restore (steps 1 to 5 of restore_s3_to_postgres)
+	when the restore cannot continue: drop the temp DB and make the target DB writable again.
+	"""
+
+	logging.info("Dropping temp DB {}...".format(temp_DB_name))
+	try:
+		db_admin.drop_database(temp_DB_name, if_exists=True)
+	except psycopg2.Error as err:
+		error_message = "Dropping temp DB failed: {}".format(err)
+
+		return {'err_msg': error_message}
+
+	logging.info("Reverting DB to be writable...")
+	try:
+		db_admin.reset_read_only(db_args['db_name'])
+	except psycopg2.Error as err:
+		error_message = "Reverting DB to be writable failed: {}".format(err)
+
+		return {'err_msg': error_message}
+
+	return {}
+
+def download_dump_file(s3_client, bucket, key, filepath, part_size, concurrency, sha256=None, progress_callback=None):
+	"""
+	Download a custom-format dump file to `filepath` (see download_file_parallel),
+	verifying its `sha256` checksum (or the checksum it was tagged with, when undefined)
+	and transparently decompressing it when compressed by this application (as recorded in its metadata).
+	Returns the downloaded object size (in bytes). Raises on failure.
+	"""
+
+	if sha256 is None:
+		sha256 = get_checksum_tag(s3_client, bucket, key)
+	if sha256 is None:
+		logging.warning("No checksum recorded for s3://{bucket}/{key}, skipping checksum verification.".format(bucket=bucket, key=key))
+
+	head = s3_client.head_object(Bucket=bucket, Key=key)
+	codec = head.get('Metadata', {}).get(METADATA_KEY)
+	if codec not in EXTERNAL_CODEC_SUFFIXES:
+		return download_file_parallel(s3_client, bucket, key, filepath, part_size, concurrency, sha256, progress_callback)
+
+	compressed_filepath = filepath+EXTERNAL_CODEC_SUFFIXES[codec]
+	try:
+		size = download_file_parallel(s3_client, bucket, key, compressed_filepath, part_size, concurrency, sha256,
+		                              progress_callback)
+		logging.info("Decompressing {file} ({codec})...".format(file=compressed_filepath, codec=codec))
+		decompress_file(compressed_filepath, filepath, codec)
+	finally:
+		os.remove(compressed_filepath)
+
+	return size
+
+def get_pg_dump_major_version():
+	version_output = subprocess.run(['pg_dump', '--version'], stdout=subprocess.PIPE, check=True).stdout.decode()
+	# Output format: "pg_dump (PostgreSQL) 15.4"
+	return int(re.search(r'(\d+)', version_output.split(')')[-1]).group(1))
+
+def remove_local_backup(local_path):
+	if os.path.isdir(local_path):
+		shutil.rmtree(local_path, ignore_errors=True)
+	elif os.path.exists(local_path):
+		os.remove(local_path)
+
+@metrics.timed_phase('find_backup')
+def find_s3_backup(bucket_name, identifier, env, timestamp=''):
+	"""
+	Find the latest backup for an identifier and env (optionally matching a timestamp prefix)
+	through the backup catalog. Falls back to listing all backups (rebuilding the catalog)
+	when the catalog is missing or holds no matching backup.
+	Returns the backup's catalog entry, or None when no matching backup was found.
+	"""
+
+	s3 = get_boto3_client('s3')
+	catalog_key = get_catalog_key(identifier, env)
+	backup_prefix = '{identifier}/{env}/'.format(identifier=identifier, env=env)
+
+	catalog, _ = load_catalog(s3, bucket_name, catalog_key)
+	if catalog is not None:
+		entry = find_catalog_entry(catalog, timestamp)
+		if entry is not None:
+			logging.debug('Found backup {key} in catalog {catalog}.'.format(key=entry['key'], catalog=catalog_key))
+			return entry
+
+	logging.info('No matching backup found in catalog {}, falling back to listing...'.format(catalog_key))
+	catalog = rebuild_catalog(s3, bucket_name, catalog_key, backup_prefix, BACKUP_KEY_SUFFIXES)
+	entry = find_catalog_entry(catalog, timestamp)
+	if entry is None:
+		logging.error('No backups found in bucket {bucket} with prefix {prefix}...'.format(bucket=bucket_name, prefix=backup_prefix+timestamp))
+		return None
+
+	return entry
+
+@metrics.timed_phase('list')
+def list_s3_backups(db_args):
+	"""
+	List all available backups for the identifier and target_env from the backup catalog
+	(rebuilding the catalog from a listing if none exists yet).
+	"""
+
+	s3 = get_s3_client(db_args)
+	catalog_key = get_catalog_key(db_args['identifier'], db_args['target_env'])
+
+	catalog, _ = load_catalog(s3, db_args['s3_bucket'], catalog_key)
+	if catalog is None:
+		backup_prefix = '{identifier}/{env}/'.format(identifier=db_args['identifier'], env=db_args['target_env'])
+		catalog = rebuild_catalog(s3, db_args['s3_bucket'], catalog_key, backup_prefix, BACKUP_KEY_SUFFIXES)
+
+	lines = [ '{timestamp:<20} {size:>16} {duration:>10} {key}'.format(timestamp='TIMESTAMP', size='SIZE (bytes)',
+	                                                                   duration='DURATION', key='KEY') ]
+	for entry in catalog['backups']:
+		lines.append('{timestamp:<20} {size:>16} {duration:>10} {key}'.format(timestamp=entry['timestamp'],
+			size=entry['size'] if entry['size'] is not None else '-',
+			duration='{:.0f}s'.format(entry['duration']) if entry['duration'] is not None else '-',
+			key=entry['key']))
+
+	return {'backup_list': "\n".join(lines)}
+
+@metrics.timed_phase('prune')
+def prune_s3_backups(db_args):
+	"""
+	Prune the backups of the identifier and target_env by grandfather-father-son retention
+	(see retention.select_retained_backups), as found by a single listing pass of the backup prefix.
+	When hot_backups is defined, the newest hot_backups retained backups get moved to the STANDARD storage class
+	(for fast and cheap restores) and all older ones to GLACIER_IR.
+	The chunks of hot deduplicated backups get moved to STANDARD as well, but never back to GLACIER_IR
+	(as chunks are shared by the backups of all envs of the identifier).
+	Pruned backups get removed from the catalog before being deleted (in batches),
+	after which chunks no longer referenced by any deduplicated backup of the identifier get deleted.
+	"""
+
+	s3 = get_s3_client(db_args)
+	backup_prefix = '{identifier}/{env}/'.format(identifier=db_args['identifier'], env=db_args['target_env'])
+
+	with metrics.span('list'):
+		backups = list_backup_objects(s3, db_args['s3_bucket'], backup_prefix, BACKUP_KEY_SUFFIXES)
+
+	retained = select_retained_backups([ backup['timestamp'] for backup in backups ],
+		**{ retention_arg: db_args[retention_arg] for retention_arg in RETENTION_ARGS })
+	pruned_backups = [ backup for backup in backups if backup['timestamp'] not in retained ]
+	retained_backups = [ backup for backup in backups if backup['timestamp'] in retained ]
+
+	# Storage class of every retained backup (newest first), unless left as stored
+	storage_classes = {}
+	if db_args['hot_backups'] != None:
+		for position, backup in enumerate(reversed(retained_backups)):
+			storage_classes[backup['key']] = 'STANDARD' if position < db_args['hot_backups'] else 'GLACIER_IR'
+
+	lines = [ '{timestamp:<20} {action:<8} {storage_class:<12} {key}'.format(timestamp='TIMESTAMP', action='ACTION',
+	                                                                        storage_class='STORAGE', key='KEY') ]
+	for backup in backups:
+		lines.append('{timestamp:<20} {action:<8} {storage_class:<12} {key}'.format(timestamp=backup['timestamp'],
+			action='keep' if backup['timestamp'] in retained else 'prune',
+			storage_class=storage_classes.get(backup['key'], '-'), key=backup['key']))
+	prune_report = "\n".join(lines)
+
+	logging.info("Keeping {kept} of {count} backups under {prefix}, pruning {pruned}.".format(
+		kept=len(retained_backups), count=len(backups), prefix=backup_prefix, pruned=len(pruned_backups)))
+
+	if db_args['dry_run']:
+		logging.info("Dry run, not modifying any backups.")
+		return {'prune_report': prune_report}
+
+	# Move retained backups (all of their files) to their storage class
+	updated_etags = {}
+	with metrics.span('transition') as phase:
+		transitioned_size = 0
+		for backup in retained_backups:
+			storage_class = storage_classes.get(backup['key'])
+			for obj in backup['objects']:
+				if storage_class is None or obj.get('StorageClass', 'STANDARD') == storage_class:
+					continue
+
+				logging.info("Moving {key} to storage class {storage_class}...".format(key=obj['Key'], storage_class=storage_class))
+				try:
+					etag = change_storage_class(s3, db_args['s3_bucket'], obj['Key'], storage_class,
+						part_size=db_args['transfer_part_size']*MIB, concurrency=db_args['transfer_concurrency'])
+				except Exception as err:
+					phase.fail()
+					error_message = "Moving {key} to storage class {storage_class} failed: {err}".format(
+						key=obj['Key'], storage_class=storage_class, err=err)
+
+					return {'err_msg': error_message}
+
+				transitioned_size += obj['Size']
+				if obj['Key'] == backup['key']:
+					updated_etags[obj['Key']] = etag
+		phase.set_bytes(transitioned_size)
+
+	hot_recipe_keys = [ backup['key'] for backup in retained_backups
+	                    if backup['key'].endswith(RECIPE_SUFFIX) and storage_classes.get(backup['key']) == 'STANDARD' ]
+	if hot_recipe_keys:
+		with metrics.span('chunk_transition') as phase:
+			try:
+				count, size = move_referenced_chunks(s3, db_args['s3_bucket'], hot_recipe_keys, 'STANDARD',
+					concurrency=db_args['transfer_concurrency'])
+			except Exception as err:
+				phase.fail()
+				error_message = "Moving chunks of hot deduplicated backups to storage class STANDARD failed: {}".format(err)
+
+				return {'err_msg': error_message}
+
+			phase.set_bytes(size)
+			logging.info("Moved {count} chunks ({size} bytes) of hot deduplicated backups to storage class STANDARD.".format(
+				count=count, size=size))
+
+	# Restores must not find pruned backups anymore by the time they get deleted
+	pruned_keys = set(backup['key'] for backup in pruned_backups)
+	if pruned_keys or updated_etags:
+		with metrics.span('catalog_update'):
+			update_catalog(s3, db_args['s3_bucket'], get_catalog_key(db_args['identifier'], db_args['target_env']),
+				backup_prefix, BACKUP_KEY_SUFFIXES,
+				lambda entries: [ dict(entry, etag=updated_etags.get(entry['key'], entry['etag']))
+				                  for entry in entries if entry['key'] not in pruned_keys ])
+
+	with metrics.span('delete') as phase:
+		pruned_objects = [ obj for backup in pruned_backups for obj in backup['objects'] ]
+		errors = delete_objects(s3, db_args['s3_bucket'], [ obj['Key'] for obj in pruned_objects ])
+		if errors:
+			phase.fail()
+			error_message = "Failed to delete {count} objects of pruned backups:\n{errors}".format(
+				count=len(errors), errors="\n".join(errors))
+
+			return {'err_msg': error_message}
+
+		phase.set_bytes(sum(obj['Size'] for obj in pruned_objects))
+		logging.info("Deleted {objects} objects of {backups} pruned backups.".format(
+			objects=len(pruned_objects), backups=len(pruned_backups)))
+
+	# Deleting recipes may leave chunks of the (identifier-wide) chunk store unreferenced
+	if any(key.endswith(RECIPE_SUFFIX) for key in pruned_keys):
+		with metrics.span('chunk_gc'):
+			try:
+				collect_garbage_chunks(s3, db_args['s3_bucket'], db_args['identifier']+'/',
+					CHUNK_STORE_PREFIX.format(identifier=db_args['identifier']), CHUNK_LEASE_PREFIX.format(identifier=db_args['identifier']))
+			except Exception as err:
+				error_message = "Deleting unreferenced chunks failed: {}".format(err)
+
+				return {'err_msg': error_message}
+
+	return {'prune_report': prune_report}
+
+def parse_restore_profile(restore_profile):
+	"""
+	Parse a restore profile, defined as 'default' (DEFAULT_RESTORE_PROFILE)
+	or as comma-separated `setting=value` pairs. Returns the settings (dict), or None when invalid.
+	"""
+
+	if restore_profile == 'default':
+		return dict(DEFAULT_RESTORE_PROFILE)
+
+	settings = {}
+	for setting in restore_profile.split(','):
+		name, separator, value = setting.partition('=')
+		if not separator or not RESTORE_PROFILE_SETTING_RE.match(name.strip()) or not value.strip():
+			return None
+		settings[name.strip()] = value.strip()
+
+	return settings if settings else None
 
 def env_rank(env_name):
 	'''
@@ -468,8 +2562,6 @@ def env_rank(env_name):
 		return max(ENV_RANK.values())+1
 
 def lambda_handler(event, context):
+	lambda_interface = importlib.import_module('interfaces.lambda')
 	response = lambda_interface.lambda_handler(event, context)
 	return response
-
-if __name__ == '__main__':
-    cli_interface.cli_handler()
@@ -0,0 +1,41 @@
+import threading
+
+# boto3 (and botocore) only get imported once the first client is requested,
+# so help and argument validation paths start without loading them.
+# Clients get created once per service and region, and reused by all (concurrent) jobs of a run:
+# client creation (through the shared default session) is not thread-safe, the clients themselves are.
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_boto3_client(service_name, region_name=None, max_pool_connections=None):
+	"""
+	Return the shared client of a service (and region), with a connection pool
+	of at least `max_pool_connections` connections (DEFAULT_MAX_POOL_CONNECTIONS when undefined).
+	A client with a larger pool replaces the shared client when requested.
+	"""
+
+	with clients_lock:
+		client = clients.get((service_name, region_name))
+		if client is not None and (max_pool_connections is None or client.meta.config.max_pool_connections >= max_pool_connections):
+			return client
+
+		import boto3
+		from botocore.config import Config
+
+		config = Config(max_pool_connections=max(max_pool_connections or 0, DEFAULT_MAX_POOL_CONNECTIONS))
+		client = boto3.client(service_name, region_name=region_name, config=config)
+		clients[(service_name, region_name)] = client
+
+		return client
+
+def get_transfer_config(part_size, concurrency, threshold):
+	"""
+	Return the transfer configuration for boto3 managed transfers (upload_file),
+	uploading files larger than `threshold` bytes in parts of `part_size` bytes, `concurrency` parts at a time.
+	"""
+
+	from boto3.s3.transfer import TransferConfig
+
+	return TransferConfig(multipart_threshold=threshold, multipart_chunksize=part_size, max_concurrency=concurrency)
@@ -0,0 +1,176 @@
+import bisect
+import json
+import logging
+
+from chunk_store import RECIPE_SUFFIX
+
+# Every identifier/env keeps a catalog of its backups, sorted by timestamp,
+# so backups can be found without listing the (ever growing) backup prefix.
+CATALOG_KEY = '{identifier}/{env}/_catalog.json'
+CATALOG_UPDATE_ATTEMPTS = 5
+
+def get_catalog_key(identifier, env):
+	return CATALOG_KEY.format(identifier=identifier, env=env)
+
+def load_catalog(s3_client, bucket, catalog_key):
+	"""
+	Retrieve a catalog from S3.
+	Returns a tuple of the catalog and its ETag, or (None, None) when no catalog exists.
+	"""
+
+	try:
+		response = s3_client.get_object(Bucket=bucket, Key=catalog_key)
+	except s3_client.exceptions.ClientError as err:
+		if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+			return None, None
+		raise
+
+	return json.loads(response['Body'].read()), response['ETag']
+
+def store_catalog(s3_client, bucket, catalog_key, catalog, etag):
+	"""
+	Write a catalog to S3, only if it was not modified since it was read (as version `etag`,
+	or None if it did not exist yet). Returns False if the write was refused because of
+	a concurrent modification.
+	"""
+
+	put_args = {}
+	if etag is None:
+		put_args['IfNoneMatch'] = '*'
+	else:
+		put_args['IfMatch'] = etag
+
+	try:
+		s3_client.put_object(Bucket=bucket, Key=catalog_key, Body=json.dumps(catalog, indent=1).encode(),
+			ContentType='application/json', **put_args)
+	except s3_client.exceptions.ClientError as err:
+		if err.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+			return False
+		raise
+
+	return True
+
+def remove_catalog(s3_client, bucket, catalog_key):
+	"""Remove a catalog from S3 (to be rebuilt from a listing by the next lookup)."""
+
+	s3_client.delete_object(Bucket=bucket, Key=catalog_key)
+	logging.info('Removed catalog {}.'.format(catalog_key))
+
+def get_backup_timestamp(backup_key, backup_prefix, backup_key_suffixes):
+	"""Extract the timestamp from a backup key (`{backup_prefix}{timestamp}{suffix}`)."""
+
+	timestamp = backup_key[len(backup_prefix):]
+	for suffix in backup_key_suffixes:
+		if timestamp.endswith(suffix):
+			return timestamp[:-len(suffix)]
+
+	return timestamp
+
+def build_catalog_from_listing(s3_client, bucket, backup_prefix, backup_key_suffixes):
+	"""
+	Build a catalog by listing all (complete) backups under `backup_prefix` in a single listing pass.
+	Backup sizes of directory-format backups are summed from the listed files,
+	the sizes of deduplicated backups are unknown from a listing (None).
+	"""
+
+	logging.info('Building backup catalog from listing of {}...'.format(backup_prefix))
+
+	backups = {}
+	object_sizes = {}
+	paginator = s3_client.get_paginator('list_objects_v2')
+	for page in paginator.paginate(Bucket=bucket, Prefix=backup_prefix):
+		for obj in page.get('Contents', []):
+			object_sizes[obj['Key']] = obj['Size']
+			if obj['Key'].endswith(backup_key_suffixes):
+				backups[obj['Key']] = obj
+
+	entries = []
+	for key, obj in backups.items():
+		timestamp = get_backup_timestamp(key, backup_prefix, backup_key_suffixes)
+		if '/' in key[len(backup_prefix):]:
+			# Directory-format backup: sum all files under the backup's prefix
+			directory_prefix = backup_prefix+timestamp+'/'
+			size = sum(object_size for object_key, object_size in object_sizes.items()
+			           if object_key.startswith(directory_prefix))
+		elif key.endswith(RECIPE_SUFFIX):
+			size = None
+		else:
+			size = obj['Size']
+
+		entries.append({
+			'key': key,
+			'timestamp': timestamp,
+			'size': size,
+			'duration': None,
+			'etag': obj['ETag']
+		})
+
+	entries.sort(key=lambda entry: entry['timestamp'])
+
+	return {'backups': entries}
+
+def rebuild_catalog(s3_client, bucket, catalog_key, backup_prefix, backup_key_suffixes):
+	"""
+	Rebuild a catalog from a listing of the backup prefix, and store it (unless concurrently modified).
+	Returns the rebuilt catalog.
+	"""
+
+	_, etag = load_catalog(s3_client, bucket, catalog_key)
+	catalog = build_catalog_from_listing(s3_client, bucket, backup_prefix, backup_key_suffixes)
+	if not store_catalog(s3_client, bucket, catalog_key, catalog, etag):
+		logging.warning('Catalog {} was modified concurrently, rebuilt catalog not stored.'.format(catalog_key))
+
+	return catalog
+
+def update_catalog(s3_client, bucket, catalog_key, backup_prefix, backup_key_suffixes, update):
+	"""
+	Replace the entries of a catalog by the result of `update(entries)`,
+	creating the catalog from a listing when none exists yet.
+	Updates are atomic (conditional writes), concurrent updates are retried.
+	"""
+
+	for attempt in range(CATALOG_UPDATE_ATTEMPTS):
+		catalog, etag = load_catalog(s3_client, bucket, catalog_key)
+		if catalog is None:
+			catalog = build_catalog_from_listing(s3_client, bucket, backup_prefix, backup_key_suffixes)
+
+		entries = update(catalog['backups'])
+		entries.sort(key=lambda catalog_entry: catalog_entry['timestamp'])
+		catalog['backups'] = entries
+
+		if store_catalog(s3_client, bucket, catalog_key, catalog, etag):
+			return
+
+		logging.info('Catalog {} was modified concurrently, retrying update...'.format(catalog_key))
+
+	raise Exception('Failed to update catalog {} after {} attempts.'.format(catalog_key, CATALOG_UPDATE_ATTEMPTS))
+
+def add_catalog_entry(s3_client, bucket, catalog_key, backup_prefix, backup_key_suffixes, entry):
+	"""Add a backup entry to a catalog (see update_catalog)."""
+
+	update_catalog(s3_client, bucket, catalog_key, backup_prefix, backup_key_suffixes,
+		lambda entries: [ existing for existing in entries if existing['key'] != entry['key'] ] + [entry])
+	logging.info('Added backup {} to catalog {}.'.format(entry['key'], catalog_key))
+
+def find_catalog_entry(catalog, timestamp_prefix=''):
+	"""
+	Find the latest backup in a catalog whose timestamp starts with `timestamp_prefix`
+	(binary search on the sorted catalog entries). Returns None if no backup matches.
+	"""
+
+	entries = catalog['backups']
+	if not entries:
+		return None
+	if not timestamp_prefix:
+		return entries[-1]
+
+	# Position after the last timestamp starting with the prefix
+	position = bisect.bisect_right([ entry['timestamp'] for entry in entries ], timestamp_prefix+'\uffff')
+	if position == 0:
+		return None
+
+	entry = entries[position-1]
+	if not entry['timestamp'].startswith(timestamp_prefix):
+		return None
+
+	return entry
@@ -0,0 +1,330 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from compression import compress_bytes, decompress_bytes
+from s3_transfer import MIB, change_storage_class, delete_objects
+
+# Deduplicated backups are stored as a recipe object per backup,
+# listing the (content-addressed) chunks, shared by all backups of an identifier,
+# that make up the dump file.
+CHUNK_STORE_PREFIX = '{identifier}/_chunks/'
+CHUNK_CODEC_PREFIX = '{chunk_prefix}{codec}/'
+RECIPE_SUFFIX = '.recipe.json'
+# Running deduplicated backups hold a lease (an object of their own) on the chunk store,
+# keeping garbage collection from deleting the chunks they reuse before their recipe got stored.
+CHUNK_LEASE_PREFIX = '{identifier}/_chunk_leases/'
+
+CHUNK_AVG_SIZE = 4 * MIB
+CHUNK_MIN_SIZE = 1 * MIB
+CHUNK_MAX_SIZE = 16 * MIB
+# Amount of stream data to chunk at once (must be well above CHUNK_MAX_SIZE)
+CHUNK_READ_SIZE = 64 * MIB
+# Unreferenced chunks younger than this (in seconds) may belong to a backup still in progress
+CHUNK_GC_MIN_AGE = 24 * 3600
+# Leases older than this (in seconds) got left behind by backups that did not complete
+CHUNK_LEASE_MAX_AGE = 24 * 3600
+
+def iter_content_defined_chunks(stream):
+	"""
+	Split a binary stream into content-defined chunks (FastCDC),
+	so that unchanged data between two dumps results in identical chunks
+	even when data was inserted or removed before it.
+	"""
+
+	from fastcdc import fastcdc
+
+	carry = b''
+	while True:
+		block = stream.read(CHUNK_READ_SIZE)
+		data = carry + block if carry else block
+		if not data:
+			return
+
+		chunks = list(fastcdc(data, min_size=CHUNK_MIN_SIZE, avg_size=CHUNK_AVG_SIZE, max_size=CHUNK_MAX_SIZE))
+		view = memoryview(data)
+		if block:
+			# The last chunk was cut by the end of the buffer rather than by its content,
+			# carry it over to be re-chunked along with the next block.
+			last = chunks.pop()
+			carry = bytes(view[last.offset:])
+		else:
+			carry = b''
+
+		for chunk in chunks:
+			yield view[chunk.offset:chunk.offset+chunk.length]
+
+		if not block:
+			return
+
+def list_stored_chunks(s3_client, bucket, chunk_prefix):
+	"""Return the set of chunk hashes present in the chunk store."""
+
+	stored_chunks = set()
+	paginator = s3_client.get_paginator('list_objects_v2')
+	for page in paginator.paginate(Bucket=bucket, Prefix=chunk_prefix):
+		for obj in page.get('Contents', []):
+			stored_chunks.add(obj['Key'][len(chunk_prefix):])
+
+	return stored_chunks
+
+@contextmanager
+def chunk_store_lease(s3_client, bucket, lease_prefix):
+	"""
+	Hold a lease on a chunk store for the enclosed block (see collect_garbage_chunks),
+	which must include storing the recipe of the deduplicated backup.
+	"""
+
+	lease_key = lease_prefix+uuid.uuid4().hex
+	s3_client.put_object(Bucket=bucket, Key=lease_key, Body=b'')
+	try:
+		yield lease_key
+	finally:
+		try:
+			s3_client.delete_object(Bucket=bucket, Key=lease_key)
+		except Exception as err:
+			# The lease expires by itself (CHUNK_LEASE_MAX_AGE)
+			logging.warning('Failed to release chunk store lease {}: {}'.format(lease_key, err))
+
+def list_active_leases(s3_client, bucket, lease_prefix):
+	"""Return the keys of all leases younger than CHUNK_LEASE_MAX_AGE, and of all expired ones."""
+
+	now = time.time()
+	active_keys = []
+	expired_keys = []
+	paginator = s3_client.get_paginator('list_objects_v2')
+	for page in paginator.paginate(Bucket=bucket, Prefix=lease_prefix):
+		for obj in page.get('Contents', []):
+			if now - obj['LastModified'].timestamp() > CHUNK_LEASE_MAX_AGE:
+				expired_keys.append(obj['Key'])
+			else:
+				active_keys.append(obj['Key'])
+
+	return active_keys, expired_keys
+
+def upload_deduplicated(stream, s3_client, bucket, chunk_prefix, concurrency, storage_class, codec='zlib', level=None,
+                        progress_callback=None):
+	"""
+	Chunk a binary stream and upload all chunks not yet present in the chunk store
+	(compressed with `codec`, by up to `concurrency` parallel workers, under a prefix of that codec's own).
+	Returns the recipe describing how to rebuild the stream from the chunk store
+	(along with the SHA-256 checksum of the complete stream), which is only valid once stored along with the successful completion of the stream producer.
+	`progress_callback` (if defined) gets called with the size of every chunk processed (uploaded or already stored).
+	Raises the first upload error encountered (if any), or when chunks reused from the store got deleted meanwhile
+	(by a garbage collection started before the lease on the chunk store got taken, see chunk_store_lease).
+	"""
+
+	# Chunks get stored per codec, as recipes decompress all of their chunks with the codec they were uploaded with
+	codec_prefix = CHUNK_CODEC_PREFIX.format(chunk_prefix=chunk_prefix, codec=codec)
+	previously_stored_chunks = list_stored_chunks(s3_client, bucket, codec_prefix)
+	stored_chunks = set(previously_stored_chunks)
+	logging.info('Found {} chunks in chunk store {}.'.format(len(stored_chunks), codec_prefix))
+
+	recipe = {
+		'format': 'custom',
+		'compression': codec,
+		'chunk_prefix': codec_prefix,
+		'size': 0,
+		'uploaded_size': 0,
+		'chunks': []
+	}
+
+	stream_sha256 = hashlib.sha256()
+	errors = []
+	lock = threading.Lock()
+	slots = threading.BoundedSemaphore(concurrency)
+
+	def upload_chunk(chunk_hash, data):
+		try:
+			if errors:
+				return
+			compressed = compress_bytes(data, codec, level)
+			s3_client.put_object(Bucket=bucket, Key=codec_prefix+chunk_hash, Body=compressed, StorageClass=storage_class)
+			with lock:
+				recipe['uploaded_size'] += len(compressed)
+			if progress_callback is not None:
+				progress_callback(len(data))
+		except Exception as err:
+			logging.error('Upload of chunk {} failed: {}'.format(chunk_hash, err))
+			with lock:
+				errors.append(err)
+		finally:
+			slots.release()
+
+	with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='chunk-upload') as executor:
+		for chunk in iter_content_defined_chunks(stream):
+			if errors:
+				break
+
+			chunk_hash = hashlib.sha256(chunk).hexdigest()
+			stream_sha256.update(chunk)
+			recipe['chunks'].append([chunk_hash, len(chunk)])
+			recipe['size'] += len(chunk)
+
+			if chunk_hash in stored_chunks:
+				if progress_callback is not None:
+					progress_callback(len(chunk))
+				continue
+			stored_chunks.add(chunk_hash)
+
+			# Bound the amount of chunk data held in memory
+			slots.acquire()
+			executor.submit(upload_chunk, chunk_hash, bytes(chunk))
+
+	if errors:
+		raise errors[0]
+
+	# The stream data is gone by now, so chunks deleted meanwhile cannot get uploaded again
+	reused_chunks = set(chunk_hash for chunk_hash, _ in recipe['chunks']) & previously_stored_chunks
+	missing_chunks = reused_chunks - list_stored_chunks(s3_client, bucket, codec_prefix)
+	if missing_chunks:
+		raise Exception('{count} reused chunks got deleted from chunk store {prefix} while uploading (by garbage collection).'.format(
+			count=len(missing_chunks), prefix=codec_prefix))
+
+	recipe['sha256'] = stream_sha256.hexdigest()
+
+	logging.info('Stored {size} bytes as {count} chunks, of which {uploaded} bytes (compressed) were new.'.format(
+		size=recipe['size'], count=len(recipe['chunks']), uploaded=recipe['uploaded_size']))
+
+	return recipe
+
+def download_deduplicated(s3_client, bucket, recipe_key, filepath, concurrency, progress_callback=None):
+	"""
+	Rebuild the file described by a recipe into `filepath`,
+	fetching every unique chunk once (by up to `concurrency` parallel workers)
+	and writing it at all of its offsets in a preallocated file.
+	`progress_callback` (if defined) gets called with the number of bytes written for every chunk.
+	Returns the rebuilt file size (in bytes). Raises on failure.
+	"""
+
+	recipe = json.loads(s3_client.get_object(Bucket=bucket, Key=recipe_key)['Body'].read())
+
+	chunk_offsets = {}
+	offset = 0
+	for chunk_hash, size in recipe['chunks']:
+		chunk_offsets.setdefault(chunk_hash, []).append(offset)
+		offset += size
+
+	if offset != recipe['size']:
+		raise Exception('Invalid recipe {}: chunk sizes do not add up to the file size.'.format(recipe_key))
+
+	logging.debug('Rebuilding {} ({} bytes) from {} unique chunks...'.format(recipe_key, offset, len(chunk_offsets)))
+
+	fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+	try:
+		if recipe['size'] > 0:
+			try:
+				os.posix_fallocate(fd, 0, recipe['size'])
+			except (AttributeError, OSError):
+				os.ftruncate(fd, recipe['size'])
+
+		def download_chunk(chunk_hash, offsets):
+			response = s3_client.get_object(Bucket=bucket, Key=recipe['chunk_prefix']+chunk_hash)
+			data = decompress_bytes(response['Body'].read(), recipe['compression'])
+			if hashlib.sha256(data).hexdigest() != chunk_hash:
+				raise Exception('Checksum verification failed for chunk {}.'.format(chunk_hash))
+
+			for chunk_offset in offsets:
+				written = 0
+				while written < len(data):
+					written += os.pwrite(fd, memoryview(data)[written:], chunk_offset + written)
+			if progress_callback is not None:
+				progress_callback(len(data) * len(offsets))
+
+		with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='chunk-download') as executor:
+			futures = [ executor.submit(download_chunk, chunk_hash, offsets) for chunk_hash, offsets in chunk_offsets.items() ]
+			try:
+				for future in futures:
+					future.result()
+			except Exception:
+				for future in futures:
+					future.cancel()
+				raise
+	finally:
+		os.close(fd)
+
+	return recipe['size']
+
+def move_referenced_chunks(s3_client, bucket, recipe_keys, storage_class, concurrency):
+	"""
+	Move all chunks referenced by the recipes `recipe_keys` to `storage_class` (unless stored as such already),
+	by up to `concurrency` parallel workers.
+	Returns the number and total size (in bytes) of the chunks moved. Raises on failure.
+	"""
+
+	chunk_keys = set()
+	chunk_prefixes = set()
+	for recipe_key in recipe_keys:
+		recipe = json.loads(s3_client.get_object(Bucket=bucket, Key=recipe_key)['Body'].read())
+		chunk_prefixes.add(recipe['chunk_prefix'])
+		chunk_keys.update(recipe['chunk_prefix']+chunk_hash for chunk_hash, _ in recipe['chunks'])
+
+	moved_chunks = []
+	paginator = s3_client.get_paginator('list_objects_v2')
+	for chunk_prefix in chunk_prefixes:
+		for page in paginator.paginate(Bucket=bucket, Prefix=chunk_prefix):
+			for obj in page.get('Contents', []):
+				if obj['Key'] in chunk_keys and obj.get('StorageClass', 'STANDARD') != storage_class:
+					moved_chunks.append(obj)
+
+	logging.info('Moving {moved} of {count} referenced chunks to storage class {storage_class}...'.format(
+		moved=len(moved_chunks), count=len(chunk_keys), storage_class=storage_class))
+	# Chunks are far below the size requiring a multipart copy
+	with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='chunk-copy') as executor:
+		list(executor.map(lambda obj: change_storage_class(s3_client, bucket, obj['Key'], storage_class, CHUNK_MAX_SIZE, 1),
+		                  moved_chunks))
+
+	return len(moved_chunks), sum(obj['Size'] for obj in moved_chunks)
+
+def collect_garbage_chunks(s3_client, bucket, identifier_prefix, chunk_prefix, lease_prefix, min_age=CHUNK_GC_MIN_AGE):
+	"""
+	Delete all chunks of a chunk store (of any codec) no longer referenced by any recipe under `identifier_prefix`
+	(the deduplicated backups of all envs of the identifier), skipping chunks younger than `min_age` seconds.
+	Recipes of deduplicated backups running concurrently are not stored yet, so nothing gets deleted
+	while any of them holds a lease on the chunk store (see chunk_store_lease), expired leases get deleted.
+	Returns the number of deleted chunks (None when skipped). Raises on failure.
+	"""
+
+	active_leases, expired_leases = list_active_leases(s3_client, bucket, lease_prefix)
+	if active_leases:
+		logging.info('Not deleting unreferenced chunks from chunk store {prefix}, {count} deduplicated backups are running.'.format(
+			prefix=chunk_prefix, count=len(active_leases)))
+		return None
+
+	referenced_chunks = set()
+	paginator = s3_client.get_paginator('list_objects_v2')
+	for page in paginator.paginate(Bucket=bucket, Prefix=identifier_prefix, Delimiter='/'):
+		for env_prefix in page.get('CommonPrefixes', []):
+			if env_prefix['Prefix'] in (chunk_prefix, lease_prefix):
+				continue
+			for env_page in paginator.paginate(Bucket=bucket, Prefix=env_prefix['Prefix']):
+				for obj in env_page.get('Contents', []):
+					if obj['Key'].endswith(RECIPE_SUFFIX):
+						recipe = json.loads(s3_client.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read())
+						referenced_chunks.update(recipe['chunk_prefix']+chunk_hash for chunk_hash, _ in recipe['chunks'])
+
+	now = time.time()
+	garbage_keys = []
+	for page in paginator.paginate(Bucket=bucket, Prefix=chunk_prefix):
+		for obj in page.get('Contents', []):
+			if obj['Key'] not in referenced_chunks and now - obj['LastModified'].timestamp() > min_age:
+				garbage_keys.append(obj['Key'])
+
+	# Backups started while listing have not seen any chunks deleted yet (and fail if they reuse any, see upload_deduplicated)
+	if list_active_leases(s3_client, bucket, lease_prefix)[0]:
+		logging.info('Not deleting unreferenced chunks from chunk store {}, deduplicated backups got started.'.format(chunk_prefix))
+		return None
+
+	logging.info('Deleting {garbage} unreferenced chunks from chunk store {prefix} ({referenced} referenced chunks)...'.format(
+		garbage=len(garbage_keys), prefix=chunk_prefix, referenced=len(referenced_chunks)))
+	errors = delete_objects(s3_client, bucket, garbage_keys + expired_leases)
+	if errors:
+		raise Exception('Failed to delete {} chunks:\n{}'.format(len(errors), "\n".join(errors)))
+
+	return len(garbage_keys)
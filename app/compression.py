@@ -0,0 +1,178 @@
+import zlib
+
+from s3_transfer import MIB
+
+# Compression methods supported for backups:
+#  * 'gzip' and 'none': pg_dump's own (single-threaded) compression, or no compression at all
+#  * 'pg_zstd': pg_dump's own zstd compression (requires pg_dump 16+)
+#  * 'zstd' and 'lz4': uncompressed pg_dump output, compressed (multithreaded for zstd) by this application
+#    while streaming it to S3. The codec is recorded in the object metadata
+#    and the file extension, so restores can decompress transparently.
+COMPRESSION_METHODS = ('gzip', 'none', 'pg_zstd', 'zstd', 'lz4')
+PG_DUMP_COMPRESSION_METHODS = ('gzip', 'none', 'pg_zstd')
+EXTERNAL_CODEC_SUFFIXES = {
+	'zstd': '.zst',
+	'lz4':  '.lz4'
+}
+# Codec used to compress individual chunks of deduplicated backups, per compression method
+CHUNK_CODECS = {
+	'gzip':    'zlib',
+	'none':    'none',
+	'pg_zstd': 'zstd',
+	'zstd':    'zstd',
+	'lz4':     'lz4'
+}
+METADATA_KEY = 'compression'
+
+def get_pg_dump_compress_option(compression, level=None):
+	"""Return the pg_dump compression option matching a compression method and level."""
+
+	if compression == 'gzip':
+		return '-Z {}'.format(level) if level is not None else ''
+	if compression == 'pg_zstd':
+		return '-Z zstd:{}'.format(level) if level is not None else '-Z zstd'
+
+	# No compression by pg_dump (either none at all, or applied externally)
+	return '-Z 0'
+
+def get_compressobj(codec, level=None):
+	"""
+	Return a compressor object for `codec`, with a zlib-like compressobj interface
+	(`compress(data)` and `flush()`, both returning compressed bytes).
+	"""
+
+	if codec == 'zlib':
+		return zlib.compressobj(level if level is not None else zlib.Z_DEFAULT_COMPRESSION)
+	if codec == 'zstd':
+		import zstandard
+		# threads=-1 compresses on as many threads as there are CPU cores
+		return zstandard.ZstdCompressor(level=level if level is not None else 3, threads=-1).compressobj()
+	if codec == 'lz4':
+		return Lz4Compressobj(level)
+
+	raise ValueError('Unsupported compression codec {}'.format(codec))
+
+class Lz4Compressobj:
+	"""zlib-like compressobj interface for lz4 frame compression."""
+
+	def __init__(self, level=None) -> None:
+		import lz4.frame
+		self.compressor = lz4.frame.LZ4FrameCompressor(compression_level=level if level is not None else 0)
+		self.header = self.compressor.begin()
+
+	def compress(self, data):
+		compressed = self.compressor.compress(data)
+		if self.header:
+			compressed = self.header + compressed
+			self.header = b''
+
+		return compressed
+
+	def flush(self):
+		return self.header + self.compressor.flush()
+
+def compress_bytes(data, codec, level=None):
+	if codec == 'none':
+		return bytes(data)
+
+	compressobj = get_compressobj(codec, level)
+	return compressobj.compress(data) + compressobj.flush()
+
+def decompress_bytes(data, codec):
+	if codec == 'none':
+		return data
+	if codec == 'zlib':
+		return zlib.decompress(data)
+	if codec == 'zstd':
+		import zstandard
+		return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+	if codec == 'lz4':
+		import lz4.frame
+		return lz4.frame.decompress(data)
+
+	raise ValueError('Unsupported compression codec {}'.format(codec))
+
+class CompressingReader:
+	"""
+	Binary file-like reader returning the compressed content of another (binary) stream.
+	`read(size)` may return less than `size` bytes before reaching EOF.
+	`size` holds the number of (uncompressed) bytes read from the stream.
+	"""
+
+	def __init__(self, stream, codec, level=None, block_size=MIB) -> None:
+		self.stream = stream
+		self.compressobj = get_compressobj(codec, level)
+		self.block_size = block_size
+		self.buffer = bytearray()
+		self.eof = False
+		self.size = 0
+
+	def read(self, size):
+		while len(self.buffer) < size and not self.eof:
+			block = self.stream.read(self.block_size)
+			if block:
+				self.size += len(block)
+				self.buffer += self.compressobj.compress(block)
+			else:
+				self.buffer += self.compressobj.flush()
+				self.eof = True
+
+		data = bytes(self.buffer[:size])
+		del self.buffer[:size]
+
+		return data
+
+def get_decompressobj(codec):
+	"""Return a decompressor object for `codec`, with a `decompress(data)` method returning decompressed bytes."""
+
+	if codec == 'zlib':
+		return zlib.decompressobj()
+	if codec == 'zstd':
+		import zstandard
+		return zstandard.ZstdDecompressor().decompressobj()
+	if codec == 'lz4':
+		import lz4.frame
+		return lz4.frame.LZ4FrameDecompressor()
+
+	raise ValueError('Unsupported compression codec {}'.format(codec))
+
+class DecompressingReader:
+	"""
+	Binary file-like reader returning the decompressed content of another (binary) stream, compressed with `codec`.
+	`read(size)` may return less than `size` bytes before reaching EOF.
+	"""
+
+	def __init__(self, stream, codec, block_size=MIB) -> None:
+		self.stream = stream
+		self.decompressobj = get_decompressobj(codec)
+		self.block_size = block_size
+		self.buffer = bytearray()
+		self.eof = False
+
+	def read(self, size):
+		while len(self.buffer) < size and not self.eof:
+			block = self.stream.read(self.block_size)
+			if block:
+				self.buffer += self.decompressobj.decompress(block)
+			else:
+				self.eof = True
+
+		data = bytes(self.buffer[:size])
+		del self.buffer[:size]
+
+		return data
+
+def decompress_file(src_filepath, dest_filepath, codec):
+	"""Decompress a local file compressed with `codec` (streaming, in bounded memory)."""
+
+	with open(src_filepath, 'rb') as src, open(dest_filepath, 'wb') as dest:
+		if codec == 'zstd':
+			import zstandard
+			zstandard.ZstdDecompressor().copy_stream(src, dest, read_size=MIB, write_size=MIB)
+		elif codec == 'lz4':
+			import lz4.frame
+			with lz4.frame.open(src, mode='rb') as decompressed:
+				for block in iter(lambda: decompressed.read(MIB), b''):
+					dest.write(block)
+		else:
+			raise ValueError('Unsupported compression codec {}'.format(codec))
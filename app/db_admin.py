@@ -0,0 +1,152 @@
+import logging
+import time
+
+import psycopg2
+from psycopg2 import sql
+
+class DbAdminConnection:
+	"""
+	Single (reused) connection to the maintenance DB of a postgres server,
+	to run all administrative DB operations of a backup or restore
+	without starting a new client process (and connection handshake) for every step.
+	"""
+
+	def __init__(self, db_args, maintenance_db='postgres') -> None:
+		self.db_host = db_args['db_host']
+		self.connection = psycopg2.connect(host=db_args['db_host'], user=db_args['db_user'],
+			password=db_args['db_password'], dbname=maintenance_db)
+		# Database-level commands (CREATE/DROP DATABASE) cannot run inside a transaction block
+		self.connection.autocommit = True
+
+	def close(self):
+		self.connection.close()
+
+	def execute(self, query, params=None):
+		with self.connection.cursor() as cursor:
+			logging.debug(query.as_string(self.connection) if isinstance(query, sql.Composable) else query)
+			cursor.execute(query, params)
+			if cursor.description is not None:
+				return cursor.fetchall()
+
+		return None
+
+	def get_connection_limit(self, db_name):
+		rows = self.execute('SELECT datconnlimit FROM pg_database WHERE datname = %s', (db_name,))
+		if not rows:
+			return None
+
+		return rows[0][0]
+
+	def set_connection_limit(self, db_name, connlimit):
+		self.execute(sql.SQL('ALTER DATABASE {} CONNECTION LIMIT {}').format(
+			sql.Identifier(db_name), sql.Literal(connlimit)))
+
+	def terminate_connections(self, db_name):
+		rows = self.execute('SELECT pg_terminate_backend(pid) FROM pg_stat_activity'
+		                    ' WHERE datname = %s AND pid <> pg_backend_pid()', (db_name,))
+
+		return len(rows)
+
+	def set_read_only(self, db_name):
+		self.execute(sql.SQL('ALTER DATABASE {} SET default_transaction_read_only=on').format(sql.Identifier(db_name)))
+
+	def reset_read_only(self, db_name):
+		self.execute(sql.SQL('ALTER DATABASE {} RESET default_transaction_read_only').format(sql.Identifier(db_name)))
+
+	def set_database_settings(self, db_name, settings):
+		for name, value in settings.items():
+			self.execute(sql.SQL('ALTER DATABASE {} SET {} = {}').format(
+				sql.Identifier(db_name), sql.Identifier(name), sql.Literal(value)))
+
+	def reset_database_settings(self, db_name, names):
+		for name in names:
+			self.execute(sql.SQL('ALTER DATABASE {} RESET {}').format(sql.Identifier(db_name), sql.Identifier(name)))
+
+	def create_database(self, db_name, template=None):
+		if template is None:
+			self.execute(sql.SQL('CREATE DATABASE {}').format(sql.Identifier(db_name)))
+		else:
+			# Copy the template files as a whole rather than block by block through the WAL (the default as of postgres 15)
+			strategy = ' STRATEGY FILE_COPY' if self.connection.server_version >= 150000 else ''
+			self.execute(sql.SQL('CREATE DATABASE {} TEMPLATE {}'+strategy).format(sql.Identifier(db_name), sql.Identifier(template)))
+
+	def database_exists(self, db_name):
+		rows = self.execute('SELECT 1 FROM pg_database WHERE datname = %s', (db_name,))
+
+		return bool(rows)
+
+	def get_template_comment(self, db_name):
+		"""Return the comment of template DB `db_name` (None when no such template DB exists)."""
+
+		rows = self.execute("SELECT shobj_description(oid, 'pg_database') FROM pg_database"
+		                    " WHERE datname = %s AND datistemplate", (db_name,))
+		if not rows:
+			return None
+
+		return rows[0][0] or ''
+
+	def list_templates(self, prefix):
+		"""Return the name and comment of all template DBs named `{prefix}*`."""
+
+		rows = self.execute("SELECT datname, shobj_description(oid, 'pg_database') FROM pg_database"
+		                    " WHERE datistemplate AND starts_with(datname, %s)", (prefix,))
+
+		return [ (db_name, comment) for db_name, comment in rows ]
+
+	def set_comment(self, db_name, comment):
+		self.execute(sql.SQL('COMMENT ON DATABASE {} IS {}').format(sql.Identifier(db_name), sql.Literal(comment)))
+
+	def mark_template(self, db_name, comment):
+		"""Turn DB `db_name` into a (pristine) template DB, refusing all connections so it can be cloned at any time."""
+
+		self.set_comment(db_name, comment)
+		self.execute(sql.SQL('ALTER DATABASE {} WITH ALLOW_CONNECTIONS false IS_TEMPLATE true').format(sql.Identifier(db_name)))
+
+	def drop_template(self, db_name):
+		self.execute(sql.SQL('ALTER DATABASE {} WITH IS_TEMPLATE false').format(sql.Identifier(db_name)))
+		self.drop_database(db_name)
+
+	def lock(self, name):
+		"""Take a (session-level, server-wide) advisory lock on `name`, waiting while held by another session."""
+
+		self.execute('SELECT pg_advisory_lock(hashtext(%s))', (name,))
+
+	def try_lock(self, name):
+		rows = self.execute('SELECT pg_try_advisory_lock(hashtext(%s))', (name,))
+
+		return rows[0][0]
+
+	def unlock(self, name):
+		self.execute('SELECT pg_advisory_unlock(hashtext(%s))', (name,))
+
+	def drop_database(self, db_name, if_exists=False):
+		query = 'DROP DATABASE IF EXISTS {}' if if_exists else 'DROP DATABASE {}'
+		self.execute(sql.SQL(query).format(sql.Identifier(db_name)))
+
+	def rename_database(self, db_name, new_db_name):
+		self.execute(sql.SQL('ALTER DATABASE {} RENAME TO {}').format(
+			sql.Identifier(db_name), sql.Identifier(new_db_name)))
+
+	def swap_databases(self, db_name, temp_db_name):
+		"""
+		Replace DB `db_name` by DB `temp_db_name`, running all steps requiring the target DB
+		to refuse connections back-to-back over this connection, to minimize its unavailability.
+		Returns the duration (in seconds) of the window in which the target DB was unavailable.
+		"""
+
+		window_start = time.monotonic()
+
+		logging.info("Refusing all new connections to DB...")
+		self.set_connection_limit(db_name, 0)
+
+		logging.info("Dropping all existing connections to DB...")
+		terminated = self.terminate_connections(db_name)
+		logging.info("\tTerminated {} connections.".format(terminated))
+
+		logging.info("Dropping original DB...")
+		self.drop_database(db_name)
+
+		logging.info("Renaming temp DB...")
+		self.rename_database(temp_db_name, db_name)
+
+		return time.monotonic() - window_start
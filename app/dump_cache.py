@@ -0,0 +1,219 @@
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+# Downloaded backups (as restorable dump file or directory) get cached by S3 key and ETag,
+# so repeated restores of the same backup read it from local storage instead of S3.
+# Every cache entry consists of
+#  * {id}.dump: the dump file (or directory)
+#  * {id}.json: the entry details, only written once the dump was completely downloaded and verified
+#  * {id}.lock: the entry lock, held exclusively while downloading and shared while restoring
+# Least recently used entries get evicted once the cache exceeds its maximum size.
+CACHE_LOCK_FILENAME = '.cache.lock'
+# Interval (in seconds) at which to retry locking an entry to download, while other processes hold it
+ENTRY_LOCK_RETRY_INTERVAL = 1
+
+class DumpCache:
+	"""Size-bounded (LRU) local cache of downloaded backups, safe for concurrent use by several processes."""
+
+	def __init__(self, cache_dir, max_size) -> None:
+		self.cache_dir = cache_dir
+		self.max_size = max_size
+
+		os.makedirs(cache_dir, exist_ok=True)
+
+	def get_entry_id(self, key, etag):
+		return hashlib.sha256('{key}\n{etag}'.format(key=key, etag=etag).encode()).hexdigest()
+
+	def acquire(self, key, etag):
+		"""
+		Acquire the cache entry of backup `key` (version `etag`).
+		Waits while the entry is being downloaded by another process.
+		Returns the (locked) entry, which is a hit when holding a verified download.
+		"""
+
+		entry = CacheEntry(self, self.get_entry_id(key, etag), key, etag)
+		entry.lock()
+
+		return entry
+
+	def list_entries(self):
+		"""Return the details of all complete entries, least recently used first."""
+
+		entries = []
+		for name in os.listdir(self.cache_dir):
+			if not name.endswith('.json'):
+				continue
+			try:
+				with open(os.path.join(self.cache_dir, name)) as details_file:
+					details = json.load(details_file)
+				details['last_used'] = os.path.getmtime(os.path.join(self.cache_dir, name))
+			except (OSError, ValueError):
+				# Entry evicted or invalidated concurrently
+				continue
+			entries.append(details)
+
+		entries.sort(key=lambda details: details['last_used'])
+
+		return entries
+
+	def evict(self, keep_id=None, reserve=0):
+		"""
+		Remove least recently used entries until the cache fits its maximum size
+		(minus `reserve` bytes, to make room for a download).
+		Entries in use (locked by any process) and entry `keep_id` are never evicted.
+		"""
+
+		with open(os.path.join(self.cache_dir, CACHE_LOCK_FILENAME), 'a') as cache_lock:
+			fcntl.flock(cache_lock, fcntl.LOCK_EX)
+
+			entries = self.list_entries()
+			total_size = sum(details['size'] for details in entries)
+			for details in entries:
+				if total_size + reserve <= self.max_size:
+					break
+				if details['id'] == keep_id:
+					continue
+
+				with open(os.path.join(self.cache_dir, details['id']+'.lock'), 'a') as entry_lock:
+					try:
+						fcntl.flock(entry_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+					except OSError as err:
+						if err.errno in (errno.EAGAIN, errno.EACCES):
+							logging.debug('Cached backup {} in use, not evicting.'.format(details['key']))
+							continue
+						raise
+
+					logging.info('Evicting cached backup {key} ({size} bytes)...'.format(key=details['key'], size=details['size']))
+					remove_path(os.path.join(self.cache_dir, details['id']+'.json'))
+					remove_path(os.path.join(self.cache_dir, details['id']+'.dump'))
+					total_size -= details['size']
+
+			if total_size + reserve > self.max_size:
+				logging.warning('Dump cache {dir} holds {size} bytes in use, exceeding its maximum size of {max_size} bytes.'.format(
+					dir=self.cache_dir, size=total_size, max_size=self.max_size))
+
+class CacheEntry:
+	"""
+	A single (locked) backup cache entry.
+	A hit holds a shared lock on the entry (preventing its eviction while in use),
+	a miss holds an exclusive lock until the download is committed (or discarded).
+	"""
+
+	def __init__(self, cache, entry_id, key, etag) -> None:
+		self.cache = cache
+		self.id = entry_id
+		self.key = key
+		self.etag = etag
+		self.path = os.path.join(cache.cache_dir, entry_id+'.dump')
+		self.details_path = os.path.join(cache.cache_dir, entry_id+'.json')
+		self.lock_file = None
+		self.hit = False
+		self.size = None
+
+	def lock(self):
+		self.lock_file = open(os.path.join(self.cache.cache_dir, self.id+'.lock'), 'a')
+
+		while True:
+			# Shared lock first (waiting while another process downloads the entry),
+			# so concurrent restores of a cached backup do not block each other
+			fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+			if self.check_hit():
+				return
+
+			# Release the shared lock before requesting an exclusive one to download: flock conversions are not atomic,
+			# and a pending exclusive request would keep waiting on the shared lock of a concurrent download
+			# once committed (for the entire restore of that process), rather than use the download as a hit
+			fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+			try:
+				fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except OSError as err:
+				if err.errno not in (errno.EAGAIN, errno.EACCES):
+					raise
+				# Downloaded by another process (waited for by the shared lock), or restored from an invalidated download
+				time.sleep(ENTRY_LOCK_RETRY_INTERVAL)
+				continue
+
+			# Another process may have completed the download meanwhile
+			if self.check_hit():
+				fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+				return
+
+			break
+
+		# Remove any leftovers of an earlier incomplete (or invalidated) download
+		remove_path(self.details_path)
+		remove_path(self.path)
+
+	def check_hit(self):
+		details = self.read_details()
+		if details is None or not os.path.exists(self.path):
+			return False
+
+		self.hit = True
+		self.size = details['size']
+		# Mark the entry as most recently used
+		os.utime(self.details_path)
+		logging.info('Found backup {key} in dump cache ({path}).'.format(key=self.key, path=self.path))
+
+		return True
+
+	def read_details(self):
+		try:
+			with open(self.details_path) as details_file:
+				details = json.load(details_file)
+		except (OSError, ValueError):
+			return None
+
+		if details.get('key') != self.key or details.get('etag') != self.etag:
+			return None
+
+		return details
+
+	def commit(self):
+		"""Register the (verified) download of a missed entry, making it available to other restores."""
+
+		size = get_path_size(self.path)
+		details = {'id': self.id, 'key': self.key, 'etag': self.etag, 'size': size, 'created': time.time()}
+		tmp_details_path = self.details_path+'.tmp'
+		with open(tmp_details_path, 'w') as details_file:
+			json.dump(details, details_file)
+		os.replace(tmp_details_path, self.details_path)
+
+		self.hit = True
+		self.size = size
+		fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+
+		self.cache.evict(keep_id=self.id)
+
+	def discard(self):
+		"""Invalidate the entry (on failed downloads or restores), so the backup gets downloaded again."""
+
+		logging.info('Removing backup {} from dump cache...'.format(self.key))
+		remove_path(self.details_path)
+		# Other processes may still be restoring from a (shared) hit, the next download replaces it
+		if not self.hit:
+			remove_path(self.path)
+
+	def release(self):
+		if self.lock_file is not None:
+			self.lock_file.close()
+			self.lock_file = None
+
+def get_path_size(path):
+	if not os.path.isdir(path):
+		return os.path.getsize(path)
+
+	return sum(os.path.getsize(os.path.join(dirpath, filename))
+	           for dirpath, _, filenames in os.walk(path) for filename in filenames)
+
+def remove_path(path):
+	if os.path.isdir(path):
+		shutil.rmtree(path, ignore_errors=True)
+	elif os.path.exists(path):
+		os.remove(path)
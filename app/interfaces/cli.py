@@ -2,8 +2,6 @@ from optparse import OptionParser
 
 from .helper import APP_OPTIONS
 
-import app
-
 def cli_handler():
 	parser = OptionParser()
 	for arg_key, arg_value in APP_OPTIONS.items():
@@ -13,5 +11,8 @@ def cli_handler():
 
 	(options, args) = parser.parse_args()
 
+	# Only load the application (and its dependencies) once the options got parsed (help exits before)
+	import app
+
 	response_msg = app.main(vars(options))
 	print(response_msg)
@@ -2,27 +2,142 @@ APP_DESCRIPTION = "This function can backup any AGR database or restore an earli
                   " backup to the same or a different environment (e.g. for data roll-down)."
 
 APP_OPTIONS = {
-	"action":            "Define an action to perform. Value must be either 'backup' or 'restore'.",
+	"action":            "Define an action to perform. Value must be one of 'backup', 'restore', 'copy', 'list', 'prune' or 'batch'."+
+	                     " 'copy' restores the source DB (of src_env) straight into the target DB (of target_env),"+
+	                     " piping pg_dump into pg_restore without staging a backup (see archive)."+
+	                     " 'list' prints all available backups for the identifier and target_env (from the backup catalog)."+
+	                     " 'prune' deletes the backups of the identifier and target_env not retained by keep_daily,"+
+	                     " keep_weekly and keep_monthly (grandfather-father-son retention)."+
+	                     " 'batch' runs all backup jobs defined in batch_jobs concurrently, in a single run."+
+	                     " 'status' (Lambda trigger only) returns the progress of the backup or restore task defined by task_id.",
+	"analyze":           "Flag to collect planner statistics for the restored DB before swapping it in (restore and copy actions only)."+
+	                     " When defined as 'true', all tables get analyzed in stages by restore_jobs parallel vacuumdb workers.",
+	"archive":           "Flag to upload the copied dump to S3 along the way, as a backup of src_env (copy action only)."+
+	                     " When defined as 'true', the dump gets compressed and stored as defined by compression, compression_level"+
+	                     " and storage_class (for src_env), and registered in the backup catalog of src_env once restored cleanly"+
+	                     " (the archive upload gets discarded when the copy fails)."+
+	                     " A failing upload fails the copy.",
+	"backup_mode":       "Define how to transfer a backup to S3 (backup action only). Value must be one of 'file', 'stream' or 'dedup'."+
+	                     " Defaults to 'file', which stores the complete dump in local storage before uploading it to S3."+
+	                     " 'stream' uploads the dump to S3 while it is being produced, without requiring any local storage."+
+	                     " 'dedup' streams the dump as content-defined chunks to a chunk store shared by all backups of the identifier,"+
+	                     " only uploading chunks not already stored by earlier backups.",
+	"backup_format":     "Define the pg_dump archive format to use (backup action only). Value must be either 'custom' or 'directory'."+
+	                     " Defaults to 'custom' (single dump file). 'directory' dumps tables in parallel (see dump_jobs)"+
+	                     " and uploads every table file to S3 as soon as it is complete, along with a manifest listing all files."+
+	                     " Can only be combined with backup_mode 'file'.",
+	"batch_concurrency": "Maximum number of batch jobs to run concurrently (batch action only)."+
+	                     " Defaults to a number fitting the CPUs and memory available.",
+	"batch_jobs":        "JSON list of backup jobs to run (batch action only), as objects holding the options specific to each job"+
+	                     " (at least identifier and target_env). All other options passed apply to every job,"+
+	                     " unless overridden by the job. Jobs run independently, a failing job does not affect the others."+
+	                     " Example: [{\"identifier\": \"curation\", \"target_env\": \"alpha\"}, {\"identifier\": \"curation\", \"target_env\": \"beta\"}]",
+	"cache_dir":         "Local directory in which to cache downloaded backups (restore action only),"+
+	                     " so repeated restores of the same backup skip downloading it. Caching is disabled when undefined.",
+	"cache_size":        "Maximum size (in GiB) of the dump cache in cache_dir (restore action only),"+
+	                     " beyond which the least recently used backups get evicted. Defaults to 20.",
+	"compression":       "Compression method to use for backups (backup action, or copy action with archive only). Value must be one of"+
+	                     " 'gzip' (pg_dump's default compression), 'none', 'pg_zstd' (pg_dump's own zstd compression, requires pg_dump 16+),"+
+	                     " 'zstd' (multithreaded) or 'lz4'. 'zstd' and 'lz4' require backup_mode 'stream' or 'dedup'."+
+	                     " Defaults to 'gzip'. Defaults to AWS SSM parameter store value when defined for the identifier and env.",
+	"compression_level": "Compression level to use with the selected compression method (backup action, or copy action with archive only)."+
+	                     " Defaults to the compression method's default level."+
+	                     " Defaults to AWS SSM parameter store value when defined for the identifier and env.",
 	"db_host":           "Host URL of target DB. Defaults to AWS SSM parameter store value.",
 	"db_name":           "DB name of target DB. Defaults to AWS SSM parameter store value.",
 	"db_password":       "DB password for target DB. Defaults to AWS SSM parameter store value.",
 	"db_user":           "DB username for target DB. Defaults to AWS SSM parameter store value.",
+	"dump_jobs":         "Number of parallel pg_dump workers to use for directory-format backups."+
+	                     " Defaults to the number of available CPUs.",
+	"dry_run":           "Flag to only report which backups would be pruned (prune action only), when defined as 'true'.",
+	"exclude_schemas":   "Comma-separated list of schemas not to restore (restore action only)."+
+	                     " Accepts shell-style wildcards (e.g. 'audit_*').",
+	"exclude_table_data": "Comma-separated list of tables to restore without their data (restore action only)."+
+	                      " Tables are defined as 'table' (in any schema) or 'schema.table' and accept shell-style wildcards."+
+	                      " Foreign keys referencing these tables (from tables restored with data) are not restored.",
+	"exclude_tables":    "Comma-separated list of tables (and views) not to restore (restore action only),"+
+	                     " along with all objects depending on them (indexes, constraints, sequences, ...)."+
+	                     " Tables are defined as 'table' (in any schema) or 'schema.table' and accept shell-style wildcards.",
 	"help":              "Print this help text (provide any value).",
+	"hot_backups":       "Number of most recent retained backups to keep in the STANDARD storage class (prune action only),"+
+	                     " moving all older ones to GLACIER_IR. Storage classes are left as stored if undefined."+
+	                     " The chunks of hot deduplicated backups get moved to STANDARD as well (but never back, being shared by all backups).",
 	"identifier":        "Application identifier to backup/restore for (for example 'curation').",
 	"ignore_privileges": "Flag to skip restoring ownership and privileges on the restored database."+
 	                     " When define as 'true', all restored objects will be owned by the restoring"+
 	                     " (postgres) user rather than maintaining ownerships and privileges as defined in the backup file."+
 	                     " Only recommended for restores to developer's systems or other applications.",
+	"include_schemas":   "Comma-separated list of schemas to restore (restore action only), all other schemas are skipped."+
+	                     " Accepts shell-style wildcards.",
+	"include_tables":    "Comma-separated list of tables (and views) to restore (restore action only), all other tables are skipped"+
+	                     " (objects other than tables, such as functions and types, are still restored)."+
+	                     " Tables are defined as 'table' (in any schema) or 'schema.table' and accept shell-style wildcards.",
+	"keep_daily":        "Number of most recent days to keep the latest backup of (prune action only). Defaults to 7.",
+	"keep_monthly":      "Number of most recent months to keep the latest backup of (prune action only). Defaults to 12.",
+	"keep_weekly":       "Number of most recent (ISO) weeks to keep the latest backup of (prune action only). Defaults to 4."+
+	                     " The most recent backup is always kept.",
 	"loglevel":          "Set logging level. Must be one of DEBUG, INFO, WARNING, ERROR or CRITICAL.",
-	"prod_restore":      "Extra flag to prevent accidental restores to 'production' environments."+
+	"metrics":           "Define the format in which to report the timing of all phases of the run (duration, bytes and throughput),"+
+	                     " printed to STDOUT once the run completed. Value must be either 'json' or 'emf'."+
+	                     " Defaults to 'json', a single JSON summary line (prefixed by 'METRICS ')."+
+	                     " 'emf' additionally prints every phase as a CloudWatch Embedded Metric Format record.",
+	"prewarm":           "Number of most used tables (as reported by the current target DB) to load into the DB server's cache,"+
+	                     " along with their indexes, before swapping in the restored DB (restore and copy actions only). Uses pg_prewarm.",
+	"process_timeout":   "Maximum duration (in seconds) of every pg_dump or pg_restore execution, after which it gets terminated"+
+	                     " and the backup or restore fails (without replacing the target DB). Defaults to no timeout.",
+	"prod_restore":      "Extra flag to prevent accidental restores (and copies) to 'production' environments."+
 	                     " Define this argument as 'true' to confirm intend to do a production environment restore.",
+	"progress_interval": "Interval (in seconds) at which backups and restores write their progress (phase, percent done, throughput"+
+	                     " and estimated time remaining) to _status/{task_id}.json in the backup bucket. Defaults to 30, 0 disables progress reporting.",
 	"region":            "AWS region to retrieve/write backups from/to. Defaults to 'us-east-1'.",
 	"s3_bucket":         "AWS S3 bucket name to retrieve/write backups from/to. Defaults to AWS SSM parameter store value.",
+	"s3_pool_size":      "Maximum number of (HTTP) connections to S3, shared by all transfers of the run."+
+	                     " Defaults to transfer_concurrency squared (directory backups upload transfer_concurrency files at once,"+
+	                     " each in transfer_concurrency parts at once), with a minimum of 10.",
+	"restore_jobs":      "Number of parallel pg_restore workers to use per target DB (restore and copy actions only,"+
+	                     " copies restore by a single worker and only use it to analyze)."+
+	                     " Defaults to the number of available CPUs.",
+	"restore_profile":   "Settings to apply to the restored DB while pg_restore runs (restore and copy actions only), to speed up bulk loading."+
+	                     " Defined as 'default' (maintenance_work_mem=1GB, max_parallel_maintenance_workers=4, synchronous_commit=off)"+
+	                     " or as comma-separated setting=value pairs. Settings get removed again before the restored DB replaces the target DB."+
+	                     " Defaults to AWS SSM parameter store value (per identifier and target_env), no settings if undefined.",
 	"restore_timestamp": "Date timestamp of DB dump to be used for restore. Latest available if undefined."+
 	                     " Format must be YYYY-MM-DD_hh-mm-ss or any part thereof from the start (e.g. YYYY-MM-DD)",
-	"src_env":           "The source environment to find a backup from to restore."+
-	                     " Defaults to 'production', only relevant for restore action.",
-	"target_env":        "The target environment to backup/restore from/to. Defaults to 'dev'."
+	"split_table_size":  "Size (in MiB) from which tables get dumped in ranges by parallel workers (backup action with backup_format 'directory' only)."+
+	                     " The data of every such table gets dumped by dump_jobs workers under the snapshot used by pg_dump,"+
+	                     " each range uploaded as a file of its own, and restored by restore_jobs workers in parallel"+
+	                     " before indexes and constraints get created. Ranges are defined by table blocks (postgres 14+),"+
+	                     " or by a single-column integer primary key on older servers. Tables not splittable remain dumped by pg_dump."+
+	                     " Undefined by default (no tables split).",
+	"src_db_host":       "Host URL of source DB (copy action only). Defaults to AWS SSM parameter store value (for src_env).",
+	"src_db_name":       "DB name of source DB (copy action only). Defaults to AWS SSM parameter store value (for src_env).",
+	"src_db_password":   "DB password for source DB (copy action only). Defaults to AWS SSM parameter store value (for src_env).",
+	"src_db_user":       "DB username for source DB (copy action only). Defaults to AWS SSM parameter store value (for src_env).",
+	"src_env":           "The source environment to find a backup from to restore, or to copy the DB of."+
+	                     " Defaults to 'production', only relevant for restore and copy actions.",
+	"storage_class":     "S3 storage class to store backups as (backup action, or copy action with archive only). Value must be either 'GLACIER_IR' or 'STANDARD'."+
+	                     " Defaults to AWS SSM parameter store value, or 'GLACIER_IR' if undefined.",
+	"target_concurrency": "Maximum number of target envs to restore to concurrently, when restoring to several target envs."+
+	                      " Defaults to all target envs at once.",
+	"target_env":        "The target environment to backup/restore from/to. Defaults to 'dev'."+
+	                     " Restores accept a comma-separated list of target envs, to restore the same backup to all of them"+
+	                     " while downloading it only once. Every target env is resolved (and validated) separately.",
+	"task_id":           "ID (or ARN) of the ECS task to return the progress of (status action only)."+
+	                     " Provide s3_bucket (or identifier and the env backups get read from or written to) along with it.",
+	"template_max_age":  "Number of days after which unused template DBs get evicted (restore action with use_template only)."+
+	                     " Defaults to 7.",
+	"template_max_count": "Maximum number of template DBs to keep per DB host (restore action with use_template only)."+
+	                      " Least recently used template DBs get evicted first. Defaults to 3.",
+	"transfer_concurrency": "Number of parts to transfer to/from S3 in parallel for streamed transfers. Defaults to 4.",
+	"transfer_part_size":   "Size (in MiB) of the parts to transfer to/from S3 for streamed transfers."+
+	                        " Defaults to 32, must be at least 5. Memory usage is bounded to roughly"+
+	                        " transfer_part_size * (transfer_concurrency + 1) and the maximum backup size"+
+	                        " to transfer_part_size * 10000.",
+	"transfer_threshold":   "Size (in MiB) from which files get uploaded to S3 in parts (backup action with file-based backup modes only)."+
+	                        " Defaults to transfer_part_size.",
+	"use_template":      "Flag to restore through template DBs (restore action only). When defined as 'true', the backup gets restored"+
+	                     " once into a read-only template DB on the target DB host, which later restores of the same backup"+
+	                     " (with the same restore options) clone instead of running pg_restore."
 }
 
 SSM_ARG_PARAMS = {       #key-value pairs matching {`input_param_name`: `ssm_param_key`}
@@ -32,3 +147,13 @@ SSM_ARG_PARAMS = {       #key-value pairs matching {`input_param_name`: `ssm_par
 	'db_password' : 'password',
 	's3_bucket' :   'bucket'
 };
+
+SSM_OPTIONAL_ARG_PARAMS = {       #key-value pairs matching {`input_param_name`: `ssm_param_key`}, not required to be defined in SSM
+	'compression' :       'compression',
+	'compression_level' : 'compression_level',
+	'storage_class' :     'storage_class'
+};
+
+SSM_OPTIONAL_RESTORE_ARG_PARAMS = {       #key-value pairs matching {`input_param_name`: `ssm_param_key`}, for restores (to target_env)
+	'restore_profile' : 'restore_profile'
+};
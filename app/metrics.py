@@ -0,0 +1,211 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+# Every run (a backup, restore or list action) records a tree of timed spans, one per phase,
+# reported as a single JSON summary line once the run completed (successfully or not),
+# and optionally as CloudWatch Embedded Metric Format (EMF) records (one per span).
+METRICS_FORMATS = ('json', 'emf')
+SUMMARY_PREFIX = 'METRICS '
+EMF_NAMESPACE = 'AgrDbBackups'
+EMF_DIMENSIONS = ['action', 'identifier', 'env', 'phase']
+
+current_run = contextvars.ContextVar('metrics_run', default=None)
+current_span = contextvars.ContextVar('metrics_span', default=None)
+
+class Span:
+	"""Timing (and optional bytes processed) of a single phase of a run."""
+
+	def __init__(self, name, parent=None) -> None:
+		self.name = name
+		self.path = parent.path+'/'+name if parent is not None else name
+		self.start = time.time()
+		self.start_monotonic = time.monotonic()
+		self.duration = None
+		self.bytes = None
+		self.status = 'ok'
+
+	def add_bytes(self, count):
+		self.bytes = (self.bytes or 0) + count
+
+	def set_bytes(self, count):
+		self.bytes = count
+
+	def fail(self):
+		self.status = 'error'
+
+	def finish(self):
+		self.duration = time.monotonic() - self.start_monotonic
+
+	def get_throughput(self):
+		"""Return the throughput of the span (in MB/s), if it processed any bytes."""
+
+		if self.bytes is None or not self.duration:
+			return None
+
+		return self.bytes / 1000000 / self.duration
+
+	def to_dict(self):
+		span_dict = {
+			'phase': self.path,
+			'start': datetime.fromtimestamp(self.start, timezone.utc).isoformat(timespec='milliseconds'),
+			'end': datetime.fromtimestamp(self.start + (self.duration or 0), timezone.utc).isoformat(timespec='milliseconds'),
+			'duration': round(self.duration, 3) if self.duration is not None else None,
+			'status': self.status
+		}
+		if self.bytes is not None:
+			span_dict['bytes'] = self.bytes
+			throughput = self.get_throughput()
+			span_dict['mb_per_s'] = round(throughput, 2) if throughput is not None else None
+
+		return span_dict
+
+class RunMetrics:
+	"""All spans recorded during a single run (of one action, on one identifier and env)."""
+
+	def __init__(self, action, dimensions) -> None:
+		self.action = action
+		self.dimensions = dimensions
+		self.spans = []
+		self.lock = threading.Lock()
+
+	def add_span(self, span):
+		with self.lock:
+			self.spans.append(span)
+
+	def get_span(self, path):
+		"""Return the (last) completed span with the given path, or None."""
+
+		with self.lock:
+			for span in reversed(self.spans):
+				if span.path == path:
+					return span
+
+		return None
+
+	def summary(self):
+		with self.lock:
+			spans = sorted(self.spans, key=lambda span: span.start)
+
+		return dict(self.dimensions, action=self.action, spans=[ span.to_dict() for span in spans ])
+
+	def emf_records(self):
+		"""Return an EMF record for every span, with its duration, bytes and throughput as metrics."""
+
+		records = []
+		with self.lock:
+			spans = sorted(self.spans, key=lambda span: span.start)
+
+		for span in spans:
+			metrics = [ {'Name': 'Duration', 'Unit': 'Seconds'} ]
+			record = {
+				'Duration': round(span.duration, 3)
+			}
+			if span.bytes is not None:
+				metrics.append({'Name': 'Bytes', 'Unit': 'Bytes'})
+				record['Bytes'] = span.bytes
+				if span.get_throughput() is not None:
+					metrics.append({'Name': 'Throughput', 'Unit': 'Megabytes/Second'})
+					record['Throughput'] = round(span.get_throughput(), 3)
+
+			record.update({ dimension: str(self.dimensions.get(dimension, '')) for dimension in EMF_DIMENSIONS })
+			record.update({'action': self.action, 'phase': span.path, 'status': span.status})
+			record['_aws'] = {
+				'Timestamp': int((span.start + span.duration) * 1000),
+				'CloudWatchMetrics': [{
+					'Namespace': EMF_NAMESPACE,
+					'Dimensions': [ EMF_DIMENSIONS ],
+					'Metrics': metrics
+				}]
+			}
+			records.append(record)
+
+		return records
+
+def start_run(action, **dimensions):
+	"""Start recording the metrics of a new run, in the current context (thread)."""
+
+	run = RunMetrics(action, dimensions)
+	current_run.set(run)
+	current_span.set(None)
+
+	return run
+
+def get_current_run():
+	return current_run.get()
+
+@contextmanager
+def span(name):
+	"""
+	Time the enclosed block as a phase of the current run, nested under the current span (if any).
+	Yields the span, on which the bytes processed can be recorded.
+	When no run is being recorded, the span is timed but not reported.
+	"""
+
+	run = current_run.get()
+	parent = current_span.get()
+	phase_span = Span(name, parent)
+	token = current_span.set(phase_span)
+	try:
+		yield phase_span
+	except BaseException:
+		phase_span.fail()
+		raise
+	finally:
+		phase_span.finish()
+		current_span.reset(token)
+		if run is not None:
+			run.add_span(phase_span)
+
+def timed_phase(name):
+	"""
+	Decorator timing every call of a function as a phase (see span),
+	marking the phase as failed when the function returns an error response (holding 'err_msg').
+	"""
+
+	def decorator(function):
+		@wraps(function)
+		def timed_function(*args, **kwargs):
+			with span(name) as phase_span:
+				response = function(*args, **kwargs)
+				if isinstance(response, dict) and 'err_msg' in response:
+					phase_span.fail()
+
+				return response
+
+		return timed_function
+
+	return decorator
+
+def in_current_context(function):
+	"""
+	Wrap `function` to run in (a copy of) the current context,
+	so spans it records in another thread get added to the current run, nested under the current span.
+	"""
+
+	context = contextvars.copy_context()
+
+	def run_in_context(*args, **kwargs):
+		return context.run(function, *args, **kwargs)
+
+	return run_in_context
+
+def report_run(run, metrics_format='json'):
+	"""Print the metrics of a run, as a single JSON summary line (and EMF records when requested)."""
+
+	if run is None:
+		return
+
+	try:
+		print(SUMMARY_PREFIX+json.dumps(run.summary()), flush=True)
+		if metrics_format == 'emf':
+			for record in run.emf_records():
+				print(json.dumps(record), flush=True)
+	except Exception as err:
+		# Metrics reporting must never fail a run
+		logging.warning('Failed to report run metrics: {}'.format(err))
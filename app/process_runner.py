@@ -0,0 +1,239 @@
+import collections
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+# Number of (most recent) output lines kept per process, to report on failure
+OUTPUT_TAIL_LINES = 100
+# Maximum number of output lines logged per second and per process (verbose output beyond that gets sampled)
+LOG_LINES_PER_SECOND = 20
+# Output lines always logged, regardless of the log rate limit
+IMPORTANT_LINE_MARKERS = ('error', 'warning', 'fatal')
+# Interval (in seconds) at which timeouts and cancellation get checked while waiting for a process
+WAIT_POLL_INTERVAL = 0.5
+# Time (in seconds) given to a process to exit after being terminated, before killing it
+TERMINATE_GRACE_PERIOD = 10
+
+class RateLimitedLogger:
+	"""
+	Log lines of (verbose) process output at a limited rate,
+	always logging important lines and reporting the number of lines skipped.
+	"""
+
+	def __init__(self, name, lines_per_second=LOG_LINES_PER_SECOND) -> None:
+		self.name = name
+		self.lines_per_second = lines_per_second
+		self.interval_start = time.monotonic()
+		self.interval_count = 0
+		self.skipped = 0
+
+	def log(self, line):
+		now = time.monotonic()
+		if now - self.interval_start >= 1:
+			if self.skipped:
+				logging.info('({name}: {skipped} output lines not logged)'.format(name=self.name, skipped=self.skipped))
+				self.skipped = 0
+			self.interval_start = now
+			self.interval_count = 0
+
+		if self.interval_count < self.lines_per_second or any(marker in line.lower() for marker in IMPORTANT_LINE_MARKERS):
+			self.interval_count += 1
+			logging.info(line)
+		else:
+			self.skipped += 1
+
+	def flush(self):
+		if self.skipped:
+			logging.info('({name}: {skipped} output lines not logged)'.format(name=self.name, skipped=self.skipped))
+			self.skipped = 0
+
+class TeeReader:
+	"""
+	Binary file-like reader passing all data read from a stream on to a writable stream
+	(e.g. from the stdout of one process to the stdin of another), while handing it to its own reader as well.
+	`read(size)` returns whatever data is available (at most `size` bytes) rather than waiting for `size` bytes,
+	so the writable stream is fed as soon as data arrives.
+	`progress_callback` (if defined) gets called with the size of every block passed on.
+	"""
+
+	def __init__(self, stream, sink, progress_callback=None) -> None:
+		self.stream = stream
+		self.sink = sink
+		self.progress_callback = progress_callback
+		self.size = 0
+
+	def read(self, size):
+		data = self.stream.read1(size)
+		if data:
+			self.sink.write(data)
+			self.size += len(data)
+			if self.progress_callback is not None:
+				self.progress_callback(len(data))
+
+		return data
+
+class ProcessRunner:
+	"""
+	Run an external command, draining its stderr (and stdout, unless consumed by the caller)
+	in background threads, so the process never blocks on a full pipe.
+	Only the most recent output lines are kept (to report on failure),
+	verbose output is logged at a limited rate.
+	The process gets terminated when exceeding `timeout` (in seconds), or when `cancel_event` gets set
+	(checked while waiting for the process).
+
+	stdout can be
+	 * None: discarded
+	 * 'pipe': consumed by the caller, through the `stdout` attribute
+	 * 'lines': drained like stderr (logged and kept)
+	Every stderr (and drained stdout) line is passed to `line_callback` (if defined),
+	from the draining thread.
+	"""
+
+	def __init__(self, command, name, env=None, stdout=None, stdin=None, line_callback=None, timeout=None,
+	             cancel_event=None, log_output=True) -> None:
+		self.command = command
+		self.name = name
+		self.env = env
+		self.stdout_mode = stdout
+		self.stdin = stdin
+		self.line_callback = line_callback
+		self.timeout = timeout
+		self.cancel_event = cancel_event if cancel_event is not None else threading.Event()
+		self.log_output = log_output
+
+		self.process = None
+		self.stdout = None
+		self.output_tail = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+		self.logger = RateLimitedLogger(name)
+		self.lock = threading.Lock()
+		self.drain_threads = []
+		self.timeout_timer = None
+		self.timed_out = False
+		self.cancelled = False
+		self.exitcode = None
+
+	def start(self):
+		stdout = subprocess.PIPE if self.stdout_mode in ('pipe', 'lines') else subprocess.DEVNULL
+		logging.debug('Starting {name}: {command}'.format(name=self.name, command=self.command))
+
+		# Run in a new process group, so termination reaches the command's (shell and worker) child processes as well
+		self.process = subprocess.Popen(self.command, shell=isinstance(self.command, str), env=self.env,
+			stdin=self.stdin, stdout=stdout, stderr=subprocess.PIPE, start_new_session=True)
+
+		if self.stdout_mode == 'pipe':
+			self.stdout = self.process.stdout
+		elif self.stdout_mode == 'lines':
+			self.drain_threads.append(self._start_drain_thread(self.process.stdout))
+		self.drain_threads.append(self._start_drain_thread(self.process.stderr))
+
+		# Enforce the timeout independently of the caller, which may be busy consuming stdout
+		if self.timeout is not None:
+			self.timeout_timer = threading.Timer(self.timeout, self._on_timeout)
+			self.timeout_timer.daemon = True
+			self.timeout_timer.start()
+
+		return self
+
+	def _on_timeout(self):
+		if self.process.poll() is not None:
+			return
+
+		logging.error('{name} exceeded its timeout of {timeout}s, terminating.'.format(name=self.name, timeout=self.timeout))
+		self.timed_out = True
+		self.terminate()
+
+	def _start_drain_thread(self, stream):
+		thread = threading.Thread(target=self._drain, args=(stream,), daemon=True,
+			name='{}-output'.format(self.name))
+		thread.start()
+
+		return thread
+
+	def _drain(self, stream):
+		for line in iter(stream.readline, b''):
+			decoded_str = line.decode(errors='replace').rstrip()
+			with self.lock:
+				self.output_tail.append(decoded_str)
+				if self.log_output:
+					self.logger.log(decoded_str)
+			if self.line_callback is not None:
+				try:
+					self.line_callback(decoded_str)
+				except Exception as err:
+					logging.error('Processing {name} output failed: {err}'.format(name=self.name, err=err))
+					self.cancel()
+
+		stream.close()
+
+	def cancel(self):
+		"""Request the process to be terminated (handled by `wait`)."""
+
+		self.cancelled = True
+		self.cancel_event.set()
+		self.terminate()
+
+	def terminate(self):
+		if self.process is None or self.process.poll() is not None:
+			return
+
+		self.signal_process_group(signal.SIGTERM)
+		try:
+			self.process.wait(timeout=TERMINATE_GRACE_PERIOD)
+		except subprocess.TimeoutExpired:
+			self.signal_process_group(signal.SIGKILL)
+
+	def signal_process_group(self, signum):
+		try:
+			os.killpg(self.process.pid, signum)
+		except ProcessLookupError:
+			pass
+
+	def wait(self):
+		"""
+		Wait for the process to exit (terminating it on timeout or cancellation)
+		and for all of its output to be drained. Returns the process exit code.
+		"""
+
+		while True:
+			try:
+				self.exitcode = self.process.wait(timeout=WAIT_POLL_INTERVAL)
+				break
+			except subprocess.TimeoutExpired:
+				pass
+
+			if self.cancel_event.is_set():
+				self.cancelled = True
+				self.terminate()
+
+		if self.timeout_timer is not None:
+			self.timeout_timer.cancel()
+		for thread in self.drain_threads:
+			thread.join()
+		with self.lock:
+			self.logger.flush()
+
+		return self.exitcode
+
+	def run(self):
+		"""Start the process and wait for it to exit. Returns the process exit code."""
+
+		return self.start().wait()
+
+	def get_output_tail(self):
+		with self.lock:
+			return "\n".join(self.output_tail)
+
+	def failure_message(self):
+		"""Describe why the (completed) process failed, along with its most recent output."""
+
+		if self.timed_out:
+			reason = "{name} execution timed out after {timeout}s".format(name=self.name, timeout=self.timeout)
+		elif self.cancelled:
+			reason = "{name} execution was cancelled".format(name=self.name)
+		else:
+			reason = "{name} execution failed (exitcode {exitcode})".format(name=self.name, exitcode=self.exitcode)
+
+		return "{reason}.\n{output}\n".format(reason=reason, output=self.get_output_tail())
@@ -0,0 +1,203 @@
+import contextvars
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import metrics
+
+# Running backups and restores periodically write their progress to a status object in the backup bucket,
+# which the ECS trigger Lambda reads back by task ID (see its `status` action).
+# Every phase tracked (download, upload, pg_restore, ...) reports the work done against its total (when known),
+# along with its throughput and estimated time remaining.
+STATUS_KEY = '_status/{task_id}.json'
+DEFAULT_PROGRESS_INTERVAL = 30
+# Set by the ECS agent in every (Fargate) container
+ECS_METADATA_URI_ENV = 'ECS_CONTAINER_METADATA_URI_V4'
+ECS_METADATA_TIMEOUT = 2
+
+current_reporter = contextvars.ContextVar('progress_reporter', default=None)
+
+class PhaseProgress:
+	"""Work done (in bytes or items) during a single phase, against its (optional, possibly estimated) total."""
+
+	def __init__(self, name, total=None, unit='bytes', estimated=False) -> None:
+		self.name = name
+		self.total = total
+		self.unit = unit
+		self.estimated = estimated
+		self.done = 0
+		self.start = time.time()
+		self.start_monotonic = time.monotonic()
+		self.duration = None
+		self.status = 'running'
+		self.lock = threading.Lock()
+
+	def advance(self, count):
+		with self.lock:
+			self.done += count
+
+	def set_done(self, count):
+		with self.lock:
+			self.done = count
+
+	def finish(self, status='ok'):
+		self.duration = time.monotonic() - self.start_monotonic
+		self.status = status
+
+	def to_dict(self):
+		with self.lock:
+			done = self.done
+		elapsed = self.duration if self.duration is not None else time.monotonic() - self.start_monotonic
+		rate = done / elapsed if elapsed > 0 else None
+
+		phase_dict = {
+			'phase': self.name,
+			'status': self.status,
+			'started': datetime.fromtimestamp(self.start, timezone.utc).isoformat(timespec='seconds'),
+			'elapsed': round(elapsed, 1),
+			'unit': self.unit,
+			'done': done,
+			'total': self.total,
+			'percent': None,
+			'eta_seconds': None
+		}
+		if self.unit == 'bytes':
+			phase_dict['mb_per_s'] = round(rate / 1000000, 2) if rate is not None else None
+		else:
+			phase_dict['per_s'] = round(rate, 2) if rate is not None else None
+		if self.estimated:
+			phase_dict['total_estimated'] = True
+
+		if self.total:
+			phase_dict['percent'] = round(min(done / self.total, 1.0) * 100, 1)
+			# Estimated totals may be exceeded, leaving the time remaining unknown
+			if self.duration is None and rate and done < self.total:
+				phase_dict['eta_seconds'] = round(max(self.total - done, 0) / rate)
+
+		return phase_dict
+
+class ProgressReporter:
+	"""
+	Write the progress of all phases of a run to the status object of the task (see STATUS_KEY),
+	every `interval` seconds (from a background thread) and once the run completed.
+	Failing to write the status object never fails the run.
+	"""
+
+	def __init__(self, s3_client, bucket, task_id, interval, action, dimensions) -> None:
+		self.s3_client = s3_client
+		self.bucket = bucket
+		self.task_id = task_id
+		self.key = STATUS_KEY.format(task_id=task_id)
+		self.interval = interval
+		self.action = action
+		self.dimensions = dimensions
+		self.start = time.time()
+		self.status = 'running'
+		self.error = None
+		self.phases = []
+		self.lock = threading.Lock()
+		self.stop_event = threading.Event()
+		self.thread = None
+
+	def start_reporting(self):
+		logging.info('Reporting progress to s3://{bucket}/{key} every {interval}s.'.format(
+			bucket=self.bucket, key=self.key, interval=self.interval))
+		self.write()
+
+		self.thread = threading.Thread(target=self._report_periodically, daemon=True, name='progress-reporter')
+		self.thread.start()
+
+	def _report_periodically(self):
+		while not self.stop_event.wait(self.interval):
+			self.write()
+
+	def add_phase(self, phase):
+		with self.lock:
+			self.phases.append(phase)
+
+	def finish(self, error=None):
+		self.stop_event.set()
+		if self.thread is not None:
+			self.thread.join()
+
+		self.status = 'failed' if error is not None else 'succeeded'
+		self.error = error
+		self.write()
+
+	def to_dict(self):
+		with self.lock:
+			phases = list(self.phases)
+
+		# The most recently started phase still running
+		running_phases = [ phase for phase in phases if phase.duration is None ]
+		status_dict = dict(self.dimensions, task_id=self.task_id, action=self.action, status=self.status,
+			started=datetime.fromtimestamp(self.start, timezone.utc).isoformat(timespec='seconds'),
+			updated=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+			current_phase=running_phases[-1].name if running_phases else None,
+			phases=[ phase.to_dict() for phase in phases ])
+		if self.error is not None:
+			# Only the first line, full errors get logged
+			status_dict['error'] = self.error.strip().split("\n")[0]
+
+		return status_dict
+
+	def write(self):
+		try:
+			self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(self.to_dict(), indent=1).encode(),
+				ContentType='application/json')
+		except Exception as err:
+			logging.warning('Failed to write progress to s3://{bucket}/{key}: {err}'.format(bucket=self.bucket, key=self.key, err=err))
+
+def get_task_id():
+	"""
+	Return the ID of the ECS task running this application (from the task metadata endpoint),
+	or a host and process based ID when not running on ECS.
+	"""
+
+	metadata_uri = os.environ.get(ECS_METADATA_URI_ENV)
+	if metadata_uri:
+		import urllib.request
+
+		try:
+			with urllib.request.urlopen(metadata_uri+'/task', timeout=ECS_METADATA_TIMEOUT) as response:
+				return json.load(response)['TaskARN'].split('/')[-1]
+		except (OSError, ValueError, KeyError) as err:
+			logging.warning('Failed to retrieve ECS task ID from task metadata: {}'.format(err))
+
+	return '{host}-{pid}'.format(host=socket.gethostname(), pid=os.getpid())
+
+def start_reporting(s3_client, bucket, interval, action, **dimensions):
+	"""Start reporting the progress of the current run (in the current context), to the status object of the task."""
+
+	reporter = ProgressReporter(s3_client, bucket, get_task_id(), interval, action, dimensions)
+	current_reporter.set(reporter)
+	reporter.start_reporting()
+
+	return reporter
+
+@contextmanager
+def track(total=None, unit='bytes', estimated=False):
+	"""
+	Track the progress of the enclosed block as a phase of the current run, named after the current metrics span
+	(so the phases of concurrent restore targets remain apart), and failed along with it.
+	Yields the phase, to be advanced by the work done (from any thread).
+	When no progress is being reported, the phase is tracked but not reported.
+	"""
+
+	reporter = current_reporter.get()
+	span = metrics.current_span.get()
+	phase = PhaseProgress(span.path if span is not None else 'run', total, unit, estimated)
+	if reporter is not None:
+		reporter.add_phase(phase)
+	try:
+		yield phase
+	except BaseException:
+		phase.finish('error')
+		raise
+	else:
+		phase.finish(span.status if span is not None else 'ok')
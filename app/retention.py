@@ -0,0 +1,84 @@
+import logging
+from datetime import datetime
+
+from catalog import get_backup_timestamp
+
+# Grandfather-father-son retention: besides the newest backup, the latest backup of each of the
+# `keep_daily` most recent days, `keep_weekly` most recent (ISO) weeks and `keep_monthly` most recent months
+# holding backups gets kept (a backup can be kept by several periods at once).
+BACKUP_TIMESTAMP_FORMAT = '%Y-%m-%d_%H-%M-%S'
+RETENTION_PERIODS = (
+	('keep_daily', lambda moment: moment.date()),
+	('keep_weekly', lambda moment: tuple(moment.isocalendar()[:2])),
+	('keep_monthly', lambda moment: (moment.year, moment.month))
+)
+
+def list_backup_objects(s3_client, bucket, backup_prefix, backup_key_suffixes):
+	"""
+	List all (complete) backups under `backup_prefix` along with the objects they consist of
+	(all files of directory-format backups), in a single listing pass.
+	Returns the backups (dicts holding key, timestamp and objects), sorted by timestamp.
+	"""
+
+	backups = {}
+	objects = []
+	paginator = s3_client.get_paginator('list_objects_v2')
+	for page in paginator.paginate(Bucket=bucket, Prefix=backup_prefix):
+		for obj in page.get('Contents', []):
+			objects.append(obj)
+			if obj['Key'].endswith(backup_key_suffixes):
+				timestamp = get_backup_timestamp(obj['Key'], backup_prefix, backup_key_suffixes)
+				backups[timestamp] = {'key': obj['Key'], 'timestamp': timestamp, 'objects': []}
+
+	for obj in objects:
+		relative_key = obj['Key'][len(backup_prefix):]
+		if '/' in relative_key:
+			# All files of a directory-format backup (including its manifest)
+			timestamp = relative_key.split('/', 1)[0]
+		elif obj['Key'].endswith(backup_key_suffixes):
+			timestamp = get_backup_timestamp(obj['Key'], backup_prefix, backup_key_suffixes)
+		else:
+			continue
+
+		# Files of incomplete directory-format backups (without manifest) are left alone
+		if timestamp in backups:
+			backups[timestamp]['objects'].append(obj)
+
+	return [ backups[timestamp] for timestamp in sorted(backups) ]
+
+def select_retained_backups(timestamps, keep_daily=0, keep_weekly=0, keep_monthly=0):
+	"""
+	Select the backup timestamps to keep by grandfather-father-son retention (see RETENTION_PERIODS).
+	The newest backup, and backups with unrecognized timestamps, are always kept.
+	"""
+
+	counts = {'keep_daily': keep_daily, 'keep_weekly': keep_weekly, 'keep_monthly': keep_monthly}
+
+	retained = set()
+	moments = []
+	for timestamp in timestamps:
+		try:
+			moments.append((datetime.strptime(timestamp, BACKUP_TIMESTAMP_FORMAT), timestamp))
+		except ValueError:
+			logging.warning('Unrecognized backup timestamp {}, keeping backup.'.format(timestamp))
+			retained.add(timestamp)
+
+	# Newest first, so the latest backup of every period gets kept
+	moments.sort(reverse=True)
+	if moments:
+		retained.add(moments[0][1])
+
+	for policy, get_period in RETENTION_PERIODS:
+		remaining = counts[policy]
+		last_period = None
+		for moment, timestamp in moments:
+			if remaining <= 0:
+				break
+
+			period = get_period(moment)
+			if period != last_period:
+				retained.add(timestamp)
+				last_period = period
+				remaining -= 1
+
+	return retained
@@ -0,0 +1,395 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+MIB = 1024 * 1024
+
+# S3 multipart upload limits
+S3_MIN_PART_SIZE = 5 * MIB
+S3_MAX_PARTS = 10000
+# Objects larger than this cannot be copied in a single request
+S3_MAX_COPY_SIZE = 5 * 1024 * MIB
+# Maximum number of keys per DeleteObjects request
+S3_DELETE_BATCH_SIZE = 1000
+
+# Object tag holding the SHA-256 checksum of a backup file
+# (tagged once uploaded, as object metadata can only be defined before the checksum is known)
+CHECKSUM_TAG = 'sha256'
+
+class MultipartStreamUpload:
+	"""
+	Upload a (non-seekable) binary stream to S3 as a multipart upload,
+	without staging it on local disk.
+
+	Parts of `part_size` bytes are read from the stream and uploaded
+	by up to `concurrency` parallel workers. Reading blocks while all workers are busy,
+	so at most `concurrency`+1 parts are held in memory at any time.
+	The upload only becomes visible in S3 once `complete()` is called,
+	so callers can validate the producer of the stream first (and `abort()` otherwise).
+	The SHA-256 checksum of all data read is computed along the way (see `sha256`).
+	`progress_callback` (if defined) gets called with the size of every part uploaded.
+	"""
+
+	def __init__(self, s3_client, bucket, key, part_size, concurrency, progress_callback=None, **create_args) -> None:
+		if part_size < S3_MIN_PART_SIZE:
+			raise ValueError('Multipart upload part size must be at least {} bytes.'.format(S3_MIN_PART_SIZE))
+
+		self.s3_client = s3_client
+		self.bucket = bucket
+		self.key = key
+		self.part_size = part_size
+		self.concurrency = concurrency
+		self.progress_callback = progress_callback
+		self.create_args = create_args
+
+		self.upload_id = None
+		self.parts = {}
+		self.bytes_uploaded = 0
+		self.error = None
+		self.sha256 = hashlib.sha256()
+
+		self._lock = threading.Lock()
+		self._slots = threading.BoundedSemaphore(concurrency)
+
+	def upload_stream(self, stream):
+		"""
+		Read `stream` until EOF and upload all data read as parts.
+		Returns the total number of bytes read from the stream.
+		Raises the first upload error encountered (if any).
+		"""
+
+		response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.create_args)
+		self.upload_id = response['UploadId']
+		logging.debug('Started multipart upload {} to s3://{}/{}'.format(self.upload_id, self.bucket, self.key))
+
+		total_size = 0
+		part_number = 0
+		with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='s3-upload') as executor:
+			while self.error is None:
+				# Wait for a free upload slot before reading the next part,
+				# to bound the amount of data held in memory.
+				self._slots.acquire()
+				data = self._read_part(stream)
+				if not data and part_number > 0:
+					self._slots.release()
+					break
+
+				part_number += 1
+				if part_number > S3_MAX_PARTS:
+					self._slots.release()
+					self.error = Exception('Stream exceeds the maximum upload size ({} parts of {} bytes).'.format(
+						S3_MAX_PARTS, self.part_size))
+					break
+
+				total_size += len(data)
+				self.sha256.update(data)
+				executor.submit(self._upload_part, part_number, data)
+
+				if len(data) < self.part_size:
+					break
+
+		if self.error is not None:
+			raise self.error
+
+		return total_size
+
+	def _read_part(self, stream):
+		# Streams may return less data than requested before reaching EOF
+		blocks = []
+		size = 0
+		while size < self.part_size:
+			block = stream.read(self.part_size - size)
+			if not block:
+				break
+			blocks.append(block)
+			size += len(block)
+
+		return b''.join(blocks)
+
+	def _upload_part(self, part_number, data):
+		try:
+			if self.error is not None:
+				return
+			response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+				PartNumber=part_number, Body=data)
+			with self._lock:
+				self.parts[part_number] = response['ETag']
+				self.bytes_uploaded += len(data)
+			if self.progress_callback is not None:
+				self.progress_callback(len(data))
+			logging.debug('Uploaded part {} ({} bytes) of s3://{}/{}'.format(part_number, len(data), self.bucket, self.key))
+		except Exception as err:
+			logging.error('Upload of part {} failed: {}'.format(part_number, err))
+			with self._lock:
+				if self.error is None:
+					self.error = err
+		finally:
+			self._slots.release()
+
+	def complete(self):
+		"""Complete the multipart upload, making the uploaded object available in S3."""
+
+		multipart_upload = {
+			'Parts': [ {'PartNumber': number, 'ETag': etag} for number, etag in sorted(self.parts.items()) ]
+		}
+		return self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key,
+			UploadId=self.upload_id, MultipartUpload=multipart_upload)
+
+	def abort(self):
+		"""Abort the multipart upload (if started), discarding all uploaded parts."""
+
+		if self.upload_id is None:
+			return
+
+		logging.info('Aborting multipart upload to s3://{}/{}...'.format(self.bucket, self.key))
+		try:
+			self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+		except Exception as err:
+			logging.error('Failed to abort multipart upload {}: {}'.format(self.upload_id, err))
+
+def set_checksum_tag(s3_client, bucket, key, sha256):
+	"""Tag an uploaded object with its SHA-256 checksum."""
+
+	s3_client.put_object_tagging(Bucket=bucket, Key=key, Tagging={'TagSet': [ {'Key': CHECKSUM_TAG, 'Value': sha256} ]})
+
+def get_checksum_tag(s3_client, bucket, key):
+	"""Return the SHA-256 checksum an object was tagged with, or None."""
+
+	tag_set = s3_client.get_object_tagging(Bucket=bucket, Key=key)['TagSet']
+	for tag in tag_set:
+		if tag['Key'] == CHECKSUM_TAG:
+			return tag['Value']
+
+	return None
+
+def delete_objects(s3_client, bucket, keys):
+	"""
+	Delete objects in batches of S3_DELETE_BATCH_SIZE keys per request.
+	Returns the errors reported for keys that could not be deleted.
+	"""
+
+	errors = []
+	for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+		response = s3_client.delete_objects(Bucket=bucket, Delete={
+			'Objects': [ {'Key': key} for key in keys[start:start+S3_DELETE_BATCH_SIZE] ],
+			'Quiet': True
+		})
+		errors.extend('{key}: {message}'.format(key=error['Key'], message=error['Message']) for error in response.get('Errors', []))
+
+	return errors
+
+def change_storage_class(s3_client, bucket, key, storage_class, part_size, concurrency):
+	"""
+	Move an object to another storage class by copying it onto itself (server-side),
+	keeping its metadata and tags. Objects too large for a single copy request get copied
+	in parts of (at least) `part_size`, by up to `concurrency` parallel workers.
+	Returns the ETag of the copied object (which may differ from the original one).
+	"""
+
+	head = s3_client.head_object(Bucket=bucket, Key=key)
+	copy_source = {'Bucket': bucket, 'Key': key}
+
+	if head['ContentLength'] <= S3_MAX_COPY_SIZE:
+		response = s3_client.copy_object(Bucket=bucket, Key=key, CopySource=copy_source, StorageClass=storage_class,
+			MetadataDirective='COPY', TaggingDirective='COPY', CopySourceIfMatch=head['ETag'])
+
+		return response['CopyObjectResult']['ETag']
+
+	tag_set = s3_client.get_object_tagging(Bucket=bucket, Key=key)['TagSet']
+	upload_args = {'StorageClass': storage_class, 'Metadata': head.get('Metadata', {})}
+	if 'ContentType' in head:
+		upload_args['ContentType'] = head['ContentType']
+	if tag_set:
+		upload_args['Tagging'] = urlencode([ (tag['Key'], tag['Value']) for tag in tag_set ])
+
+	size = head['ContentLength']
+	part_size = max(part_size, math.ceil(size / S3_MAX_PARTS))
+	upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, **upload_args)['UploadId']
+
+	def copy_part(part_number):
+		start = (part_number-1) * part_size
+		end = min(start+part_size, size) - 1
+		response = s3_client.upload_part_copy(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number,
+			CopySource=copy_source, CopySourceRange='bytes={}-{}'.format(start, end), CopySourceIfMatch=head['ETag'])
+
+		return {'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']}
+
+	try:
+		with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='s3-copy') as executor:
+			parts = list(executor.map(copy_part, range(1, math.ceil(size / part_size)+1)))
+		response = s3_client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+			MultipartUpload={'Parts': parts})
+	except Exception:
+		s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+		raise
+
+	return response['ETag']
+
+class OrderedChecksum:
+	"""
+	Compute the SHA-256 checksum of a file downloaded as (concurrent, out-of-order) ranges,
+	hashing every range as it arrives, without reading the file back.
+	Ranges arriving ahead of the next range to hash are held in memory,
+	blocking their downloader while more than `window` bytes ahead.
+	"""
+
+	def __init__(self, expected, window) -> None:
+		self.expected = expected
+		self.window = window
+		self.sha256 = hashlib.sha256()
+		self.offset = 0
+		self.pending = {}
+		self.aborted = False
+		self.condition = threading.Condition()
+
+	def update(self, offset, data):
+		with self.condition:
+			# The range at the current offset never waits, so hashing always makes progress
+			while offset - self.offset > self.window and not self.aborted:
+				self.condition.wait()
+			if self.aborted:
+				raise Exception('Checksum computation aborted.')
+
+			self.pending[offset] = data
+			while self.offset in self.pending:
+				data = self.pending.pop(self.offset)
+				self.sha256.update(data)
+				self.offset += len(data)
+			self.condition.notify_all()
+
+	def abort(self):
+		with self.condition:
+			self.aborted = True
+			self.pending.clear()
+			self.condition.notify_all()
+
+	def matches(self):
+		return not self.pending and self.sha256.hexdigest() == self.expected
+
+def file_sha256(filepath):
+	"""Return the size and SHA-256 hex digest of a local file."""
+
+	sha256 = hashlib.sha256()
+	size = 0
+	with open(filepath, 'rb') as file:
+		for block in iter(lambda: file.read(MIB), b''):
+			sha256.update(block)
+			size += len(block)
+
+	return size, sha256.hexdigest()
+
+def upload_file_with_checksum(s3_client, filepath, bucket, key, extra_args=None, progress_callback=None, transfer_config=None):
+	"""
+	Upload a local file to S3 (as a managed transfer, configured by `transfer_config` when defined),
+	calling `progress_callback` (if defined) with the number of bytes transferred along the way.
+	Returns a dict with the size and SHA-256 checksum of the uploaded file.
+	"""
+
+	size, sha256 = file_sha256(filepath)
+	s3_client.upload_file(filepath, bucket, key, ExtraArgs=extra_args, Callback=progress_callback, Config=transfer_config)
+
+	return {'size': size, 'sha256': sha256}
+
+def download_file_parallel(s3_client, bucket, key, filepath, part_size, concurrency, sha256=None, progress_callback=None):
+	"""
+	Download an S3 object to `filepath` using `concurrency` parallel ranged GET requests
+	of `part_size` bytes each, writing every range directly at its offset in a preallocated file.
+	When defined, the download gets verified against the expected `sha256` checksum.
+	`progress_callback` (if defined) gets called with the size of every range downloaded.
+	Returns the object size (in bytes). Raises on failure.
+	"""
+
+	head = s3_client.head_object(Bucket=bucket, Key=key)
+	files = [ {'key': key, 'filepath': filepath, 'size': head['ContentLength'], 'etag': head['ETag'], 'sha256': sha256} ]
+
+	return download_files_parallel(s3_client, bucket, files, part_size, concurrency, progress_callback)
+
+def download_files_parallel(s3_client, bucket, files, part_size, concurrency, progress_callback=None):
+	"""
+	Download a set of S3 objects, defined as a list of dicts with keys
+	`key`, `filepath`, `size` and (optionally) `etag` and `sha256`,
+	using a single pool of `concurrency` parallel ranged GET requests of `part_size` bytes each.
+	Ranges of all files are fetched concurrently, so large files do not serialize the download.
+	Files with a `sha256` checksum get verified while their ranges arrive.
+	`progress_callback` (if defined) gets called with the size of every range downloaded.
+	Returns the total size (in bytes) downloaded. Raises on failure.
+	"""
+
+	checksums = {}
+	ranges = []
+	for file in files:
+		if file.get('sha256'):
+			checksums[file['key']] = OrderedChecksum(file['sha256'], window=2*concurrency*part_size)
+
+		logging.debug('Downloading s3://{}/{} ({} bytes) in parts of {} bytes...'.format(
+			bucket, file['key'], file['size'], part_size))
+
+		# Preallocate the target file, so every range can be written at its offset
+		fd = os.open(file['filepath'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+		try:
+			if file['size'] > 0:
+				try:
+					os.posix_fallocate(fd, 0, file['size'])
+				except (AttributeError, OSError):
+					os.ftruncate(fd, file['size'])
+		finally:
+			os.close(fd)
+
+		for start in range(0, file['size'], part_size):
+			ranges.append((file, start))
+
+	def download_range(file, start):
+		try:
+			fetch_range(file, start)
+		except Exception:
+			# Release downloaders of later ranges waiting on this range to be hashed
+			if file['key'] in checksums:
+				checksums[file['key']].abort()
+			raise
+
+	def fetch_range(file, start):
+		end = min(start + part_size, file['size']) - 1
+		get_args = {'Bucket': bucket, 'Key': file['key'], 'Range': 'bytes={}-{}'.format(start, end)}
+		# Pin the ETag to guarantee all ranges come from the same object version
+		if file.get('etag'):
+			get_args['IfMatch'] = file['etag']
+		response = s3_client.get_object(**get_args)
+		data = response['Body'].read()
+		if len(data) != end - start + 1:
+			raise Exception('Incomplete range {}-{} received for s3://{}/{}'.format(start, end, bucket, file['key']))
+
+		fd = os.open(file['filepath'], os.O_WRONLY)
+		try:
+			written = 0
+			while written < len(data):
+				written += os.pwrite(fd, memoryview(data)[written:], start + written)
+		finally:
+			os.close(fd)
+
+		if file['key'] in checksums:
+			checksums[file['key']].update(start, data)
+		if progress_callback is not None:
+			progress_callback(len(data))
+
+	with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='s3-download') as executor:
+		futures = [ executor.submit(download_range, *file_range) for file_range in ranges ]
+		try:
+			for future in futures:
+				future.result()
+		except Exception:
+			for future in futures:
+				future.cancel()
+			for checksum in checksums.values():
+				checksum.abort()
+			raise
+
+	for key, checksum in checksums.items():
+		if not checksum.matches():
+			raise Exception('Checksum verification failed for s3://{}/{}.'.format(bucket, key))
+		logging.debug('Verified checksum of s3://{}/{}.'.format(bucket, key))
+
+	return sum(file['size'] for file in files)
@@ -0,0 +1,58 @@
+import logging
+import threading
+import time
+
+# SSM parameters get retrieved in batches (GetParameters accepts up to 10 names per request)
+# and cached in-process for SSM_CACHE_TTL seconds, shared by all jobs of a (batch or multi-target) run
+# and across invocations of a warm Lambda function.
+# Parameters found missing get cached as well, so optional parameters do not get requested again.
+SSM_GET_PARAMETERS_MAX_NAMES = 10
+SSM_CACHE_TTL = 300
+
+class ParameterCache:
+	"""In-process TTL cache of SSM parameter values (None for missing parameters), by region and name."""
+
+	def __init__(self, ttl=SSM_CACHE_TTL) -> None:
+		self.ttl = ttl
+		self.entries = {}
+		# Held while fetching, so concurrent jobs requesting the same parameters wait for a single request
+		self.lock = threading.Lock()
+
+	def get_parameters(self, ssm_client, names):
+		"""
+		Return the (decrypted) values of SSM parameters `names`, as a dict by name,
+		fetching all names not cached (or expired) in batched GetParameters requests.
+		Missing parameters are left out of the returned dict.
+		"""
+
+		region = ssm_client.meta.region_name
+		values = {}
+		with self.lock:
+			now = time.monotonic()
+			missing_names = []
+			for name in dict.fromkeys(names):
+				entry = self.entries.get((region, name))
+				if entry is not None and entry[1] > now:
+					values[name] = entry[0]
+				else:
+					missing_names.append(name)
+
+			if missing_names:
+				logging.debug('Retrieving SSM parameters {}...'.format(', '.join(missing_names)))
+			for start in range(0, len(missing_names), SSM_GET_PARAMETERS_MAX_NAMES):
+				batch = missing_names[start:start + SSM_GET_PARAMETERS_MAX_NAMES]
+				response = ssm_client.get_parameters(Names=batch, WithDecryption=True)
+				found = { param['Name']: param['Value'] for param in response['Parameters'] }
+				expiry = time.monotonic() + self.ttl
+				for name in batch:
+					self.entries[(region, name)] = (found.get(name), expiry)
+					values[name] = found.get(name)
+
+		return { name: value for name, value in values.items() if value is not None }
+
+parameter_cache = ParameterCache()
+
+def get_ssm_parameters(ssm_client, names):
+	"""Return the values of SSM parameters `names` (by name, leaving out missing parameters), through the shared cache."""
+
+	return parameter_cache.get_parameters(ssm_client, names)
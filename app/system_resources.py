@@ -0,0 +1,68 @@
+import logging
+import math
+import os
+
+# Resource limits of the container the application runs in (e.g. a Fargate task),
+# as enforced through cgroups (v2 or v1), falling back to those of the host.
+CGROUP_V2_DIR = '/sys/fs/cgroup'
+CGROUP_V1_CPU_DIR = '/sys/fs/cgroup/cpu'
+CGROUP_V1_MEMORY_DIR = '/sys/fs/cgroup/memory'
+# cgroup v1 reports "no limit" as a very large number (page-rounded LONG_MAX)
+CGROUP_V1_NO_LIMIT = 2**60
+
+def read_cgroup_file(filepath):
+	try:
+		with open(filepath) as cgroup_file:
+			return cgroup_file.read().strip()
+	except OSError:
+		return None
+
+def get_cpu_count():
+	"""Return the number of (possibly fractional) CPUs available to this process, rounded up."""
+
+	cpu_limit = None
+
+	cpu_max = read_cgroup_file(os.path.join(CGROUP_V2_DIR, 'cpu.max'))
+	if cpu_max is not None:
+		quota, period = cpu_max.split()
+		if quota != 'max':
+			cpu_limit = int(quota) / int(period)
+	else:
+		quota = read_cgroup_file(os.path.join(CGROUP_V1_CPU_DIR, 'cpu.cfs_quota_us'))
+		period = read_cgroup_file(os.path.join(CGROUP_V1_CPU_DIR, 'cpu.cfs_period_us'))
+		if quota is not None and period is not None and int(quota) > 0:
+			cpu_limit = int(quota) / int(period)
+
+	try:
+		cpu_count = len(os.sched_getaffinity(0))
+	except AttributeError:
+		cpu_count = os.cpu_count() or 1
+
+	if cpu_limit is not None:
+		cpu_count = min(cpu_count, max(1, math.ceil(cpu_limit)))
+
+	logging.debug('Available CPUs: {}'.format(cpu_count))
+
+	return int(cpu_count)
+
+def get_memory_limit():
+	"""Return the amount of memory (in bytes) available to this process."""
+
+	memory_limit = None
+
+	memory_max = read_cgroup_file(os.path.join(CGROUP_V2_DIR, 'memory.max'))
+	if memory_max is not None:
+		if memory_max != 'max':
+			memory_limit = int(memory_max)
+	else:
+		limit_in_bytes = read_cgroup_file(os.path.join(CGROUP_V1_MEMORY_DIR, 'memory.limit_in_bytes'))
+		if limit_in_bytes is not None and int(limit_in_bytes) < CGROUP_V1_NO_LIMIT:
+			memory_limit = int(limit_in_bytes)
+
+	physical_memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+	if memory_limit is None or memory_limit > physical_memory:
+		memory_limit = physical_memory
+
+	logging.debug('Available memory: {} bytes'.format(memory_limit))
+
+	return memory_limit
@@ -0,0 +1,183 @@
+import logging
+import math
+import subprocess
+
+from compression import CompressingReader, DecompressingReader
+from process_runner import ProcessRunner
+from s3_transfer import MIB
+
+# Directory-format backups can dump the data of large tables (see split_table_size) in ranges,
+# by parallel workers each running a COPY of its range through psql, all under the snapshot exported
+# by a coordinating transaction, which pg_dump uses as well (--snapshot) while leaving out their data.
+# Every range gets compressed and uploaded as a file of its own, listed (per table) in the backup manifest.
+# Restores load all ranges in parallel (COPY FROM) along with the data section of the backup,
+# so indexes and constraints only get created once all data got loaded.
+# Ranges cover blocks of the table (ctid, as TID range scans on postgres 14+),
+# or ranges of a single-column integer primary key on older servers.
+SPLIT_PART_NAME = 'split_{table:04d}_{part:05d}.dat'
+TID_RANGE_SCAN_VERSION = 140000
+GENERATED_COLUMNS_VERSION = 120000
+# Session settings dumping and loading data the way pg_dump and pg_restore do
+SESSION_OPTIONS = '-c datestyle=ISO -c intervalstyle=postgres -c extra_float_digits=3 -c row_security=off'
+PSQL_COMMAND = ['psql', '-X', '-q', '-v', 'ON_ERROR_STOP=1']
+
+# Ordinary (non-temporary) tables of at least %s bytes, not belonging to an extension, largest first
+FIND_TABLES_QUERY = """
+SELECT c.oid, n.nspname, c.relname, pg_relation_size(c.oid),
+       pg_relation_size(c.oid) / current_setting('block_size')::int
+FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'r' AND c.relpersistence <> 't'
+  AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+  AND NOT EXISTS (SELECT 1 FROM pg_depend d
+                  WHERE d.classid = 'pg_class'::regclass AND d.objid = c.oid AND d.deptype = 'e')
+  AND pg_relation_size(c.oid) >= %s
+ORDER BY 4 DESC
+"""
+INTEGER_KEY_QUERY = """
+SELECT a.attname FROM pg_index i
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+WHERE i.indrelid = %s AND i.indisprimary AND i.indnatts = 1 AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)
+"""
+
+def quote_ident(name):
+	return '"{}"'.format(name.replace('"', '""'))
+
+def qualified_name(table):
+	return '{}.{}'.format(quote_ident(table['schema']), quote_ident(table['name']))
+
+def export_split_tables(connection, min_size, min_parts):
+	"""
+	Start a (repeatable read) transaction on `connection` and export its snapshot, to be shared by pg_dump and all range workers.
+	The connection must remain open until all of them completed.
+	Returns the snapshot ID and the tables of at least `min_size` bytes (locked until the transaction ends),
+	each defined by its schema, name, columns, encoding and (at least `min_parts`) ranges to dump its data in.
+	"""
+
+	connection.execute('BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY')
+	snapshot = connection.execute('SELECT pg_export_snapshot()')[0][0]
+	encoding = connection.execute('SHOW server_encoding')[0][0]
+	server_version = connection.connection.server_version
+
+	tables = []
+	for oid, schema, name, size, pages in connection.execute(FIND_TABLES_QUERY, (min_size,)):
+		table = {'schema': schema, 'name': name, 'size': size, 'encoding': encoding, 'key': None}
+		# Keep the table from being altered or truncated until all of its ranges got dumped (as pg_dump does)
+		connection.execute('LOCK TABLE {} IN ACCESS SHARE MODE'.format(qualified_name(table)))
+
+		count = max(min_parts, math.ceil(size / min_size))
+		if server_version >= TID_RANGE_SCAN_VERSION:
+			table['ranges'] = split_range(0, pages, count)
+		else:
+			rows = connection.execute(INTEGER_KEY_QUERY, (oid,))
+			if not rows:
+				logging.info("Not splitting table {} (no single-column integer primary key).".format(qualified_name(table)))
+				continue
+
+			table['key'] = rows[0][0]
+			min_key, max_key = connection.execute('SELECT min({key}), max({key}) FROM {table}'.format(
+				key=quote_ident(table['key']), table=qualified_name(table)))[0]
+			table['ranges'] = split_range(min_key, max_key + 1, count) if min_key is not None else [(None, None)]
+
+		table['columns'] = get_copy_columns(connection, oid, server_version)
+		tables.append(table)
+
+		logging.info("Splitting table {table} ({size} bytes) into {count} ranges (by {key}).".format(
+			table=qualified_name(table), size=size, count=len(table['ranges']), key=table['key'] or 'ctid'))
+
+	return snapshot, tables
+
+def split_range(first, end, count):
+	"""
+	Split the values from `first` up to (not including) `end` into up to `count` (start, end) ranges of about equal size.
+	The first and last ranges are open-ended (None), so values outside of the range get covered as well,
+	empty ranges (when splitting fewer values than `count`) are left out.
+	"""
+
+	bounds = sorted(set(first + (end - first) * index // count for index in range(1, count)) - {first})
+
+	return list(zip([None]+bounds, bounds+[None]))
+
+def get_copy_columns(connection, oid, server_version):
+	"""Return the columns of table `oid` holding data to dump (leaving out dropped and generated columns)."""
+
+	query = 'SELECT attname FROM pg_attribute WHERE attrelid = %s AND attnum > 0 AND NOT attisdropped'
+	if server_version >= GENERATED_COLUMNS_VERSION:
+		query += " AND attgenerated = ''"
+
+	return [ row[0] for row in connection.execute(query+' ORDER BY attnum', (oid,)) ]
+
+def get_range_condition(table, table_range):
+	if table['key'] is None:
+		column = 'ctid'
+		bound = "'({},0)'::tid"
+	else:
+		column = quote_ident(table['key'])
+		bound = '{}'
+
+	start, end = table_range
+	conditions = []
+	if start is not None:
+		conditions.append('{} >= {}'.format(column, bound.format(start)))
+	if end is not None:
+		conditions.append('{} < {}'.format(column, bound.format(end)))
+
+	return ' WHERE '+' AND '.join(conditions) if conditions else ''
+
+def get_session_env(pg_env, encoding):
+	env = dict(pg_env)
+	env['PGOPTIONS'] = (pg_env.get('PGOPTIONS', '')+' '+SESSION_OPTIONS).strip()
+	env['PGCLIENTENCODING'] = encoding
+
+	return env
+
+def dump_table_range(pg_env, db_name, snapshot, table, table_range, filepath, codec, level=None, timeout=None):
+	"""
+	Dump a range of `table` (as returned by export_split_tables) from DB `db_name`,
+	as seen by `snapshot`, to local file `filepath` (in COPY text format, compressed with `codec`). Raises on failure.
+	"""
+
+	query = 'COPY (SELECT {columns} FROM {table}{condition}) TO STDOUT'.format(
+		columns=', '.join(quote_ident(column) for column in table['columns']), table=qualified_name(table),
+		condition=get_range_condition(table, table_range))
+	command = PSQL_COMMAND + ['-d', db_name, '-c', 'BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY',
+	                         '-c', "SET TRANSACTION SNAPSHOT '{}'".format(snapshot), '-c', query]
+
+	runner = ProcessRunner(command, 'psql', env=get_session_env(pg_env, table['encoding']), stdout='pipe', timeout=timeout).start()
+	try:
+		with open(filepath, 'wb') as part_file:
+			reader = CompressingReader(runner.stdout, codec, level) if codec != 'none' else runner.stdout
+			for block in iter(lambda: reader.read(MIB), b''):
+				part_file.write(block)
+	except Exception:
+		runner.cancel()
+		runner.wait()
+		raise
+
+	if runner.wait() != 0:
+		raise Exception(runner.failure_message())
+
+def load_table_part(pg_env, db_name, table, filepath, codec, timeout=None):
+	"""Load a range of `table` (as listed in the backup manifest) from local file `filepath` into DB `db_name`. Raises on failure."""
+
+	query = 'COPY {table} ({columns}) FROM STDIN'.format(table=qualified_name(table),
+		columns=', '.join(quote_ident(column) for column in table['columns']))
+	command = PSQL_COMMAND + ['-d', db_name, '-c', query]
+
+	runner = ProcessRunner(command, 'psql', env=get_session_env(pg_env, table['encoding']), stdin=subprocess.PIPE,
+		timeout=timeout).start()
+	try:
+		with open(filepath, 'rb') as part_file:
+			reader = DecompressingReader(part_file, codec) if codec != 'none' else part_file
+			for block in iter(lambda: reader.read(MIB), b''):
+				runner.process.stdin.write(block)
+		runner.process.stdin.close()
+	except BrokenPipeError:
+		# psql exited early, its failure gets reported below
+		pass
+	except Exception:
+		runner.cancel()
+		runner.wait()
+		raise
+
+	if runner.wait() != 0:
+		raise Exception(runner.failure_message())
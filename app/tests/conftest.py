@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# Application modules import each other as top-level modules (as when run from the app directory)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_BUCKET = 'agr-db-backups-test'
+
+@pytest.fixture
+def aws(monkeypatch):
+	"""Mock all AWS services (moto), with fake credentials, for the duration of a test."""
+
+	from moto import mock_aws
+
+	for name in ('AWS_ENDPOINT_URL', 'AWS_PROFILE'):
+		monkeypatch.delenv(name, raising=False)
+	monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+	monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+	monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+	with mock_aws():
+		yield
+
+@pytest.fixture
+def s3(aws):
+	"""S3 client on the mocked AWS, with an (empty) TEST_BUCKET."""
+
+	import boto3
+
+	client = boto3.client('s3', region_name='us-east-1')
+	client.create_bucket(Bucket=TEST_BUCKET)
+
+	return client
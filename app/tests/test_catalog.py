@@ -0,0 +1,37 @@
+from catalog import find_catalog_entry, get_backup_timestamp
+
+CATALOG = {'backups': [ {'key': 'app/dev/{}.dump'.format(timestamp), 'timestamp': timestamp}
+                        for timestamp in ('2026-01-01_00-00-00', '2026-01-02_10-00-00', '2026-01-02_12-00-00',
+                                          '2026-02-01_00-00-00') ]}
+
+def find_timestamp(prefix):
+	entry = find_catalog_entry(CATALOG, prefix)
+
+	return entry['timestamp'] if entry is not None else None
+
+def test_latest_backup():
+	assert find_timestamp('') == '2026-02-01_00-00-00'
+
+def test_latest_backup_matching_prefix():
+	assert find_timestamp('2026-01-02') == '2026-01-02_12-00-00'
+	assert find_timestamp('2026-01') == '2026-01-02_12-00-00'
+	assert find_timestamp('2026-01-02_10') == '2026-01-02_10-00-00'
+
+def test_exact_timestamp():
+	assert find_timestamp('2026-01-01_00-00-00') == '2026-01-01_00-00-00'
+
+def test_no_matching_backup():
+	# Before, after and in between the cataloged timestamps
+	assert find_timestamp('2025') is None
+	assert find_timestamp('2026-03') is None
+	assert find_timestamp('2026-01-02_11') is None
+
+def test_empty_catalog():
+	assert find_catalog_entry({'backups': []}) is None
+	assert find_catalog_entry({'backups': []}, '2026') is None
+
+def test_backup_timestamp():
+	suffixes = ('.dump', '.dump.zst', '/manifest.json')
+
+	assert get_backup_timestamp('app/dev/2026-01-01_00-00-00.dump', 'app/dev/', suffixes) == '2026-01-01_00-00-00'
+	assert get_backup_timestamp('app/dev/2026-01-01_00-00-00/manifest.json', 'app/dev/', suffixes) == '2026-01-01_00-00-00'
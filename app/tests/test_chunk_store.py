@@ -0,0 +1,70 @@
+import io
+import json
+import os
+
+from chunk_store import (CHUNK_MIN_SIZE, CHUNK_STORE_PREFIX, collect_garbage_chunks, download_deduplicated, move_referenced_chunks,
+                         upload_deduplicated)
+from conftest import TEST_BUCKET
+
+CHUNK_PREFIX = CHUNK_STORE_PREFIX.format(identifier='app')
+LEASE_PREFIX = 'app/_chunk_leases/'
+
+def backup(s3, data, recipe_key, codec):
+	recipe = upload_deduplicated(io.BytesIO(data), s3, TEST_BUCKET, CHUNK_PREFIX, concurrency=2, storage_class='STANDARD', codec=codec)
+	s3.put_object(Bucket=TEST_BUCKET, Key=recipe_key, Body=json.dumps(recipe).encode())
+
+	return recipe
+
+def restore(s3, recipe_key, tmp_path):
+	filepath = str(tmp_path / 'restored.dump')
+	download_deduplicated(s3, TEST_BUCKET, recipe_key, filepath, concurrency=2)
+	with open(filepath, 'rb') as restored:
+		return restored.read()
+
+def test_round_trip_reuses_chunks(s3, tmp_path):
+	data = os.urandom(3 * CHUNK_MIN_SIZE)
+	first = backup(s3, data, 'app/dev/1.recipe.json', 'zstd')
+	second = backup(s3, data, 'app/dev/2.recipe.json', 'zstd')
+
+	assert first['uploaded_size'] > 0 and second['uploaded_size'] == 0
+	assert restore(s3, 'app/dev/2.recipe.json', tmp_path) == data
+
+def test_codecs_do_not_share_chunks(s3, tmp_path):
+	# Backups of an identifier compressed differently (per env, or after changing the compression)
+	codecs = ['lz4', 'zstd', 'none']
+	data = os.urandom(3 * CHUNK_MIN_SIZE)
+	for codec in codecs:
+		assert backup(s3, data, 'app/{}/1.recipe.json'.format(codec), codec)['uploaded_size'] > 0
+
+	for codec in codecs:
+		assert restore(s3, 'app/{}/1.recipe.json'.format(codec), tmp_path) == data
+
+def test_garbage_collection(s3, tmp_path):
+	data = os.urandom(3 * CHUNK_MIN_SIZE)
+	backup(s3, data, 'app/dev/1.recipe.json', 'zstd')
+	backup(s3, os.urandom(3 * CHUNK_MIN_SIZE), 'app/dev/2.recipe.json', 'zstd')
+	backup(s3, data, 'app/prod/1.recipe.json', 'lz4')
+
+	s3.delete_object(Bucket=TEST_BUCKET, Key='app/dev/2.recipe.json')
+	assert collect_garbage_chunks(s3, TEST_BUCKET, 'app/', CHUNK_PREFIX, LEASE_PREFIX, min_age=-1) == 1
+	assert collect_garbage_chunks(s3, TEST_BUCKET, 'app/', CHUNK_PREFIX, LEASE_PREFIX, min_age=-1) == 0
+
+	assert restore(s3, 'app/dev/1.recipe.json', tmp_path) == data
+	assert restore(s3, 'app/prod/1.recipe.json', tmp_path) == data
+
+def test_move_referenced_chunks(s3):
+	hot = upload_deduplicated(io.BytesIO(os.urandom(3 * CHUNK_MIN_SIZE)), s3, TEST_BUCKET, CHUNK_PREFIX, concurrency=2,
+		storage_class='GLACIER_IR', codec='zstd')
+	cold = upload_deduplicated(io.BytesIO(os.urandom(3 * CHUNK_MIN_SIZE)), s3, TEST_BUCKET, CHUNK_PREFIX, concurrency=2,
+		storage_class='GLACIER_IR', codec='zstd')
+	s3.put_object(Bucket=TEST_BUCKET, Key='app/dev/1.recipe.json', Body=json.dumps(hot).encode())
+
+	assert move_referenced_chunks(s3, TEST_BUCKET, ['app/dev/1.recipe.json'], 'STANDARD', concurrency=2)[0] == len(hot['chunks'])
+	assert move_referenced_chunks(s3, TEST_BUCKET, ['app/dev/1.recipe.json'], 'STANDARD', concurrency=2) == (0, 0)
+
+	storage_classes = { obj['Key']: obj.get('StorageClass', 'STANDARD')
+	                    for obj in s3.list_objects_v2(Bucket=TEST_BUCKET, Prefix=CHUNK_PREFIX)['Contents'] }
+	for chunk_hash, _ in hot['chunks']:
+		assert storage_classes[hot['chunk_prefix']+chunk_hash] == 'STANDARD'
+	for chunk_hash, _ in cold['chunks']:
+		assert storage_classes[cold['chunk_prefix']+chunk_hash] == 'GLACIER_IR'
@@ -0,0 +1,66 @@
+import io
+import os
+
+import pytest
+
+from compression import (CompressingReader, DecompressingReader, compress_bytes, decompress_bytes, decompress_file,
+                         get_pg_dump_compress_option)
+
+CODECS = ('zlib', 'zstd', 'lz4', 'none')
+# Compressible and incompressible content, spanning several read blocks
+DATA = b'COPY data\t1\t2\n' * 20000 + os.urandom(100000)
+
+def read_all(reader, size):
+	blocks = []
+	for block in iter(lambda: reader.read(size), b''):
+		assert len(block) <= size
+		blocks.append(block)
+
+	return b''.join(blocks)
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_bytes_round_trip(codec):
+	assert decompress_bytes(compress_bytes(DATA, codec), codec) == DATA
+
+@pytest.mark.parametrize('codec', ('zlib', 'zstd', 'lz4'))
+def test_compression_level(codec):
+	assert decompress_bytes(compress_bytes(DATA, codec, level=1), codec) == DATA
+
+@pytest.mark.parametrize('codec', ('zlib', 'zstd', 'lz4'))
+def test_stream_round_trip(codec):
+	reader = CompressingReader(io.BytesIO(DATA), codec, block_size=4096)
+	compressed = read_all(reader, 1000)
+
+	assert decompress_bytes(compressed, codec) == DATA
+	assert reader.size == len(DATA)
+	assert read_all(DecompressingReader(io.BytesIO(compressed), codec, block_size=4096), 3000) == DATA
+
+@pytest.mark.parametrize('codec', ('zlib', 'zstd', 'lz4'))
+def test_stream_empty(codec):
+	compressed = read_all(CompressingReader(io.BytesIO(b''), codec), 1000)
+
+	assert read_all(DecompressingReader(io.BytesIO(compressed), codec), 1000) == b''
+
+@pytest.mark.parametrize('codec', ('zstd', 'lz4'))
+def test_decompress_file(codec, tmp_path):
+	src_filepath = tmp_path / 'dump.compressed'
+	dest_filepath = tmp_path / 'dump'
+	src_filepath.write_bytes(read_all(CompressingReader(io.BytesIO(DATA), codec), 65536))
+
+	decompress_file(str(src_filepath), str(dest_filepath), codec)
+
+	assert dest_filepath.read_bytes() == DATA
+
+def test_unsupported_codec():
+	with pytest.raises(ValueError):
+		compress_bytes(DATA, 'brotli')
+	with pytest.raises(ValueError):
+		DecompressingReader(io.BytesIO(b''), 'brotli')
+
+def test_pg_dump_compress_option():
+	assert get_pg_dump_compress_option('gzip') == ''
+	assert get_pg_dump_compress_option('gzip', 9) == '-Z 9'
+	assert get_pg_dump_compress_option('pg_zstd') == '-Z zstd'
+	assert get_pg_dump_compress_option('pg_zstd', 5) == '-Z zstd:5'
+	assert get_pg_dump_compress_option('none') == '-Z 0'
+	assert get_pg_dump_compress_option('zstd', 5) == '-Z 0'
@@ -0,0 +1,63 @@
+import threading
+
+from dump_cache import DumpCache
+
+def test_miss_then_hit(tmp_path):
+	cache = DumpCache(str(tmp_path), 10**6)
+	entry = cache.acquire('app/dev/2026-01-01_00-00-00.dump', 'etag')
+	assert not entry.hit
+	with open(entry.path, 'w') as dump_file:
+		dump_file.write('dump')
+	entry.commit()
+	entry.release()
+
+	entry = cache.acquire('app/dev/2026-01-01_00-00-00.dump', 'etag')
+	assert entry.hit and entry.size == 4
+	entry.release()
+
+	# Another version of the backup
+	entry = cache.acquire('app/dev/2026-01-01_00-00-00.dump', 'other-etag')
+	assert not entry.hit
+	entry.release()
+
+def test_concurrent_miss_uses_committed_download(tmp_path):
+	cache = DumpCache(str(tmp_path), 10**6)
+	downloader = cache.acquire('app/dev/2026-01-01_00-00-00.dump', 'etag')
+	assert not downloader.hit
+
+	acquired = threading.Event()
+	entries = []
+
+	def acquire():
+		entries.append(cache.acquire('app/dev/2026-01-01_00-00-00.dump', 'etag'))
+		acquired.set()
+
+	thread = threading.Thread(target=acquire)
+	thread.start()
+	# Waiting while the entry is being downloaded
+	assert not acquired.wait(0.5)
+
+	with open(downloader.path, 'w') as dump_file:
+		dump_file.write('dump')
+	downloader.commit()
+	# A hit as soon as committed, while the downloader still holds the entry (restoring from it)
+	assert acquired.wait(5)
+	assert entries[0].hit
+	thread.join()
+
+	entries[0].release()
+	downloader.release()
+
+def test_discarded_download_gets_downloaded_again(tmp_path):
+	cache = DumpCache(str(tmp_path), 10**6)
+	downloader = cache.acquire('app/dev/2026-01-01_00-00-00.dump', 'etag')
+
+	entries = []
+	thread = threading.Thread(target=lambda: entries.append(cache.acquire('app/dev/2026-01-01_00-00-00.dump', 'etag')))
+	thread.start()
+	downloader.discard()
+	downloader.release()
+	thread.join(5)
+
+	assert entries and not entries[0].hit
+	entries[0].release()
@@ -0,0 +1,67 @@
+import subprocess
+import threading
+import time
+
+from process_runner import ProcessRunner, TeeReader
+
+def test_exit_code_and_output():
+	lines = []
+	runner = ProcessRunner('echo out; echo err >&2; exit 3', 'sh', stdout='lines', line_callback=lines.append)
+
+	assert runner.run() == 3
+	assert sorted(lines) == ['err', 'out']
+	assert runner.failure_message().startswith('sh execution failed (exitcode 3).')
+	assert 'err' in runner.failure_message()
+
+def test_output_tail_only_keeps_recent_lines():
+	runner = ProcessRunner('seq 1 500', 'seq', stdout='lines', log_output=False)
+	runner.run()
+
+	assert runner.get_output_tail().split("\n")[-1] == '500'
+	assert '1' not in runner.get_output_tail().split("\n")
+
+def test_timeout_terminates_process_group():
+	start = time.monotonic()
+	# The sleep runs as a child of the shell, which must get terminated as well
+	runner = ProcessRunner('sleep 30; echo done', 'sleep', stdout='lines', timeout=0.5)
+
+	assert runner.run() != 0
+	assert runner.timed_out and not runner.cancelled
+	assert time.monotonic() - start < 10
+	assert runner.failure_message().startswith('sleep execution timed out after 0.5s.')
+
+def test_cancel_event():
+	cancel_event = threading.Event()
+	runner = ProcessRunner('sleep 30', 'sleep', cancel_event=cancel_event).start()
+	threading.Timer(0.2, cancel_event.set).start()
+
+	assert runner.wait() != 0
+	assert runner.cancelled and not runner.timed_out
+	assert runner.failure_message().startswith('sleep execution was cancelled.')
+
+def test_failing_line_callback_cancels():
+	def failing_callback(line):
+		raise ValueError('unexpected line')
+	runner = ProcessRunner('echo line; sleep 30', 'sh', stdout='lines', line_callback=failing_callback)
+
+	assert runner.run() != 0
+	assert runner.cancelled
+
+def test_piped_stdout():
+	runner = ProcessRunner(['printf', 'dump'], 'printf', stdout='pipe').start()
+	data = runner.stdout.read()
+
+	assert runner.wait() == 0 and data == b'dump'
+
+def test_tee_reader():
+	source = ProcessRunner(['printf', 'dump'], 'printf', stdout='pipe').start()
+	sink = ProcessRunner('cat', 'cat', stdin=subprocess.PIPE, stdout='pipe').start()
+	progress = []
+	tee = TeeReader(source.stdout, sink.process.stdin, progress_callback=progress.append)
+
+	data = b''.join(iter(lambda: tee.read(2), b''))
+	sink.process.stdin.close()
+
+	assert data == b'dump' and sink.stdout.read() == b'dump'
+	assert tee.size == sum(progress) == 4
+	assert source.wait() == 0 and sink.wait() == 0
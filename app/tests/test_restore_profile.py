@@ -0,0 +1,18 @@
+from app import DEFAULT_RESTORE_PROFILE, parse_restore_profile
+
+def test_default_profile():
+	settings = parse_restore_profile('default')
+
+	assert settings == DEFAULT_RESTORE_PROFILE
+	# A copy, not the shared default itself
+	settings['work_mem'] = '1GB'
+	assert DEFAULT_RESTORE_PROFILE.get('work_mem') != '1GB'
+
+def test_settings():
+	assert parse_restore_profile('maintenance_work_mem=2GB, synchronous_commit = off,auto_explain.log_min_duration=-1')\
+	       == {'maintenance_work_mem': '2GB', 'synchronous_commit': 'off', 'auto_explain.log_min_duration': '-1'}
+
+def test_invalid_profiles():
+	for restore_profile in ('', 'maintenance_work_mem', 'maintenance_work_mem=', '=2GB', '1setting=on',
+	                        'work_mem=1GB,', 'work mem=1GB'):
+		assert parse_restore_profile(restore_profile) is None, restore_profile
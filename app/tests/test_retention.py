@@ -0,0 +1,48 @@
+from retention import select_retained_backups
+
+def test_no_backups():
+	assert select_retained_backups([], keep_daily=7) == set()
+
+def test_newest_always_kept():
+	timestamps = ['2026-03-01_00-00-00', '2026-03-02_00-00-00']
+
+	assert select_retained_backups(timestamps) == {'2026-03-02_00-00-00'}
+
+def test_unrecognized_timestamps_kept():
+	timestamps = ['2026-03-01_00-00-00', '2026-03-02_00-00-00', 'manual-copy']
+
+	assert select_retained_backups(timestamps) == {'2026-03-02_00-00-00', 'manual-copy'}
+
+def test_daily_keeps_latest_backup_of_each_day():
+	timestamps = ['2026-03-01_01-00-00', '2026-03-01_23-00-00', '2026-03-02_01-00-00', '2026-03-02_13-00-00',
+	              '2026-03-03_01-00-00']
+
+	assert select_retained_backups(timestamps, keep_daily=2) == {'2026-03-03_01-00-00', '2026-03-02_13-00-00'}
+
+def test_daily_counts_days_holding_backups():
+	# Days without backups do not count against keep_daily
+	timestamps = ['2026-03-01_00-00-00', '2026-03-05_00-00-00', '2026-03-10_00-00-00']
+
+	assert select_retained_backups(timestamps, keep_daily=2) == {'2026-03-10_00-00-00', '2026-03-05_00-00-00'}
+
+def test_weekly_uses_iso_weeks_across_years():
+	# 2025-12-29 (Monday) and 2026-01-04 (Sunday) are both in ISO week 1 of 2026
+	timestamps = ['2025-12-29_00-00-00', '2026-01-04_00-00-00', '2026-01-05_00-00-00']
+
+	assert select_retained_backups(timestamps, keep_weekly=2) == {'2026-01-05_00-00-00', '2026-01-04_00-00-00'}
+
+def test_monthly_skips_months_without_backups():
+	timestamps = ['2025-12-31_00-00-00', '2026-01-15_00-00-00', '2026-03-10_00-00-00', '2026-03-20_00-00-00']
+
+	assert select_retained_backups(timestamps, keep_monthly=2) == {'2026-03-20_00-00-00', '2026-01-15_00-00-00'}
+
+def test_periods_overlap():
+	timestamps = ['2026-01-31_00-00-00', '2026-02-01_00-00-00', '2026-02-02_00-00-00']
+
+	assert select_retained_backups(timestamps, keep_daily=2, keep_monthly=2)\
+	       == {'2026-02-02_00-00-00', '2026-02-01_00-00-00', '2026-01-31_00-00-00'}
+
+def test_input_order_irrelevant():
+	timestamps = ['2026-03-03_00-00-00', '2026-03-01_00-00-00', '2026-03-02_00-00-00']
+
+	assert select_retained_backups(timestamps, keep_daily=2) == {'2026-03-03_00-00-00', '2026-03-02_00-00-00'}
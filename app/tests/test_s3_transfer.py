@@ -0,0 +1,144 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+from conftest import TEST_BUCKET
+from s3_transfer import S3_MIN_PART_SIZE, MultipartStreamUpload, OrderedChecksum, download_file_parallel, download_files_parallel
+
+class TrickleStream(io.BytesIO):
+	"""Stream returning less data than requested (as pipes do)."""
+
+	def read(self, size=-1):
+		return super().read(min(size, 1000) if size >= 0 else size)
+
+def test_stream_upload(s3):
+	data = os.urandom(2 * S3_MIN_PART_SIZE + 1234)
+	progress = []
+	upload = MultipartStreamUpload(s3, TEST_BUCKET, 'app/dev/1.dump', part_size=S3_MIN_PART_SIZE, concurrency=2,
+		progress_callback=progress.append, StorageClass='STANDARD')
+
+	assert upload.upload_stream(TrickleStream(data)) == len(data)
+	# Nothing visible before completing the upload
+	assert 'Contents' not in s3.list_objects_v2(Bucket=TEST_BUCKET)
+	upload.complete()
+
+	assert s3.get_object(Bucket=TEST_BUCKET, Key='app/dev/1.dump')['Body'].read() == data
+	assert upload.bytes_uploaded == sum(progress) == len(data)
+	assert len(progress) == 3
+	assert upload.sha256.hexdigest() == hashlib.sha256(data).hexdigest()
+
+def test_empty_stream_upload(s3):
+	upload = MultipartStreamUpload(s3, TEST_BUCKET, 'app/dev/1.dump', part_size=S3_MIN_PART_SIZE, concurrency=2)
+	assert upload.upload_stream(io.BytesIO()) == 0
+	upload.complete()
+
+	assert s3.get_object(Bucket=TEST_BUCKET, Key='app/dev/1.dump')['Body'].read() == b''
+
+def test_abort(s3):
+	upload = MultipartStreamUpload(s3, TEST_BUCKET, 'app/dev/1.dump', part_size=S3_MIN_PART_SIZE, concurrency=2)
+	upload.upload_stream(io.BytesIO(os.urandom(S3_MIN_PART_SIZE + 1)))
+	upload.abort()
+
+	assert 'Uploads' not in s3.list_multipart_uploads(Bucket=TEST_BUCKET)
+	assert 'Contents' not in s3.list_objects_v2(Bucket=TEST_BUCKET)
+
+def test_part_upload_error(s3, monkeypatch):
+	upload_part = s3.upload_part
+	def failing_upload_part(**kwargs):
+		if kwargs['PartNumber'] == 2:
+			raise Exception('Part upload failed')
+		return upload_part(**kwargs)
+	monkeypatch.setattr(s3, 'upload_part', failing_upload_part)
+
+	upload = MultipartStreamUpload(s3, TEST_BUCKET, 'app/dev/1.dump', part_size=S3_MIN_PART_SIZE, concurrency=1)
+	with pytest.raises(Exception, match='Part upload failed'):
+		upload.upload_stream(io.BytesIO(os.urandom(4 * S3_MIN_PART_SIZE)))
+	upload.abort()
+
+	assert 'Uploads' not in s3.list_multipart_uploads(Bucket=TEST_BUCKET)
+
+def test_part_size_limit(s3):
+	with pytest.raises(ValueError):
+		MultipartStreamUpload(s3, TEST_BUCKET, 'app/dev/1.dump', part_size=S3_MIN_PART_SIZE - 1, concurrency=2)
+
+def test_ordered_checksum():
+	data = os.urandom(10000)
+	checksum = OrderedChecksum(hashlib.sha256(data).hexdigest(), window=len(data))
+	for start in (6000, 2000, 8000, 0, 4000):
+		checksum.update(start, data[start:start+2000])
+
+	assert checksum.matches()
+
+def test_ordered_checksum_mismatch():
+	checksum = OrderedChecksum(hashlib.sha256(b'dump').hexdigest(), window=100)
+	checksum.update(0, b'pump')
+
+	assert not checksum.matches()
+
+def test_ordered_checksum_abort_releases_waiting_ranges():
+	checksum = OrderedChecksum(hashlib.sha256(b'').hexdigest(), window=10)
+	errors = []
+	def update_ahead():
+		try:
+			checksum.update(100, b'data')
+		except Exception as err:
+			errors.append(err)
+	updater = threading.Thread(target=update_ahead)
+	updater.start()
+	checksum.abort()
+	updater.join(timeout=5)
+
+	assert not updater.is_alive() and errors
+
+def put_backup_file(s3, key, data):
+	s3.put_object(Bucket=TEST_BUCKET, Key=key, Body=data)
+	return {'key': key, 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()}
+
+def test_parallel_download(s3, tmp_path):
+	data = os.urandom(5 * 1024 * 1024 + 17)
+	put_backup_file(s3, 'app/dev/1.dump', data)
+	filepath = str(tmp_path / '1.dump')
+	progress = []
+
+	size = download_file_parallel(s3, TEST_BUCKET, 'app/dev/1.dump', filepath, part_size=1024 * 1024, concurrency=4,
+		sha256=hashlib.sha256(data).hexdigest(), progress_callback=progress.append)
+
+	assert size == sum(progress) == len(data)
+	with open(filepath, 'rb') as downloaded:
+		assert downloaded.read() == data
+
+def test_parallel_download_of_many_files(s3, tmp_path):
+	files = []
+	for index, size in enumerate([0, 1, 3 * 1024 * 1024 + 5, 1024 * 1024]):
+		file = put_backup_file(s3, 'app/dev/1/{}.dat.gz'.format(index), os.urandom(size))
+		file['filepath'] = str(tmp_path / '{}.dat.gz'.format(index))
+		files.append(file)
+
+	assert download_files_parallel(s3, TEST_BUCKET, files, part_size=1024 * 1024, concurrency=3) == sum(file['size'] for file in files)
+	for file in files:
+		with open(file['filepath'], 'rb') as downloaded:
+			assert hashlib.sha256(downloaded.read()).hexdigest() == file['sha256']
+
+def test_parallel_download_checksum_mismatch(s3, tmp_path):
+	put_backup_file(s3, 'app/dev/1.dump', os.urandom(3 * 1024 * 1024))
+
+	with pytest.raises(Exception, match='Checksum verification failed'):
+		download_file_parallel(s3, TEST_BUCKET, 'app/dev/1.dump', str(tmp_path / '1.dump'), part_size=1024 * 1024,
+			concurrency=2, sha256=hashlib.sha256(b'other').hexdigest())
+
+def test_parallel_download_of_changed_object(s3, tmp_path, monkeypatch):
+	put_backup_file(s3, 'app/dev/1.dump', os.urandom(3 * 1024 * 1024))
+	# The object gets overwritten while downloading, after its first range
+	get_object = s3.get_object
+	def overwriting_get_object(**kwargs):
+		response = get_object(**kwargs)
+		if kwargs['Range'].startswith('bytes=0-'):
+			s3.put_object(Bucket=TEST_BUCKET, Key='app/dev/1.dump', Body=os.urandom(3 * 1024 * 1024))
+		return response
+	monkeypatch.setattr(s3, 'get_object', overwriting_get_object)
+
+	with pytest.raises(Exception):
+		download_file_parallel(s3, TEST_BUCKET, 'app/dev/1.dump', str(tmp_path / '1.dump'), part_size=1024 * 1024, concurrency=1)
@@ -0,0 +1,44 @@
+import boto3
+
+from ssm_params import SSM_GET_PARAMETERS_MAX_NAMES, ParameterCache
+
+def ssm_client(monkeypatch):
+	client = boto3.client('ssm', region_name='us-east-1')
+	for index in range(15):
+		client.put_parameter(Name='/app/dev/param{}'.format(index), Value='value{}'.format(index), Type='SecureString')
+
+	requests = []
+	get_parameters = client.get_parameters
+	def counting_get_parameters(**kwargs):
+		requests.append(kwargs['Names'])
+		return get_parameters(**kwargs)
+	monkeypatch.setattr(client, 'get_parameters', counting_get_parameters)
+
+	return client, requests
+
+def test_batched_retrieval(aws, monkeypatch):
+	client, requests = ssm_client(monkeypatch)
+	names = [ '/app/dev/param{}'.format(index) for index in range(15) ] + ['/app/dev/missing']
+
+	values = ParameterCache().get_parameters(client, names)
+
+	assert values == { '/app/dev/param{}'.format(index): 'value{}'.format(index) for index in range(15) }
+	assert len(requests) == 2 and all(len(batch) <= SSM_GET_PARAMETERS_MAX_NAMES for batch in requests)
+
+def test_cached_values_and_missing_parameters(aws, monkeypatch):
+	client, requests = ssm_client(monkeypatch)
+	cache = ParameterCache()
+	cache.get_parameters(client, ['/app/dev/param0', '/app/dev/missing'])
+
+	assert cache.get_parameters(client, ['/app/dev/param0', '/app/dev/missing']) == {'/app/dev/param0': 'value0'}
+	assert cache.get_parameters(client, ['/app/dev/param0', '/app/dev/param1']) == {'/app/dev/param0': 'value0', '/app/dev/param1': 'value1'}
+	assert requests == [['/app/dev/param0', '/app/dev/missing'], ['/app/dev/param1']]
+
+def test_expired_values_get_refreshed(aws, monkeypatch):
+	client, requests = ssm_client(monkeypatch)
+	cache = ParameterCache(ttl=0)
+	cache.get_parameters(client, ['/app/dev/param0'])
+	client.put_parameter(Name='/app/dev/param0', Value='updated', Type='SecureString', Overwrite=True)
+
+	assert cache.get_parameters(client, ['/app/dev/param0']) == {'/app/dev/param0': 'updated'}
+	assert len(requests) == 2
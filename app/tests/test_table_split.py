@@ -0,0 +1,41 @@
+import pytest
+
+from table_split import get_range_condition, qualified_name, split_range
+
+@pytest.mark.parametrize('first, end, count', [(0, 100, 4), (0, 101, 4), (0, 3, 8), (-10, 10, 3), (5, 6, 4), (7, 1000003, 16)])
+def test_ranges_contiguous_and_open_ended(first, end, count):
+	ranges = split_range(first, end, count)
+
+	assert 1 <= len(ranges) <= count
+	assert ranges[0][0] is None and ranges[-1][1] is None
+	for (_, previous_end), (start, _) in zip(ranges, ranges[1:]):
+		assert previous_end == start
+	# No empty ranges
+	for start, range_end in ranges:
+		assert (start if start is not None else first) < (range_end if range_end is not None else end)
+
+def test_even_split():
+	assert split_range(0, 100, 4) == [(None, 25), (25, 50), (50, 75), (75, None)]
+
+def test_fewer_values_than_ranges():
+	assert split_range(0, 2, 4) == [(None, 1), (1, None)]
+	assert split_range(5, 6, 4) == [(None, None)]
+
+def test_single_range():
+	assert split_range(0, 100, 1) == [(None, None)]
+
+def test_ctid_condition():
+	table = {'schema': 'public', 'name': 'big', 'key': None}
+
+	assert get_range_condition(table, (None, 25)) == " WHERE ctid < '(25,0)'::tid"
+	assert get_range_condition(table, (25, 50)) == " WHERE ctid >= '(25,0)'::tid AND ctid < '(50,0)'::tid"
+	assert get_range_condition(table, (50, None)) == " WHERE ctid >= '(50,0)'::tid"
+	assert get_range_condition(table, (None, None)) == ''
+
+def test_key_condition():
+	table = {'schema': 'public', 'name': 'big', 'key': 'Id'}
+
+	assert get_range_condition(table, (-5, 10)) == ' WHERE "Id" >= -5 AND "Id" < 10'
+
+def test_qualified_name_quoting():
+	assert qualified_name({'schema': 'my schema', 'name': 'a"b'}) == '"my schema"."a""b"'
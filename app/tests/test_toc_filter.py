@@ -0,0 +1,69 @@
+from toc_filter import filter_toc, parse_toc
+
+# Verbose TOC listing (pg_restore -l -v) of a DB holding tables a and b (referencing a) and audit.log
+TOC_LINES = """;
+; Archive created at 2026-10-18 01:26:02 UTC
+;
+2557; 0 0 ENCODING - ENCODING 
+6; 2615 147481 SCHEMA - audit postgres
+218; 1259 147498 TABLE audit log postgres
+;\tdepends on: 6
+216; 1259 147482 TABLE public a postgres
+217; 1259 147487 TABLE public b postgres
+2554; 0 147498 TABLE DATA audit log postgres
+;\tdepends on: 218
+2552; 0 147482 TABLE DATA public a postgres
+;\tdepends on: 216
+2553; 0 147487 TABLE DATA public b postgres
+;\tdepends on: 217
+2404; 2606 147486 CONSTRAINT public a a_pkey postgres
+;\tdepends on: 216
+2405; 1259 147497 INDEX public b_a postgres
+;\tdepends on: 217
+2408; 2606 147492 FK CONSTRAINT public b b_a_id_fkey postgres
+;\tdepends on: 217 2404 216""".split("\n")
+
+ALL_IDS = [2557, 6, 218, 216, 217, 2554, 2552, 2553, 2404, 2405, 2408]
+
+def selected_ids(**filters):
+	return [ entry['id'] for entry in filter_toc(parse_toc(TOC_LINES), **filters) ]
+
+def test_parse_toc():
+	entries = {entry['id']: entry for entry in parse_toc(TOC_LINES)}
+
+	assert list(entries) == ALL_IDS
+	assert (entries[2552]['description'], entries[2552]['schema'], entries[2552]['name']) == ('TABLE DATA', 'public', 'a')
+	assert (entries[2408]['description'], entries[2408]['name']) == ('FK CONSTRAINT', 'b b_a_id_fkey')
+	assert entries[2408]['dependencies'] == [217, 2404, 216]
+	assert entries[216]['dependencies'] == []
+	# Entries without owner
+	assert (entries[2557]['description'], entries[2557]['name']) == ('ENCODING', 'ENCODING')
+
+def test_no_filters():
+	assert selected_ids() == ALL_IDS
+
+def test_exclude_schema_excludes_dependents():
+	assert selected_ids(exclude_schemas=['aud*']) == [2557, 216, 217, 2552, 2553, 2404, 2405, 2408]
+
+def test_include_schema():
+	assert selected_ids(include_schemas=['audit']) == [2557, 6, 218, 2554]
+
+def test_exclude_table_excludes_dependents():
+	# The foreign key of b depends on a (and its primary key)
+	assert selected_ids(exclude_tables=['a']) == [2557, 6, 218, 217, 2554, 2553, 2405]
+
+def test_include_qualified_table():
+	assert selected_ids(include_tables=['public.b']) == [2557, 6, 217, 2553, 2405]
+
+def test_exclude_table_data_drops_referencing_foreign_keys():
+	assert selected_ids(exclude_table_data=['public.a']) == [2557, 6, 218, 216, 217, 2554, 2553, 2404, 2405]
+
+def test_exclude_table_data_of_referencing_table_keeps_foreign_keys():
+	assert selected_ids(exclude_table_data=['b']) == [2557, 6, 218, 216, 217, 2554, 2552, 2404, 2405, 2408]
+
+def test_exclude_table_data_without_data_entry():
+	# Split tables (see table_split) have no TABLE DATA entry
+	lines = [ line for line in TOC_LINES if not line.startswith('2552;') ]
+	entries = filter_toc(parse_toc(lines), exclude_table_data=['a'])
+
+	assert 2408 not in [ entry['id'] for entry in entries ]
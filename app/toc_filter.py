@@ -0,0 +1,133 @@
+import logging
+import re
+from fnmatch import fnmatchcase
+
+# Archive TOC listings (pg_restore -l -v) hold one line per entry, formatted as
+#   {dump_id}; {catalog_oid} {oid} {description} {schema} {name} {owner}
+# optionally followed by a comment line listing the dump IDs the entry depends on.
+# Descriptions consisting of several words (longest first, so prefixes do not match first)
+MULTI_WORD_DESCRIPTIONS = sorted([
+	'ACCESS METHOD', 'BLOB METADATA', 'CHECK CONSTRAINT', 'DATABASE PROPERTIES', 'DEFAULT ACL', 'EVENT TRIGGER',
+	'FK CONSTRAINT', 'FOREIGN DATA WRAPPER', 'FOREIGN TABLE', 'INDEX ATTACH', 'LARGE OBJECT', 'MATERIALIZED VIEW',
+	'MATERIALIZED VIEW DATA', 'OPERATOR CLASS', 'OPERATOR FAMILY', 'PROCEDURAL LANGUAGE', 'PUBLICATION TABLE',
+	'PUBLICATION TABLES IN SCHEMA', 'ROW SECURITY', 'SECURITY LABEL', 'SEQUENCE OWNED BY', 'SEQUENCE SET', 'SHELL TYPE',
+	'STATISTICS DATA', 'SUBSCRIPTION TABLE', 'TABLE ATTACH', 'TABLE DATA', 'TEXT SEARCH CONFIGURATION',
+	'TEXT SEARCH DICTIONARY', 'TEXT SEARCH PARSER', 'TEXT SEARCH TEMPLATE', 'USER MAPPING'
+], key=len, reverse=True)
+# Entries defining a table (or table-like relation), and entries holding its data
+TABLE_DESCRIPTIONS = ('TABLE', 'VIEW', 'MATERIALIZED VIEW', 'FOREIGN TABLE')
+TABLE_DATA_DESCRIPTIONS = ('TABLE DATA', 'MATERIALIZED VIEW DATA')
+
+TOC_ENTRY_RE = re.compile(r'^(\d+); (\d+) (\d+) (.*)$')
+TOC_DEPENDENCIES_PREFIX = ';\tdepends on:'
+
+def parse_toc(toc_lines):
+	"""Parse the lines of a verbose TOC listing into a list of entries (dicts)."""
+
+	entries = []
+	for line in toc_lines:
+		if line.startswith(TOC_DEPENDENCIES_PREFIX) and entries:
+			entries[-1]['dependencies'] = [ int(dump_id) for dump_id in line[len(TOC_DEPENDENCIES_PREFIX):].split() ]
+			continue
+
+		match = TOC_ENTRY_RE.match(line)
+		if not match:
+			continue
+
+		details = match.group(4)
+		description = details.split(' ', 1)[0]
+		for multi_word_description in MULTI_WORD_DESCRIPTIONS:
+			if details.startswith(multi_word_description+' '):
+				description = multi_word_description
+				break
+
+		schema, _, name_owner = details[len(description)+1:].partition(' ')
+		# The owner is the last field (and may be empty)
+		name = name_owner.rsplit(' ', 1)[0] if ' ' in name_owner else name_owner
+
+		entries.append({
+			'id': int(match.group(1)),
+			'description': description,
+			'schema': schema,
+			'name': name,
+			'line': line,
+			'dependencies': []
+		})
+
+	return entries
+
+def matches_any(value, patterns):
+	return any(fnmatchcase(value, pattern) for pattern in patterns)
+
+def table_matches(schema, name, patterns):
+	"""Match a table against patterns, as `schema.table` when holding a '.' and as `table` otherwise."""
+
+	return any(fnmatchcase(schema+'.'+name if '.' in pattern else name, pattern) for pattern in patterns)
+
+def filter_toc(entries, include_schemas=None, exclude_schemas=None, include_tables=None, exclude_tables=None,
+               exclude_table_data=None):
+	"""
+	Filter TOC entries by schema and table (shell-style patterns, see table_matches for tables),
+	excluding all entries depending (directly or indirectly) on excluded entries as well
+	(such as indexes, constraints, sequences, comments and privileges of excluded tables).
+	Tables matching `exclude_table_data` get restored without their data,
+	along with all foreign keys referencing them from tables restored with data.
+	Returns the list of entries to restore.
+	"""
+
+	def schema_selected(schema):
+		return (not include_schemas or matches_any(schema, include_schemas))\
+		       and not matches_any(schema, exclude_schemas or [])
+
+	def table_selected(schema, name):
+		return (not include_tables or table_matches(schema, name, include_tables))\
+		       and not table_matches(schema, name, exclude_tables or [])
+
+	excluded = set()
+	data_excluded_tables = set()
+	for entry in entries:
+		if entry['description'] == 'SCHEMA':
+			if not schema_selected(entry['name']):
+				excluded.add(entry['id'])
+		elif entry['schema'] != '-' and not schema_selected(entry['schema']):
+			excluded.add(entry['id'])
+		elif entry['description'] in TABLE_DESCRIPTIONS + TABLE_DATA_DESCRIPTIONS:
+			if not table_selected(entry['schema'], entry['name']):
+				excluded.add(entry['id'])
+			# Tables matched as well, as the data of split tables is no TOC entry of its own (see table_split)
+			elif entry['description'] in ('TABLE',) + TABLE_DATA_DESCRIPTIONS\
+			     and table_matches(entry['schema'], entry['name'], exclude_table_data or []):
+				data_excluded_tables.add((entry['schema'], entry['name']))
+
+	# Exclude everything depending on excluded entries (dependencies may be listed after their dependents)
+	changed = True
+	while changed:
+		changed = False
+		for entry in entries:
+			if entry['id'] not in excluded and any(dump_id in excluded for dump_id in entry['dependencies']):
+				excluded.add(entry['id'])
+				changed = True
+
+	tables_by_id = { entry['id']: entry for entry in entries if entry['description'] in TABLE_DESCRIPTIONS }
+	selected = []
+	for entry in entries:
+		if entry['id'] in excluded:
+			continue
+
+		if entry['description'] in TABLE_DATA_DESCRIPTIONS and (entry['schema'], entry['name']) in data_excluded_tables:
+			continue
+
+		# Foreign keys (named `{table} {constraint}`) of tables with data would fail against tables without data
+		if entry['description'] == 'FK CONSTRAINT' and (entry['schema'], entry['name'].split(' ')[0]) not in data_excluded_tables:
+			referenced_tables = [ (tables_by_id[dump_id]['schema'], tables_by_id[dump_id]['name'])
+			                      for dump_id in entry['dependencies'] if dump_id in tables_by_id ]
+			if any(table in data_excluded_tables for table in referenced_tables):
+				logging.info('Skipping foreign key {} referencing a table restored without data.'.format(entry['name']))
+				continue
+
+		selected.append(entry)
+
+	logging.info('Selected {selected} of {count} TOC entries to restore ({tables} tables without data).'.format(
+		selected=len(selected), count=len(entries), tables=len(data_excluded_tables)))
+
+	return selected
@@ -12,8 +12,12 @@ class CdkInfraStack(Stack):
 	def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
 		super().__init__(scope, construct_id, **kwargs)
 
+		# All buckets backups can be stored in (as defined by s3_bucket arguments or backup bucket SSM parameters),
+		# defined as backup_buckets in the context (see cdk.json)
+		backup_buckets = self.node.try_get_context('backup_buckets')
+
 		ecs_cluster = EcsCluster(self)
-		ecs_task_def = EcsTaskDefinition(self)
+		ecs_task_def = EcsTaskDefinition(self, backup_buckets)
 		LambdaEcsTrigger(self, ecs_cluster.get_cluster_arn(), ecs_task_def.get_task_def_arn(),
 			ecs_task_def.get_container_name(), ecs_task_def.get_aws_log_url_template(),
-			ecs_task_def.get_ecs_task_detail_url_template(ecs_cluster.get_cluster_name()))
+			ecs_task_def.get_ecs_task_detail_url_template(ecs_cluster.get_cluster_name()), backup_buckets)
@@ -3,8 +3,7 @@ from aws_cdk import (
 	aws_ecs as ecs,
 	aws_ecr as ecr,
 	aws_ec2 as ec2,
-	aws_iam as iam,
-	aws_s3 as s3
+	aws_iam as iam
 )
 
 class EcsCluster:
@@ -27,10 +26,10 @@ class EcsTaskDefinition:
 
 	task_def = None
 
-	def __init__(self, scope: Stack) -> None:
+	def __init__(self, scope: Stack, backup_buckets: list) -> None:
 
-		# Find the S3 bucket to read/write backups from/to
-		s3_bucket = s3.Bucket.from_bucket_name(scope, "AgrDbBackupsBucket","agr-db-backups")
+		# The S3 buckets to read/write backups from/to
+		bucket_arns = [ 'arn:aws:s3:::'+bucket for bucket in backup_buckets ]
 
 		# Create ECS task definition
 		iam_ecr_read_policy = iam.ManagedPolicy.from_managed_policy_name(scope, "IamEcrReadPolicy", "ReadOnlyAccessECR")
@@ -59,13 +58,27 @@ class EcsTaskDefinition:
 					sid="S3BucketWriteAll",
 					effect=iam.Effect.ALLOW,
 					actions=[ 's3:Put*' ],
-					resources=[ s3_bucket.bucket_arn+'/*' ]
+					resources=[ bucket_arn+'/*' for bucket_arn in bucket_arns ]
+				),
+				iam.PolicyStatement(
+					sid="S3BucketDeleteAll",
+					effect=iam.Effect.ALLOW,
+					actions=[ 's3:DeleteObject' ],
+					resources=[ bucket_arn+'/*' for bucket_arn in bucket_arns ]
+				),
+				# Failed multipart uploads (stream, file and copy backups, storage class changes) get aborted,
+				# leaving no (billed) parts behind
+				iam.PolicyStatement(
+					sid="S3BucketAbortUploadsAll",
+					effect=iam.Effect.ALLOW,
+					actions=[ 's3:AbortMultipartUpload' ],
+					resources=[ bucket_arn+'/*' for bucket_arn in bucket_arns ]
 				),
 				iam.PolicyStatement(
 					sid="S3BucketReadAll",
 					effect=iam.Effect.ALLOW,
 					actions=[ 's3:ListBucket*', 's3:Get*' ],
-					resources=[ s3_bucket.bucket_arn, s3_bucket.bucket_arn+'/*' ]
+					resources=bucket_arns + [ bucket_arn+'/*' for bucket_arn in bucket_arns ]
 				)
 			]
 		)
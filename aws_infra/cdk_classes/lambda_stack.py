@@ -12,7 +12,7 @@ from aws_cdk import aws_events_targets
 class LambdaEcsTrigger:
 
 	def __init__(self, scope: Stack, ecs_cluster_arn: str, ecs_task_def_arn: str,
-	             container_name: str, log_url_template: str, task_details_template: str) -> None:
+	             container_name: str, log_url_template: str, task_details_template: str, backup_buckets: list) -> None:
 
 		# Create lambda function role
 		excecution_role = iam.Role(scope, "agr-db-backups-lambda-role",
@@ -23,6 +23,23 @@ class LambdaEcsTrigger:
 			]
 		)
 
+		# The trigger sizes ECS tasks by the size of the backup to process (as found in its backup catalog)
+		# and reports the progress of running tasks (as written to their status object), in any of the backup buckets
+		bucket_arns = [ 'arn:aws:s3:::'+bucket for bucket in backup_buckets ]
+		excecution_role.add_to_policy(iam.PolicyStatement(
+			sid="S3BackupCatalogRead",
+			effect=iam.Effect.ALLOW,
+			actions=[ 's3:GetObject', 's3:ListBucket' ],
+			resources=[ resource for bucket_arn in bucket_arns
+			            for resource in (bucket_arn, bucket_arn+'/*/_catalog.json', bucket_arn+'/_status/*') ]
+		))
+		excecution_role.add_to_policy(iam.PolicyStatement(
+			sid="SSMBackupBucketRead",
+			effect=iam.Effect.ALLOW,
+			actions=[ 'ssm:GetParameter' ],
+			resources=[ 'arn:aws:ssm:*:100225593120:parameter/*/db/backup/bucket' ]
+		))
+
 		# Copy helper file into lambda bundle
 		dirname = os.path.dirname(os.path.realpath(__file__))
 		shutil.copyfile(os.path.join(dirname, '..','..','app','interfaces','helper.py'),
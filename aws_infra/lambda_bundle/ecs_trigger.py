@@ -1,9 +1,31 @@
+import json
 import logging
 import os
+import time
+from datetime import datetime, timezone
 import boto3
+from botocore.exceptions import ClientError
 
 from helper import APP_DESCRIPTION, APP_OPTIONS
 
+# Fargate task size to run a backup or restore with, by (compressed) backup size.
+# Restores need local storage for the dump (and its decompressed copy, for externally compressed dumps),
+# more CPUs allow more parallel pg_dump/pg_restore workers (see dump_jobs and restore_jobs).
+# Every tier holds its maximum backup size (in GiB, None for unlimited), CPU units, memory (in MiB) and ephemeral storage (in GiB).
+TASK_SIZE_TIERS = [
+	(2,    1024, 2048,  21),
+	(10,   2048, 4096,  40),
+	(40,   4096, 8192,  100),
+	(None, 8192, 16384, 200)
+]
+GIB = 1024**3
+CATALOG_KEY = '{identifier}/{env}/_catalog.json'
+# Running tasks report their progress to a status object in the backup bucket (see the app's progress module)
+STATUS_KEY = '_status/{task_id}.json'
+# Backup bucket SSM parameters get cached (by region and name) across invocations of a warm function
+SSM_CACHE_TTL = 300
+ssm_cache = {}
+
 def lambda_handler(event, context):
 
 	log_level = 'INFO'
@@ -26,8 +48,30 @@ def lambda_handler(event, context):
 		logging.info("Help response:\n"+str(help_json))
 		return help_json
 
+	if event.get('action') == 'status':
+		response = get_task_status(event)
+		logging.info("Function response returned:\n"+str(response))
+		return response
+
 	cmd_overwrite = event_data_to_CMD(event)
 
+	task_overrides = {
+		'containerOverrides': [{
+			'name': os.environ.get('AGRDB_CONTAINER_NAME'),
+			'command': cmd_overwrite
+		}]
+	}
+
+	try:
+		bucket = get_backup_bucket(event)
+	except Exception as err:
+		logging.warning("Failed to look up backup bucket: {}".format(err))
+		bucket = None
+
+	task_size = get_task_size(event, bucket)
+	if task_size is not None:
+		task_overrides.update(task_size)
+
 	ecs_client = boto3.client('ecs')
 	ecs_response = ecs_client.run_task(
 		count=1,
@@ -40,12 +84,7 @@ def lambda_handler(event, context):
 				'assignPublicIp': 'DISABLED'
 			}
 		},
-		overrides = {
-			'containerOverrides': [{
-				'name': os.environ.get('AGRDB_CONTAINER_NAME'),
-				'command': cmd_overwrite
-			}]
-		},
+		overrides = task_overrides,
 		taskDefinition = os.environ.get('AGRDB_ECS_TASK_DEF')
 	)
 
@@ -56,6 +95,11 @@ def lambda_handler(event, context):
 	task_details_url = os.environ.get('AGRDB_ECS_TASK_DETAILS_URL_TEMPLATE').format(task_short_name)
 
 	response = { 'initiated_task_arn': task_arn, 'task_logs_url': task_logs_url, 'task_details_url': task_details_url }
+	if task_size is not None:
+		response['task_size'] = task_size
+	# Payload to invoke this function with to follow up on the task's progress
+	if bucket is not None and event.get('action') in ('backup', 'restore', 'copy'):
+		response['status_payload'] = { 'action': 'status', 'task_id': task_short_name, 's3_bucket': bucket }
 
 	logging.info("Function response returned:\n"+str(response))
 
@@ -68,6 +112,139 @@ def event_data_to_CMD(event_data):
 	CMD = []
 	for key, value in event_data.items():
 		CMD.append('--'+key)
-		CMD.append(value)
+		# Structured values (like batch_jobs) are passed on as JSON
+		if isinstance(value, str):
+			CMD.append(value)
+		else:
+			CMD.append(json.dumps(value))
 
 	return CMD
+
+def get_backup_env(event):
+	"""Return the env the backups are read from (the src_env for restores) or written to (the src_env for copies)."""
+
+	if event.get('action') in ('restore', 'copy'):
+		return event.get('src_env') or 'production'
+	if event.get('action') == 'status':
+		return event.get('src_env') or event.get('target_env') or 'dev'
+
+	return event.get('target_env') or 'dev'
+
+def get_backup_bucket(event):
+	"""
+	Return the backup bucket of the identifier and env (as defined in the event, or in SSM),
+	or None when no identifier is defined.
+	"""
+
+	if event.get('s3_bucket'):
+		return event['s3_bucket']
+
+	identifier = event.get('identifier')
+	if not identifier:
+		return None
+
+	region = event.get('region') or 'us-east-1'
+	param_name = '/{identifier}/{env}/db/backup/bucket'.format(identifier=identifier, env=get_backup_env(event))
+	cached = ssm_cache.get((region, param_name))
+	if cached is not None and cached[1] > time.monotonic():
+		return cached[0]
+
+	ssm_client = boto3.client('ssm', region_name=region)
+	param = ssm_client.get_parameter(Name=param_name, WithDecryption=True)
+	ssm_cache[(region, param_name)] = (param['Parameter']['Value'], time.monotonic() + SSM_CACHE_TTL)
+
+	return param['Parameter']['Value']
+
+def find_backup_size(event, bucket):
+	"""
+	Find the size (in bytes) of the backup to restore (or, for backups, of the latest backup),
+	from the backup catalog of the identifier and env in `bucket`. Returns None when not found.
+	"""
+
+	identifier = event.get('identifier')
+	if not identifier or not bucket:
+		return None
+
+	env = get_backup_env(event)
+	timestamp = ''
+	if event.get('action') == 'restore':
+		timestamp = event.get('restore_timestamp') or ''
+
+	region = event.get('region') or 'us-east-1'
+	s3_client = boto3.client('s3', region_name=region)
+	try:
+		response = s3_client.get_object(Bucket=bucket, Key=CATALOG_KEY.format(identifier=identifier, env=env))
+	except ClientError as err:
+		if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+			return None
+		raise
+	catalog = json.loads(response['Body'].read())
+
+	# Latest backup (catalog entries are sorted by timestamp) matching the timestamp prefix
+	for entry in reversed(catalog['backups']):
+		if entry['timestamp'].startswith(timestamp):
+			return entry.get('size')
+
+	return None
+
+def get_task_size(event, bucket):
+	"""
+	Choose the (cpu, memory and ephemeral storage) task overrides for a backup or restore
+	from TASK_SIZE_TIERS, by backup size. Returns None to run with the task definition defaults
+	(for other actions, or when the backup size is unknown).
+	"""
+
+	if event.get('action') not in ('backup', 'restore'):
+		return None
+
+	try:
+		backup_size = find_backup_size(event, bucket)
+	except Exception as err:
+		logging.warning("Failed to look up backup size, running with default task size: {}".format(err))
+		return None
+
+	if backup_size is None:
+		logging.info("Backup size unknown, running with default task size.")
+		return None
+
+	for max_size, cpu, memory, storage in TASK_SIZE_TIERS:
+		if max_size is None or backup_size <= max_size*GIB:
+			break
+
+	logging.info("Backup size {size} bytes, running with {cpu} CPU units, {memory} MiB memory and {storage} GiB storage.".format(
+		size=backup_size, cpu=cpu, memory=memory, storage=storage))
+
+	return {
+		'cpu': str(cpu),
+		'memory': str(memory),
+		'ephemeralStorage': { 'sizeInGiB': storage }
+	}
+
+def get_task_status(event):
+	"""
+	Read the status object of a (running or completed) backup or restore task,
+	identified by `task_id` (the task ID or ARN) and found in the backup bucket (see get_backup_bucket).
+	Returns the progress of all phases of the task, along with the number of seconds since its last update
+	(which should not exceed its progress_interval by much, unless the task stalled or was stopped).
+	"""
+
+	if not event.get('task_id'):
+		return { 'err_msg': "Missing input argument task_id" }
+
+	task_id = event['task_id'].split('/').pop()
+	bucket = get_backup_bucket(event)
+	if bucket is None:
+		return { 'err_msg': "Missing input argument s3_bucket (or identifier, to find the backup bucket)" }
+
+	s3_client = boto3.client('s3', region_name=event.get('region') or 'us-east-1')
+	try:
+		response = s3_client.get_object(Bucket=bucket, Key=STATUS_KEY.format(task_id=task_id))
+	except ClientError as err:
+		if err.response['Error']['Code'] in ('NoSuchKey', '404'):
+			return { 'err_msg': "No status found for task {task_id} in bucket {bucket}.".format(task_id=task_id, bucket=bucket) }
+		raise
+	status = json.loads(response['Body'].read())
+
+	status['seconds_since_update'] = round((datetime.now(timezone.utc) - datetime.fromisoformat(status['updated'])).total_seconds())
+
+	return status
@@ -0,0 +1,72 @@
+import logging
+
+import psycopg2
+from psycopg2 import sql
+
+# Synthetic dataset sizes (in MB of table data), selectable by name
+DATASET_SIZES = {
+	'small':  50,
+	'medium': 500,
+	'large':  5000
+}
+
+# Synthetic dataset shapes, as a list of (table count, share of the dataset size) tuples
+DATASET_SHAPES = {
+	# A few huge tables, each dumped by a single pg_dump worker
+	'few_huge':   [(2, 1.0)],
+	# One dominant table along with a set of medium tables
+	'mixed':      [(1, 0.6), (50, 0.4)],
+	# Thousands of small tables, dominated by per-object overhead
+	'many_small': [(2000, 1.0)]
+}
+
+# Approximate on-disk size of a generated row (tuple header and all columns)
+ROW_SIZE = 160
+
+def get_dataset_size(size):
+	"""Return the size (in MB) of a dataset size name, or of a size given in MB."""
+
+	if size in DATASET_SIZES:
+		return DATASET_SIZES[size]
+
+	return int(size)
+
+def generate_dataset(connection_args, db_name, shape, size_mb):
+	"""
+	(Re)create DB `db_name` and fill it with synthetic tables of the given shape,
+	totalling approximately `size_mb` MB of table data.
+	Returns the number of tables created and the resulting DB size (in bytes).
+	"""
+
+	admin_connection = psycopg2.connect(dbname='postgres', **connection_args)
+	admin_connection.autocommit = True
+	with admin_connection.cursor() as cursor:
+		cursor.execute(sql.SQL('DROP DATABASE IF EXISTS {}').format(sql.Identifier(db_name)))
+		cursor.execute(sql.SQL('CREATE DATABASE {}').format(sql.Identifier(db_name)))
+	admin_connection.close()
+
+	connection = psycopg2.connect(dbname=db_name, **connection_args)
+	table_count = 0
+	with connection, connection.cursor() as cursor:
+		for group_index, (tables, share) in enumerate(DATASET_SHAPES[shape]):
+			rows = max(1, int(size_mb * 1024 * 1024 * share / tables / ROW_SIZE))
+			logging.info('Generating {tables} tables of {rows} rows...'.format(tables=tables, rows=rows))
+			for table_index in range(tables):
+				table_name = 'bench_{}_{}'.format(group_index, table_index)
+				cursor.execute(sql.SQL('CREATE TABLE {} (id bigint PRIMARY KEY, created timestamptz,'
+				                       ' label text, amount numeric, payload text)').format(sql.Identifier(table_name)))
+				# Partially repetitive content, compressing like typical application data
+				cursor.execute(sql.SQL('INSERT INTO {} SELECT i, now() - i * interval \'1 second\', md5(i::text),'
+				                       ' (i %% 10000) / 100.0, repeat(chr(65 + i %% 26), 40) || md5((i %% 1000)::text)'
+				                       ' FROM generate_series(1, %s) AS i').format(sql.Identifier(table_name)), (rows,))
+				table_count += 1
+
+	with connection.cursor() as cursor:
+		cursor.execute('SELECT pg_database_size(current_database())')
+		db_size = cursor.fetchone()[0]
+	connection.close()
+
+	logging.info('Generated dataset {shape}/{size}MB as DB {db} ({tables} tables, {db_size} bytes).'.format(
+		shape=shape, size=size_mb, db=db_name, tables=table_count, db_size=db_size))
+
+	return table_count, db_size
@@ -0,0 +1,237 @@
+"""
+End-to-end backup and restore benchmarks, against a local postgres server
+and a local S3/SSM stand-in (moto server).
+Reports per-phase timings, bytes and throughput as JSON.
+"""
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from optparse import OptionParser
+
+import psycopg2
+from psycopg2 import sql
+
+from datasets import DATASET_SHAPES, generate_dataset, get_dataset_size
+
+APP_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'app')
+
+BENCHMARK_IDENTIFIER = 'benchmark'
+BENCHMARK_SOURCE_DB = 'bench_source'
+BENCHMARK_TARGET_DB = 'bench_target'
+
+# Backup configurations to benchmark, by name
+BACKUP_CONFIGS = {
+	'file':           {'backup_mode': 'file'},
+	'directory':      {'backup_mode': 'file', 'backup_format': 'directory'},
+	'stream':         {'backup_mode': 'stream'},
+	'stream_zstd':    {'backup_mode': 'stream', 'compression': 'zstd'},
+	'stream_lz4':     {'backup_mode': 'stream', 'compression': 'lz4'},
+	'dedup':          {'backup_mode': 'dedup'},
+	# Transfer tuning (applied to the restore download as well)
+	'stream_c8':      {'backup_mode': 'stream', 'transfer_concurrency': '8', 'transfer_part_size': '16'},
+	'directory_c8':   {'backup_mode': 'file', 'backup_format': 'directory', 'transfer_concurrency': '8', 'transfer_threshold': '8'},
+	# Tables of 16 MiB or more dumped and restored in ranges by parallel workers
+	'directory_split': {'backup_mode': 'file', 'backup_format': 'directory', 'split_table_size': '16'}
+}
+# Backup configuration options applying to restores as well
+TRANSFER_OPTIONS = ('transfer_part_size', 'transfer_concurrency', 'transfer_threshold', 's3_pool_size')
+# Number of runs to take the median startup time of
+STARTUP_RUNS = 5
+
+def get_phases(run, action):
+	"""Return the timing, bytes and throughput of every phase recorded for an action, by phase (path)."""
+
+	phases = {}
+	for span in run.summary()['spans']:
+		if span['phase'] == action or span['phase'].startswith(action+'/'):
+			phase = dict(seconds=span['duration'], status=span['status'])
+			if 'bytes' in span:
+				phase.update(bytes=span['bytes'], mb_per_s=span['mb_per_s'])
+			phases[span['phase']] = phase
+
+	return phases
+
+def run_backup(app, db_options, backup_options):
+	db_args = dict(db_options, action='backup', identifier=BENCHMARK_IDENTIFIER, target_env='bench',
+	               db_name=BENCHMARK_SOURCE_DB, **backup_options)
+	args_response = app.get_args_dict(db_args, app.SSM_ARG_PARAMS, app.SSM_OPTIONAL_ARG_PARAMS)
+	if 'err_msg' in args_response:
+		raise Exception(args_response['err_msg'])
+
+	# Backups are keyed by timestamp (in seconds), ensure every backup gets a new key
+	time.sleep(1)
+
+	run = app.metrics.start_run('backup', identifier=BENCHMARK_IDENTIFIER, env='bench')
+	response = app.backup_postgres_to_s3(args_response['db_args'])
+	if 'err_msg' in response:
+		raise Exception(response['err_msg'])
+
+	s3_client = app.get_boto3_client('s3')
+	catalog, _ = app.load_catalog(s3_client, db_options['s3_bucket'], app.get_catalog_key(BENCHMARK_IDENTIFIER, 'bench'))
+
+	return catalog['backups'][-1], get_phases(run, 'backup')
+
+def run_restore(app, connection_args, db_options, backup, backup_options):
+	# Restores replace an existing target DB
+	admin_connection = psycopg2.connect(dbname='postgres', **connection_args)
+	admin_connection.autocommit = True
+	with admin_connection.cursor() as cursor:
+		cursor.execute(sql.SQL('DROP DATABASE IF EXISTS {}').format(sql.Identifier(BENCHMARK_TARGET_DB)))
+		cursor.execute(sql.SQL('CREATE DATABASE {}').format(sql.Identifier(BENCHMARK_TARGET_DB)))
+	admin_connection.close()
+
+	db_args = dict(db_options, action='restore', identifier=BENCHMARK_IDENTIFIER, src_env='bench', target_env='bench',
+	               db_name=BENCHMARK_TARGET_DB, restore_timestamp=backup['timestamp'], ignore_privileges='true',
+	               **{ option: value for option, value in backup_options.items() if option in TRANSFER_OPTIONS })
+	args_response = app.get_args_dict(db_args, app.SSM_ARG_PARAMS, app.SSM_OPTIONAL_ARG_PARAMS)
+	if 'err_msg' in args_response:
+		raise Exception(args_response['err_msg'])
+
+	run = app.metrics.start_run('restore', identifier=BENCHMARK_IDENTIFIER, env='bench')
+	response = app.restore_s3_to_postgres(args_response['db_args'])
+	if 'err_msg' in response:
+		raise Exception(response['err_msg'])
+
+	return get_phases(run, 'restore')
+
+def measure_startup(runs=STARTUP_RUNS):
+	"""
+	Measure the application startup time (median of `runs` runs, in seconds),
+	for printing the help text and for importing the application module.
+	"""
+
+	commands = {
+		'help_seconds': [sys.executable, 'app.py', '--help'],
+		'import_seconds': [sys.executable, '-c', 'import app']
+	}
+
+	startup = {}
+	for name, command in commands.items():
+		durations = []
+		for _ in range(runs):
+			start = time.monotonic()
+			subprocess.run(command, cwd=APP_DIR, stdout=subprocess.DEVNULL, check=True)
+			durations.append(time.monotonic() - start)
+		startup[name] = round(statistics.median(durations), 3)
+
+	return startup
+
+def start_moto_server(port):
+	from moto.server import ThreadedMotoServer
+
+	server = ThreadedMotoServer(port=port)
+	server.start()
+
+	return server
+
+def get_options():
+	parser = OptionParser(description='Run end-to-end backup and restore benchmarks and report the results as JSON.')
+	parser.add_option('--db_host', default='localhost', help='Host of the local postgres server to benchmark against. Defaults to localhost.')
+	parser.add_option('--db_port', default='5432', help='Port of the local postgres server. Defaults to 5432.')
+	parser.add_option('--db_user', default='postgres', help='Postgres (super)user to connect as. Defaults to postgres.')
+	parser.add_option('--db_password', default='postgres', help='Password of the postgres user. Defaults to postgres.')
+	parser.add_option('--s3_endpoint', help='Endpoint URL of a running S3/SSM stand-in.'+
+	                  ' Defaults to starting a moto server on port 5000.')
+	parser.add_option('--s3_bucket', default='agr-db-backups-benchmark', help='Bucket to store backups in (created when missing).')
+	parser.add_option('--sizes', default='small', help='Comma-separated dataset sizes, as size names (small, medium, large) or in MB.'+
+	                  ' Defaults to small.')
+	parser.add_option('--shapes', default=','.join(DATASET_SHAPES),
+	                  help='Comma-separated dataset shapes ({}). Defaults to all.'.format(', '.join(DATASET_SHAPES)))
+	parser.add_option('--configs', default='file,stream,dedup',
+	                  help='Comma-separated backup configurations ({}). Defaults to file, stream and dedup.'.format(', '.join(BACKUP_CONFIGS)))
+	parser.add_option('--skip_restore', action='store_true', default=False, help='Only benchmark backups.')
+	parser.add_option('--output', help='File to write the JSON results to. Defaults to STDOUT.')
+	parser.add_option('--loglevel', default='WARNING', help='Log level of the benchmarked application. Defaults to WARNING.')
+
+	(options, args) = parser.parse_args()
+
+	return options
+
+def main():
+	options = get_options()
+
+	logging.basicConfig(level=options.loglevel.upper())
+
+	moto_server = None
+	if options.s3_endpoint is None:
+		moto_server = start_moto_server(5000)
+		options.s3_endpoint = 'http://localhost:5000'
+
+	os.environ['AWS_ENDPOINT_URL'] = options.s3_endpoint
+	os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+	os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+	os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+	# Import the application only once the AWS endpoint is configured
+	sys.path.insert(0, APP_DIR)
+	import app
+
+	s3_client = app.get_boto3_client('s3')
+	try:
+		s3_client.create_bucket(Bucket=options.s3_bucket)
+	except s3_client.exceptions.BucketAlreadyOwnedByYou:
+		pass
+
+	connection_args = {'host': options.db_host, 'port': options.db_port, 'user': options.db_user, 'password': options.db_password}
+	# The application's pg tools and connections pick up the port through the environment
+	os.environ['PGPORT'] = options.db_port
+	db_options = {'db_host': options.db_host, 'db_user': options.db_user, 'db_password': options.db_password,
+	              's3_bucket': options.s3_bucket, 'region': 'us-east-1'}
+
+	report = {
+		'started': datetime.now().isoformat(timespec='seconds'),
+		'environment': {
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'cpus': app.get_cpu_count(),
+			'memory': app.get_memory_limit()
+		},
+		'startup': measure_startup(),
+		'results': []
+	}
+
+	try:
+		for size in options.sizes.split(','):
+			size_mb = get_dataset_size(size)
+			for shape in options.shapes.split(','):
+				generation_start = time.monotonic()
+				table_count, db_size = generate_dataset(connection_args, BENCHMARK_SOURCE_DB, shape, size_mb)
+				generation_seconds = time.monotonic() - generation_start
+
+				for config in options.configs.split(','):
+					result = {
+						'dataset': {'shape': shape, 'size_mb': size_mb, 'tables': table_count, 'db_size': db_size,
+						            'generation_seconds': round(generation_seconds, 3)},
+						'config': config,
+						'options': BACKUP_CONFIGS[config]
+					}
+					logging.warning('Benchmarking {config} on dataset {shape}/{size}MB...'.format(config=config, shape=shape, size=size_mb))
+					try:
+						backup, result['backup'] = run_backup(app, db_options, BACKUP_CONFIGS[config])
+						if not options.skip_restore:
+							result['restore'] = run_restore(app, connection_args, db_options, backup, BACKUP_CONFIGS[config])
+					except Exception as err:
+						logging.error('Benchmark {config} on dataset {shape}/{size}MB failed: {err}'.format(
+							config=config, shape=shape, size=size_mb, err=err))
+						result['error'] = str(err)
+
+					report['results'].append(result)
+	finally:
+		if moto_server is not None:
+			moto_server.stop()
+
+	report_json = json.dumps(report, indent=2)
+	if options.output:
+		with open(options.output, 'w') as output_file:
+			output_file.write(report_json+"\n")
+	else:
+		print(report_json)
+
+if __name__ == '__main__':
+	main()